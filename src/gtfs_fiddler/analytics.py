@@ -0,0 +1,129 @@
+"""
+Headway and service gap statistics of a feed, e.g. to verify the results of fiddling
+by comparing the statistics before (`GtfsFiddler._original_feed`) and after.
+
+All statistics are computed in one vectorized pass over the departures sorted
+by route_id, direction_id (stop_id) and departure time.
+Statistics are either per route and direction (`level="route"`, based on
+the departure at the first stop of each trip like `GtfsFiddler.trips_enriched`)
+or per route, direction and stop (`level="stop"`).
+"""
+
+from __future__ import annotations
+
+import math
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from gtfs_fiddler.gtfs_time import GtfsTime, to_seconds
+
+if TYPE_CHECKING:
+    from gtfs_kit.feed import Feed
+
+LEVELS = ("route", "stop")
+ROUTE_KEYS = ["route_id", "direction_id"]
+
+
+def _keys(level: str) -> list[str]:
+    if level not in LEVELS:
+        raise ValueError(f"level must be one of {LEVELS} but got {level}")
+    return ROUTE_KEYS if level == "route" else ROUTE_KEYS + ["stop_id"]
+
+
+def _to_gtfs_time(seconds: pd.Series) -> pd.Series:
+    return seconds.apply(lambda v: math.nan if math.isnan(v) else GtfsTime(v))
+
+
+def departures(feed: Feed, level: str = "route") -> DataFrame:
+    """
+    Departures (in seconds of day) with the keys of the given level
+    and the headway to the previous departure of the same key (NaN for the first),
+    sorted by keys and departure.
+    Stop times without departure time are ignored.
+    """
+    keys = _keys(level)
+    st = feed.stop_times[["trip_id", "stop_sequence", "stop_id", "departure_time"]]
+    if level == "route":
+        st = st.sort_values(["trip_id", "stop_sequence"]).drop_duplicates("trip_id")
+    trips = feed.trips.set_index("trip_id")
+    df = DataFrame(
+        {
+            "trip_id": st.trip_id.to_numpy(),
+            "route_id": st.trip_id.map(trips.route_id).to_numpy(),
+            "direction_id": (
+                st.trip_id.map(trips.direction_id).to_numpy()
+                if "direction_id" in trips.columns
+                else math.nan
+            ),
+            "stop_id": st.stop_id.to_numpy(),
+            "departure": to_seconds(st.departure_time),
+        }
+    )
+    df = df[df.departure.notna()].sort_values(keys + ["departure"], kind="stable")
+    df = df.reset_index(drop=True)[["trip_id"] + keys + ["departure"]]
+
+    # sorted, so a new key starts wherever the group number changes
+    group = df.groupby(keys, sort=False, dropna=False).ngroup().to_numpy()
+    headway = np.diff(df.departure.to_numpy(), prepend=math.nan)
+    headway[np.diff(group, prepend=-1) != 0] = math.nan
+    df["headway"] = headway
+    return df
+
+
+def headway_stats(feed: Feed, level: str = "route") -> DataFrame:
+    """
+    Number of departures, first and last departure and
+    min / median / max headway (i.e. the largest service gap) per key.
+    Times are returned as `GtfsTime` (NaN headways for keys with a single departure).
+    """
+    keys = _keys(level)
+    df = departures(feed, level).groupby(keys, dropna=False)
+    stats = df.agg(
+        num_departures=("departure", "size"),
+        first_departure=("departure", "min"),
+        last_departure=("departure", "max"),
+        min_headway=("headway", "min"),
+        median_headway=("headway", "median"),
+        max_headway=("headway", "max"),
+    ).reset_index()
+    for col in stats.columns[len(keys) + 1 :]:
+        stats[col] = _to_gtfs_time(stats[col])
+    return stats
+
+
+def trips_per_hour(feed: Feed, level: str = "route") -> DataFrame:
+    """
+    Histogram of departures per hour of day: one row per key,
+    one column per hour (0 up to the latest hour of the feed, which may exceed 23).
+    """
+    keys = _keys(level)
+    df = departures(feed, level)
+    if len(df) == 0:
+        return DataFrame(columns=keys)
+    hour = (df.departure // 3600).astype(int).rename("hour")
+    histogram = df.groupby(keys + [hour], dropna=False).size().unstack(fill_value=0)
+    histogram = histogram.reindex(columns=range(hour.max() + 1), fill_value=0)
+    histogram.columns.name = None
+    return histogram.reset_index()
+
+
+def service_gaps(feed: Feed, minutes: int, level: str = "route") -> DataFrame:
+    """
+    All headways longer than the given number of minutes,
+    with the departures before and after the gap (as `GtfsTime`).
+    """
+    keys = _keys(level)
+    df = departures(feed, level)
+    gaps = df[df.headway > minutes * 60]
+    gaps = DataFrame(
+        {
+            **{k: gaps[k].to_numpy() for k in keys},
+            "gap_start": _to_gtfs_time(gaps.departure - gaps.headway).to_numpy(),
+            "gap_end": _to_gtfs_time(gaps.departure).to_numpy(),
+            "gap": _to_gtfs_time(gaps.headway).to_numpy(),
+        }
+    )
+    return gaps
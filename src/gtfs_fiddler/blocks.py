@@ -0,0 +1,186 @@
+"""
+Vehicle blocks of trips added by fiddling (see `GtfsFiddler.assign_blocks`).
+
+The added trips are copies of existing trips, including their `block_id`,
+i.e. the same vehicle would serve both trips at once. Instead they are
+assigned to existing blocks with enough time between their trips or to new blocks
+in a single sorted sweep over the added trips (by start time) with
+
+- a heap of the free time spans of all blocks (by start of the span), and
+- a sorted list of the free spans that started already (by end of the span)
+  to find the span ending first that still fits the trip (bisect),
+  and among these the one starting last (i.e. with the shortest idle time).
+
+Only the time is considered (no deadheading between the end and the start stop),
+and trips are only assigned to blocks of the same route type.
+Like `GtfsFiddler.ensure_max_trip_interval` this only works reliably
+if the feed was reduced to a single day.
+"""
+
+from __future__ import annotations
+
+import bisect
+import heapq
+import math
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame, Series
+
+from gtfs_fiddler import kernels
+from gtfs_fiddler.gtfs_time import to_seconds
+
+if TYPE_CHECKING:
+    from gtfs_kit.feed import Feed
+
+NEW_BLOCK_PREFIX = "fiddle_block_"
+
+
+@dataclass(frozen=True)
+class VehicleCount:
+    """
+    `blocks`: number of blocks, i.e. vehicles serving trips with a `block_id`.
+    `unblocked_trips`: trips without `block_id` (each requires its own vehicle).
+    `peak`: max number of trips in service at the same time (a lower bound
+    for the number of vehicles).
+    """
+
+    blocks: int
+    unblocked_trips: int
+    peak: int
+
+    @property
+    def vehicles(self) -> int:
+        return self.blocks + self.unblocked_trips
+
+
+def trip_spans(feed: Feed) -> DataFrame:
+    """
+    One row per trip (with stop times) with route_type, block_id (NaN if missing)
+    and the time span the trip occupies its vehicle in seconds of day:
+    from the first departure (or arrival) to the last arrival (or departure),
+    NaN if missing.
+    """
+    st = feed.stop_times.sort_values(["trip_id", "stop_sequence"])
+    boundaries = kernels.trip_boundaries(st.trip_id.to_numpy())
+    arrival = to_seconds(st.arrival_time)
+    departure = to_seconds(st.departure_time)
+    first, last = boundaries[:-1], boundaries[1:] - 1
+    spans = DataFrame(
+        {
+            "trip_id": st.trip_id.to_numpy()[first],
+            "start": np.where(
+                np.isnan(departure[first]), arrival[first], departure[first]
+            ),
+            "end": np.where(np.isnan(arrival[last]), departure[last], arrival[last]),
+        }
+    )
+    trips = feed.trips.set_index("trip_id")
+    route_types = feed.routes.set_index("route_id").route_type
+    spans["route_type"] = spans.trip_id.map(trips.route_id).map(route_types)
+    spans["block_id"] = (
+        spans.trip_id.map(trips.block_id) if "block_id" in trips.columns else math.nan
+    )
+    return spans
+
+
+def _free_spans(spans: DataFrame, min_layover_seconds: float) -> list[tuple]:
+    """
+    (start, end, block_id) of the times each block is not in service,
+    including the time before its first and after its last trip
+    """
+    if len(spans) == 0:
+        return []
+    spans = spans.sort_values(["block_id", "start"])
+    block_ids = spans.block_id.to_numpy()
+    starts = spans.start.to_numpy() - min_layover_seconds
+    ends = spans.end.to_numpy() + min_layover_seconds
+    is_first = np.concatenate([[True], block_ids[1:] != block_ids[:-1]])
+    is_last = np.concatenate([block_ids[1:] != block_ids[:-1], [True]])
+    free_start = np.where(is_first, -math.inf, np.roll(ends, 1))
+    free = list(zip(free_start, starts, block_ids))
+    free.extend(
+        zip(ends[is_last], np.full(is_last.sum(), math.inf), block_ids[is_last])
+    )
+    return [(s, e, b) for s, e, b in free if s <= e]
+
+
+def _sweep(
+    trips: DataFrame, free: list[tuple], min_layover_seconds: float, new_block_ids
+) -> list:
+    """
+    Assign the trips (sorted by start) to free spans or new blocks,
+    returns the block id per trip.
+    """
+    pending = list(free)
+    heapq.heapify(pending)
+    # (end, -start, block_id) of free spans starting before the current trip
+    started = []
+    assigned = []
+    for start, end in zip(trips.start.to_numpy(), trips.end.to_numpy()):
+        while pending and pending[0][0] <= start:
+            free_start, free_end, block_id = heapq.heappop(pending)
+            bisect.insort(started, (free_end, -free_start, block_id))
+        # spans ending before the trip starts can't fit any later trip either
+        del started[: bisect.bisect_left(started, (start,))]
+        i = bisect.bisect_left(started, (end,))
+        if i < len(started):
+            free_end, _, block_id = started.pop(i)
+        else:
+            free_end, block_id = math.inf, next(new_block_ids)
+        assigned.append(block_id)
+        heapq.heappush(pending, (end + min_layover_seconds, free_end, block_id))
+    return assigned
+
+
+def assign_blocks(
+    feed: Feed, trip_ids: Series, min_layover_seconds: float = 0
+) -> Series:
+    """
+    Block ids for the given trips (trip_id -> block_id), see module docs.
+    The current block ids of these trips are ignored, the other trips
+    keep their blocks. Trips without times get no block (NaN).
+    """
+    spans = trip_spans(feed)
+    is_assigned = spans.trip_id.isin(trip_ids)
+    existing = spans[~is_assigned & spans.block_id.notna() & spans.start.notna()]
+    to_assign = spans[is_assigned & spans.start.notna() & spans.end.notna()]
+
+    used = set(spans.block_id.dropna())
+    counter = (f"{NEW_BLOCK_PREFIX}{i}" for i in range(len(spans) + len(used) + 1))
+    new_block_ids = (b for b in counter if b not in used)
+
+    block_ids = Series(math.nan, index=pd.Index(trip_ids, name="trip_id"), dtype=object)
+    for route_type, trips in to_assign.groupby("route_type", dropna=False):
+        blocks = existing[
+            (
+                existing.route_type.isna()
+                if pd.isna(route_type)
+                else existing.route_type == route_type
+            )
+        ]
+        trips = trips.sort_values(["start", "end"])
+        free = _free_spans(blocks, min_layover_seconds)
+        assigned = _sweep(trips, free, min_layover_seconds, new_block_ids)
+        block_ids[trips.trip_id.to_numpy()] = assigned
+    return block_ids
+
+
+def vehicle_count(feed: Feed) -> VehicleCount:
+    """
+    Vehicles required by the feed, see `VehicleCount`
+    """
+    spans = trip_spans(feed)
+    spans = spans[spans.start.notna() & spans.end.notna()]
+    # trips ending at the same time another trip starts are not in service together
+    times = np.concatenate([spans.start.to_numpy(), spans.end.to_numpy()])
+    changes = np.concatenate([np.ones(len(spans)), -np.ones(len(spans))])
+    order = np.lexsort((changes, times))
+    peak = int(np.cumsum(changes[order]).max()) if len(spans) > 0 else 0
+    return VehicleCount(
+        blocks=spans.block_id.nunique(),
+        unblocked_trips=int(spans.block_id.isna().sum()),
+        peak=peak,
+    )
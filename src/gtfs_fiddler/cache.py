@@ -0,0 +1,195 @@
+"""
+Content-addressed cache of fiddle results on local disk
+(see `play_the_fiddle.py --cache-dir`).
+
+Entries are keyed by a hash of everything the result depends on: the content
+of the input feed, the date, the distance unit, the steps, the library versions
+and the source code of gtfs_fiddler (so that a code change altering results
+never serves stale entries, even without a version bump).
+Two kinds of entries are stored:
+
+- the input feed restricted to the date (pickled), which is reused
+  when only the steps (e.g. interval or departure targets) differ, and
+- the output GTFS zip per steps, which is simply copied on a hit.
+
+The cache is limited by size: entries are evicted least recently used first
+(by modification time, which is updated on each hit).
+
+The cached feeds are unpickled, i.e. loading them can execute arbitrary code:
+only use a cache directory that is writable by trusted users only.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import pickle
+import uuid
+from collections.abc import Callable
+from datetime import date
+from functools import lru_cache
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from gtfs_fiddler import feed_io
+
+if TYPE_CHECKING:
+    from gtfs_kit.feed import Feed
+
+logger = logging.getLogger(__name__)
+
+FEED_SUFFIX = ".feed.pickle"
+RESULT_SUFFIX = ".zip"
+
+
+def _version(package: str) -> str:
+    try:
+        return version(package)
+    except PackageNotFoundError:
+        return "unknown"
+
+
+@lru_cache(maxsize=1)
+def source_digest() -> str:
+    """
+    sha256 of the source files of gtfs_fiddler, part of all cache keys
+    """
+    h = hashlib.sha256()
+    for p in sorted(Path(__file__).parent.rglob("*.py")):
+        h.update(p.relative_to(Path(__file__).parent).as_posix().encode())
+        h.update(b"\0")
+        h.update(p.read_bytes())
+    return h.hexdigest()
+
+
+def library_versions() -> tuple[str, str, str]:
+    """
+    Versions of gtfs-fiddler (and its source digest) and gtfs-kit,
+    part of all cache keys
+    """
+    return _version("gtfs-fiddler"), source_digest(), _version("gtfs-kit")
+
+
+def file_digest(p: Path) -> str:
+    """
+    sha256 of the file's content
+    """
+    with open(p, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+class ResultCache:
+    """
+    Files in a directory, named by key and suffix, limited to `max_bytes` in total.
+    The directory must only be writable by trusted users (see module docs).
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(*parts) -> str:
+        """
+        Hash of the (string representation of the) parts and the library versions
+        (see `library_versions`)
+        """
+        h = hashlib.sha256()
+        for part in (*library_versions(), *parts):
+            h.update(str(part).encode())
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def _path(self, key: str, suffix: str) -> Path:
+        return self.directory / f"{key}{suffix}"
+
+    def get(self, key: str, suffix: str) -> Path | None:
+        """
+        Path of the entry (marked as recently used) or None if not cached
+        """
+        p = self._path(key, suffix)
+        try:
+            os.utime(p)
+        except FileNotFoundError:
+            return None
+        return p
+
+    def put(self, key: str, suffix: str, write: Callable[[Path], None]) -> Path:
+        """
+        Store an entry written by `write` (to a temporary path which is then renamed,
+        i.e. concurrent readers never see incomplete entries) and evict old entries.
+        """
+        p = self._path(key, suffix)
+        tmp = self.directory / f".{uuid.uuid4().hex}{suffix}.tmp"
+        try:
+            write(tmp)
+            os.replace(tmp, p)
+        finally:
+            tmp.unlink(missing_ok=True)
+        self.evict(keep=p)
+        return p
+
+    def evict(self, keep: Path | None = None):
+        """
+        Delete the least recently used entries until the cache fits `max_bytes`
+        (except `keep`, e.g. the entry just stored)
+        """
+        entries = []
+        for p in self.directory.iterdir():
+            if p.name.startswith(".") or not p.is_file():
+                continue
+            stat = p.stat()
+            entries.append((stat.st_mtime, stat.st_size, p))
+        total = sum(size for _, size, _ in entries)
+        for _, size, p in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            if p == keep:
+                continue
+            p.unlink(missing_ok=True)
+            total -= size
+            logger.info(f"evicted {p.name} from cache")
+
+
+def feed_key(p: Path, restrict_to_date: date, dist_units: str) -> str:
+    """
+    Cache key of the feed read from `p` restricted to the date
+    (to derive the keys of results from)
+    """
+    return ResultCache.key(file_digest(p), restrict_to_date.isoformat(), dist_units)
+
+
+def restricted_feed(
+    cache: ResultCache,
+    p: Path,
+    restrict_to_date: date,
+    dist_units: str,
+    key: str | None = None,
+) -> Feed:
+    """
+    The (validated) feed read from `p` restricted to the date,
+    from the cache if available (`key` if already computed with `feed_key`).
+    """
+    key = feed_key(p, restrict_to_date, dist_units) if key is None else key
+    cached = cache.get(key, FEED_SUFFIX)
+    if cached is not None:
+        logger.info(f"using cached feed for {p} on {restrict_to_date}")
+        with open(cached, "rb") as f:
+            return pickle.load(f)
+
+    from gtfs_kit.miscellany import restrict_to_dates
+
+    feed = feed_io.read_feed(p, dist_units)
+    feed.validate()
+    datestr = restrict_to_date.isoformat().replace("-", "")
+    feed = restrict_to_dates(feed, [datestr])
+
+    def write(tmp: Path):
+        with open(tmp, "wb") as f:
+            pickle.dump(feed, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    cache.put(key, FEED_SUFFIX, write)
+    return feed
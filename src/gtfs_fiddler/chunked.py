@@ -0,0 +1,349 @@
+import dataclasses
+import heapq
+import logging
+import math
+import shutil
+from collections.abc import Iterator
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from gtfs_kit.constants import DTYPE
+from gtfs_kit.feed import Feed
+from gtfs_kit.miscellany import restrict_to_dates
+from pandas import DataFrame, Series
+
+from gtfs_fiddler import feed_io, spatial
+from gtfs_fiddler.fiddle import (
+    NO_FILTER,
+    FiddleFilter,
+    GtfsFiddler,
+    filtered_route_ids,
+)
+from gtfs_fiddler.gtfs_time import GtfsTime
+
+logger = logging.getLogger(__name__)
+
+
+def assign_partitions(trips: DataFrame, partition_count: int) -> dict[str, int]:
+    """
+    Assign each route to one of `partition_count` partitions so that
+    the number of trips per partition is roughly balanced.
+    All trips of a route always end up in the same partition
+    (which is required by all `ensure_*` methods).
+
+    Returns a dict of route_id -> partition number.
+    """
+    trips_per_route = trips.groupby("route_id").size().sort_values(ascending=False)
+    # greedy bin packing: always fill the currently smallest partition
+    heap = [(0, i) for i in range(partition_count)]
+    route2partition = {}
+    for route_id, count in trips_per_route.items():
+        size, partition = heapq.heappop(heap)
+        route2partition[route_id] = partition
+        heapq.heappush(heap, (size + count, partition))
+    return route2partition
+
+
+class ChunkedGtfsFiddler:
+    """
+    Out-of-core variant of `GtfsFiddler` for feeds with stop_times larger than memory.
+
+    Only the small tables (routes, trips, stops,..) are kept in memory.
+    stop_times are streamed from the input file and partitioned by route
+    into Parquet files in `work_dir`. The `ensure_*` methods are then executed
+    partition by partition with a regular `GtfsFiddler` and `write` streams
+    all partitions directly into the output zip.
+    This way peak memory is bounded by the largest partition.
+
+    Note, that the feed is not validated (this would require all stop_times in memory).
+    """
+
+    def __init__(
+        self,
+        p: Path,
+        dist_units: str,
+        work_dir: Path,
+        restrict_to_date: date | None = None,
+        partition_count: int = 16,
+        chunksize: int = 1_000_000,
+    ):
+        self._work_dir = Path(work_dir)
+        self._work_dir.mkdir(parents=True, exist_ok=True)
+        self._stop_index: spatial.StopIndex | None = None
+        self._feed = feed_io.read_feed(p, dist_units, skip=["stop_times"])
+        all_stops = self._feed.stops
+        all_transfers = self._feed.transfers
+        if restrict_to_date is not None:
+            datestr = restrict_to_date.isoformat().replace("-", "")
+            # stop_times are restricted while partitioning
+            self._feed.stop_times = DataFrame(columns=["trip_id", "stop_id"])
+            self._feed = restrict_to_dates(self._feed, [datestr])
+            self._feed.stop_times = None
+
+        route2partition = assign_partitions(self._feed.trips, partition_count)
+        self._partition_count = partition_count
+        self._partition_routes = [
+            [r for r, i in route2partition.items() if i == partition]
+            for partition in range(partition_count)
+        ]
+        trip2partition = self._feed.trips.set_index("trip_id").route_id.map(
+            route2partition
+        )
+
+        stop_ids = self._partition_stop_times(p, trip2partition, chunksize)
+
+        if restrict_to_date is not None:
+            # restrict stops (and transfers) the same way `restrict_to_dates` does
+            cond = all_stops.stop_id.isin(stop_ids)
+            if "location_type" in all_stops.columns:
+                cond |= ~all_stops.location_type.isin([0, math.nan])
+            self._feed.stops = all_stops[cond].copy()
+            if all_transfers is not None:
+                self._feed.transfers = all_transfers[
+                    all_transfers.from_stop_id.isin(stop_ids)
+                    & all_transfers.to_stop_id.isin(stop_ids)
+                ].copy()
+
+    def _partition_path(self, partition: int) -> Path:
+        return self._work_dir / f"stop_times_{partition:04}.parquet"
+
+    def _partition_stop_times(
+        self, p: Path, trip2partition: Series, chunksize: int
+    ) -> set[str]:
+        """
+        Stream stop_times from the input file into one Parquet file per partition.
+        Values are stored as raw strings and only converted when reading a partition.
+
+        Returns the ids of all stops that are used by the stop times.
+        """
+        writers = {}
+        stop_ids = set()
+        rows = 0
+        for chunk in feed_io.read_table_chunks(p, "stop_times", chunksize, dtype=str):
+            chunk["_partition"] = chunk.trip_id.map(trip2partition)
+            chunk = chunk.dropna(subset="_partition")
+            stop_ids.update(chunk.stop_id.unique())
+            rows += len(chunk)
+            for partition, df in chunk.groupby("_partition"):
+                df = df.drop(columns="_partition")
+                partition = int(partition)
+                if partition not in writers:
+                    schema = pa.schema([(c, pa.string()) for c in df.columns])
+                    writers[partition] = pq.ParquetWriter(
+                        self._partition_path(partition), schema
+                    )
+                writers[partition].write_table(
+                    pa.Table.from_pandas(
+                        df, schema=writers[partition].schema, preserve_index=False
+                    )
+                )
+        for writer in writers.values():
+            writer.close()
+        logger.info(f"partitioned {rows} stop times into {len(writers)} partitions")
+        return stop_ids
+
+    def _read_partition(self, partition: int) -> DataFrame | None:
+        p = self._partition_path(partition)
+        if not p.exists():
+            return None
+        df = pd.read_parquet(p)
+        # restore the dtypes (and NaNs) `gtfs_kit.read_feed` would use
+        for col in df.columns:
+            if col in DTYPE:
+                df[col] = df[col].where(df[col].notna(), math.nan)
+            else:
+                df[col] = pd.to_numeric(df[col])
+        return df
+
+    def _fiddler_for_partition(self, partition: int) -> GtfsFiddler | None:
+        stop_times = self._read_partition(partition)
+        if stop_times is None:
+            return None
+        routes = self._partition_routes[partition]
+        tables = {t: getattr(self._feed, t) for t in feed_io.GTFS_TABLES}
+        tables["trips"] = self._feed.trips[self._feed.trips.route_id.isin(routes)]
+        tables["stop_times"] = stop_times
+        return GtfsFiddler.from_feed(Feed(dist_units=self._feed.dist_units, **tables))
+
+    def stop_index(self) -> spatial.StopIndex:
+        """
+        See `GtfsFiddler.stop_index`, built from the distinct (stop_id, route_id)
+        pairs of each partition so that memory stays bounded by the largest
+        partition; `trip_ids` of this index returns route ids
+        """
+        if self._stop_index is None:
+            trip_route_ids = self._feed.trips.set_index("trip_id").route_id
+            pairs = []
+            for path in map(self._partition_path, range(self._partition_count)):
+                if not path.exists():
+                    continue
+                stop_times = pd.read_parquet(path, columns=["stop_id", "trip_id"])
+                pairs.append(
+                    DataFrame(
+                        {
+                            "stop_id": stop_times.stop_id,
+                            "route_id": stop_times.trip_id.map(trip_route_ids),
+                        }
+                    )
+                    .dropna()
+                    .drop_duplicates()
+                )
+            stop_routes = (
+                pd.concat(pairs).drop_duplicates()
+                if pairs
+                else DataFrame(columns=["stop_id", "route_id"], dtype=object)
+            )
+            self._stop_index = spatial.StopIndex.from_stop_routes(
+                self._feed.stops, stop_routes
+            )
+        return self._stop_index
+
+    def resolve_filter(self, filter: FiddleFilter) -> FiddleFilter:
+        """
+        See `GtfsFiddler.resolve_filter`
+        """
+        if filter.area is None:
+            return filter
+        route_ids = self.stop_index().route_ids(filter.area)
+        if filter.route_ids is not None:
+            route_ids &= set(filter.route_ids)
+        logger.info(f"{len(route_ids)} routes within the filter's area")
+        return dataclasses.replace(
+            filter, route_ids=tuple(sorted(route_ids)), area=None
+        )
+
+    def _selected_partitions(self, filter: FiddleFilter) -> list[int]:
+        """
+        Partitions containing at least one route matching the (resolved) filter
+        """
+        route_ids = filtered_route_ids(self._feed.routes, filter)
+        return [
+            i
+            for i, partition_routes in enumerate(self._partition_routes)
+            if route_ids.intersection(partition_routes)
+        ]
+
+    def _apply(self, partitions: list[int], method: str, *args):
+        """
+        Call a `GtfsFiddler` method for each given partition
+        and store the resulting trips and stop times.
+        """
+        trips = []
+        touched_routes = set()
+        for partition in partitions:
+            fiddler = self._fiddler_for_partition(partition)
+            if fiddler is None:
+                continue
+            getattr(fiddler, method)(*args)
+            fiddler.stop_times.to_parquet(self._partition_path(partition), index=False)
+            trips.append(fiddler.trips)
+            touched_routes.update(self._partition_routes[partition])
+            logger.info(f"{method} done for partition {partition}")
+
+        untouched = self._feed.trips[~self._feed.trips.route_id.isin(touched_routes)]
+        self._feed.trips = pd.concat([untouched, *trips]).reset_index(drop=True)
+
+    @property
+    def feed(self) -> Feed:
+        """
+        The feed without stop times (which only exist on disk)
+        """
+        return self._feed
+
+    @property
+    def routes(self) -> DataFrame:
+        return self._feed.routes
+
+    @property
+    def trips(self) -> DataFrame:
+        return self._feed.trips
+
+    def iter_stop_times(self) -> Iterator[DataFrame]:
+        """
+        Iterate over the stop times, one partition at a time.
+        """
+        for partition in range(self._partition_count):
+            df = self._read_partition(partition)
+            if df is not None:
+                yield df
+
+    def trips_enriched(self, filter: FiddleFilter = NO_FILTER) -> DataFrame:
+        """
+        See `GtfsFiddler.trips_enriched`
+        """
+        filter = self.resolve_filter(filter)
+        dfs = []
+        for partition in self._selected_partitions(filter):
+            fiddler = self._fiddler_for_partition(partition)
+            if fiddler is not None:
+                dfs.append(fiddler.trips_enriched(filter))
+        if len(dfs) == 0:
+            return DataFrame()
+        df = pd.concat(dfs)
+        return df.sort_values(by=["route_id", "direction_id", "start_time"])
+
+    def ensure_earliest_departure(
+        self, target_time: GtfsTime, filter: FiddleFilter = NO_FILTER
+    ):
+        """
+        See `GtfsFiddler.ensure_earliest_departure`
+        """
+        filter = self.resolve_filter(filter)
+        partitions = self._selected_partitions(filter)
+        self._apply(partitions, "ensure_earliest_departure", target_time, filter)
+
+    def ensure_latest_departure(
+        self, target_time: GtfsTime, filter: FiddleFilter = NO_FILTER
+    ):
+        """
+        See `GtfsFiddler.ensure_latest_departure`
+        """
+        filter = self.resolve_filter(filter)
+        partitions = self._selected_partitions(filter)
+        self._apply(partitions, "ensure_latest_departure", target_time, filter)
+
+    def ensure_max_trip_interval(self, minutes: int, filter: FiddleFilter = NO_FILTER):
+        """
+        See `GtfsFiddler.ensure_max_trip_interval`
+        """
+        filter = self.resolve_filter(filter)
+        partitions = self._selected_partitions(filter)
+        self._apply(partitions, "ensure_max_trip_interval", minutes, filter)
+
+    def ensure_min_speed(
+        self,
+        route_type2speed: dict[int, float] | None = None,
+        route_id2speed: dict[str, float] | None = None,
+    ):
+        """
+        See `GtfsFiddler.ensure_min_speed`
+        """
+        route_types = None if route_type2speed is None else route_type2speed.keys()
+        route_ids = None if route_id2speed is None else route_id2speed.keys()
+        partitions = set()
+        if route_types is not None:
+            partitions.update(
+                self._selected_partitions(FiddleFilter(route_types=route_types))
+            )
+        if route_ids is not None:
+            partitions.update(
+                self._selected_partitions(FiddleFilter(route_ids=route_ids))
+            )
+        self._apply(
+            sorted(partitions), "ensure_min_speed", route_type2speed, route_id2speed
+        )
+
+    def write(self, p: Path):
+        """
+        Write the feed as GTFS zip file, streaming stop times partition by partition.
+        """
+        feed_io.write_feed(self._feed, p, stop_times=self.iter_stop_times())
+
+    def cleanup(self):
+        """
+        Delete the partition files in the working directory.
+        """
+        shutil.rmtree(self._work_dir, ignore_errors=True)
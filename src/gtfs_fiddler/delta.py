@@ -0,0 +1,174 @@
+"""
+Append-only storage of the trips and stop times added by fiddling.
+
+Instead of concatenating the whole table for each batch of added rows
+(i.e. copying all of it again for a few thousand new rows), the added rows
+are kept as segments and the combined table is only materialized when requested
+(see `GtfsFiddler.feed`). Rows can be looked up by key (e.g. trip_id) across
+the base table and all segments, indexing each of them only once.
+Segments appended to a sorted base table are merged into it, i.e. only the
+(few) added rows are sorted instead of the whole table.
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from gtfs_fiddler import kernels, patterns
+
+
+@dataclass(frozen=True)
+class _KeyIndex:
+    """
+    Rows of a table sorted by key (and sort column): `order[first[i]:first[i] + num[i]]`
+    are the positions of the rows with key `keys[i]`
+    """
+
+    keys: pd.Index
+    order: np.ndarray
+    first: np.ndarray
+    num: np.ndarray
+
+
+def _merge_order(df: DataFrame, num_sorted: int, cols: list[str]) -> np.ndarray:
+    """
+    Positions of the rows of `df` (with reset index) sorted by `cols`
+    (like `sort_values` for unique keys), if its first `num_sorted` rows are already
+    sorted: only the other rows are sorted and inserted with a binary search.
+    """
+    added = df.iloc[num_sorted:].sort_values(cols).index.to_numpy()
+    keys = df[cols[0]].to_numpy()
+    pos = np.searchsorted(keys[:num_sorted], keys[added], side="left")
+    if len(cols) > 1:
+        # added rows with keys of sorted rows (not for copied trips)
+        end = np.searchsorted(keys[:num_sorted], keys[added], side="right")
+        values = df[cols[1]].to_numpy()
+        for i in np.flatnonzero(end > pos):
+            pos[i] += np.searchsorted(values[pos[i] : end[i]], values[added[i]])
+    # the i-th added row follows pos[i] sorted rows and i added rows
+    target = pos + np.arange(len(added))
+    is_added = np.zeros(len(df), dtype=bool)
+    is_added[target] = True
+    order = np.empty(len(df), dtype=np.int64)
+    order[target] = added
+    order[~is_added] = np.arange(num_sorted)
+    return order
+
+
+class AppendOnlyTable:
+    """
+    Segments appended to a base table (which is passed to each method,
+    so that it can be replaced as long as there are no segments).
+    """
+
+    def __init__(self, key: str, sort_by: str | None = None):
+        self.key = key
+        self.sort_by = sort_by
+        self.segments: list[DataFrame] = []
+        # (frame, index) of the base table and the segments
+        self._indexes: list[tuple[DataFrame, _KeyIndex]] = []
+
+    def __len__(self) -> int:
+        return sum(len(s) for s in self.segments)
+
+    def append(self, df: DataFrame):
+        if len(df) > 0:
+            self.segments.append(df)
+
+    def _index(self, frame: DataFrame) -> _KeyIndex:
+        for indexed, index in self._indexes:
+            if indexed is frame:
+                return index
+        cols = [self.key] if self.sort_by is None else [self.key, self.sort_by]
+        order = (
+            frame[cols]
+            .reset_index(drop=True)
+            .sort_values(cols, kind="stable")
+            .index.to_numpy()
+        )
+        sorted_keys = frame[self.key].to_numpy()[order]
+        boundaries = kernels.trip_boundaries(sorted_keys)
+        index = _KeyIndex(
+            pd.Index(sorted_keys[boundaries[:-1]]),
+            order,
+            boundaries[:-1],
+            np.diff(boundaries),
+        )
+        self._indexes.append((frame, index))
+        return index
+
+    def rows(self, base: DataFrame, keys) -> tuple[DataFrame, np.ndarray]:
+        """
+        The rows of each key (in the order of the given keys, which may repeat),
+        sorted by the sort column within each key, and the number of rows per key.
+        Raises a KeyError for unknown keys.
+        """
+        frames = [base, *self.segments]
+        self._indexes = [
+            (f, i) for f, i in self._indexes if any(f is frame for frame in frames)
+        ]
+        keys = np.asarray(keys, dtype=object)
+        lengths = np.zeros(len(keys), dtype=np.int64)
+        found = np.zeros(len(keys), dtype=bool)
+        parts, query_positions = [], []
+        for frame in frames:
+            index = self._index(frame)
+            pos = index.keys.get_indexer(keys)
+            selected = np.flatnonzero((pos >= 0) & ~found)
+            if len(selected) == 0:
+                continue
+            found[selected] = True
+            num = index.num[pos[selected]]
+            lengths[selected] = num
+            rows = patterns.rows_of(index.first[pos[selected]], num)
+            parts.append(frame.iloc[index.order[rows]])
+            query_positions.append(np.repeat(selected, num))
+        if not found.all():
+            raise KeyError(f"unknown {self.key}: {list(keys[~found][:5])}")
+        if not parts:
+            return base.iloc[:0].reset_index(drop=True), lengths
+        order = np.argsort(np.concatenate(query_positions), kind="stable")
+        df = pd.concat(parts).iloc[order].reset_index(drop=True)
+        return df, lengths
+
+    def is_sorted(self, df: DataFrame) -> bool:
+        """
+        Whether the table is sorted by key and sort column (without duplicates)
+        """
+        keys = df[self.key]
+        if not keys.is_monotonic_increasing:
+            return False
+        if self.sort_by is None:
+            return True
+        keys = keys.to_numpy()
+        same_key = keys[1:] == keys[:-1]
+        values = df[self.sort_by].to_numpy()
+        return bool(np.all(values[1:][same_key] > values[:-1][same_key]))
+
+    def materialize(
+        self, base: DataFrame, sort_segments: int = 0, base_sorted: bool = False
+    ) -> DataFrame:
+        """
+        The base table with all segments appended (with reset index).
+        The base table and the first `sort_segments` segments are sorted
+        by key and sort column (like `sort_values` after a concat, i.e. the index
+        is only reset again if further segments are appended).
+        If the base table is already sorted (see `is_sorted`) only the segments
+        are sorted and merged into it.
+        """
+        if not self.segments:
+            return base
+        head = pd.concat([base, *self.segments[:sort_segments]]).reset_index(drop=True)
+        if sort_segments > 0:
+            cols = [self.key] if self.sort_by is None else [self.key, self.sort_by]
+            if base_sorted:
+                head = head.iloc[_merge_order(head, len(base), cols)]
+            else:
+                head = head.sort_values(cols)
+        tail = self.segments[sort_segments:]
+        df = pd.concat([head, *tail]).reset_index(drop=True) if tail else head
+        self.segments = []
+        self._indexes = []
+        return df
@@ -0,0 +1,185 @@
+"""
+Compare a feed before and after fiddling (see `GtfsFiddler.diff`).
+
+Trips are matched by trip_id and stop times by (trip_id, stop_sequence).
+Both are joined on integer keys (factorized trip ids) and all comparisons
+are vectorized, so this scales to millions of stop times.
+"""
+
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from gtfs_fiddler.gtfs_time import to_seconds
+
+if TYPE_CHECKING:
+    from gtfs_kit.feed import Feed
+
+ROUTE_KEYS = ["route_id", "direction_id"]
+STATUSES = ("added", "removed", "changed", "unchanged")
+
+
+@dataclass(frozen=True)
+class FeedDiff:
+    """
+    Differences between two feeds.
+
+    `summary` has one row per route_id and direction_id with the number of trips
+    before and after, the number of added, removed and changed trips,
+    the number of changed stop times and the mean change of the trip duration
+    (in seconds) of changed trips.
+
+    `trips` (only if requested) has one row per trip with its `status`
+    (one of `STATUSES`), start and duration before and after (in seconds),
+    the number of changed stop times and the largest shift of a stop time (in seconds).
+    """
+
+    summary: DataFrame
+    trips: DataFrame | None = None
+
+
+def _trips(feed: Feed) -> DataFrame:
+    trips = feed.trips
+    return DataFrame(
+        {
+            "trip_id": trips.trip_id.to_numpy(),
+            "route_id": trips.route_id.to_numpy(),
+            "direction_id": (
+                trips.direction_id.to_numpy()
+                if "direction_id" in trips.columns
+                else math.nan
+            ),
+        }
+    )
+
+
+def _stop_times(feed: Feed, trip_codes: pd.Index, max_sequence: int) -> DataFrame:
+    """
+    Stop times with an integer key for (trip_id, stop_sequence)
+    and times in seconds
+    """
+    st = feed.stop_times
+    trip_code = trip_codes.get_indexer(st.trip_id)
+    return DataFrame(
+        {
+            "key": trip_code.astype(np.int64) * (max_sequence + 1)
+            + st.stop_sequence.to_numpy(dtype=np.int64),
+            "trip_code": trip_code,
+            "stop_sequence": st.stop_sequence.to_numpy(dtype=np.int64),
+            "arrival": to_seconds(st.arrival_time),
+            "departure": to_seconds(st.departure_time),
+        }
+    )
+
+
+def _per_trip(st: DataFrame, suffix: str) -> DataFrame:
+    """
+    start (first departure) and duration (last arrival - start) per trip code
+    """
+    st = st.sort_values(["trip_code", "stop_sequence"])
+    grouped = st.groupby("trip_code")
+    start = grouped.departure.first()
+    end = grouped.arrival.last()
+    return DataFrame({f"start{suffix}": start, f"duration{suffix}": end - start})
+
+
+def diff_feeds(before: Feed, after: Feed, detail: bool = False) -> FeedDiff:
+    """
+    Compare the trips and stop times of two feeds, see `FeedDiff`.
+    """
+    trips = _trips(before).merge(
+        _trips(after), on="trip_id", how="outer", indicator=True, suffixes=("", "_")
+    )
+    for key in ROUTE_KEYS:
+        trips[key] = trips[key].where(trips._merge != "right_only", trips[f"{key}_"])
+    trip_codes = pd.Index(trips.trip_id)
+
+    max_sequence = max(
+        int(before.stop_times.stop_sequence.max()),
+        int(after.stop_times.stop_sequence.max()),
+    )
+    st_before = _stop_times(before, trip_codes, max_sequence)
+    st_after = _stop_times(after, trip_codes, max_sequence)
+    st = st_before.merge(
+        st_after.drop(columns=["trip_code", "stop_sequence"]),
+        on="key",
+        how="outer",
+        suffixes=("_before", "_after"),
+    )
+    st["trip_code"] = st.key // (max_sequence + 1)
+
+    # missing on both sides counts as equal
+    shifts = []
+    changed = np.zeros(len(st), dtype=bool)
+    for col in ["arrival", "departure"]:
+        b, a = st[f"{col}_before"].to_numpy(), st[f"{col}_after"].to_numpy()
+        changed |= (b != a) & ~(np.isnan(b) & np.isnan(a))
+        shifts.append(np.abs(a - b))
+    st["changed"] = changed
+    st["shift"] = np.fmax(*shifts)
+    changes = st.groupby("trip_code").agg(
+        changed_stop_times=("changed", "sum"), max_shift=("shift", "max")
+    )
+
+    trips = trips.join(_per_trip(st_before, "_before"))
+    trips = trips.join(_per_trip(st_after, "_after"))
+    trips = trips.join(changes)
+    trips["changed_stop_times"] = trips.changed_stop_times.fillna(0).astype(int)
+    status = np.select(
+        [
+            trips._merge == "right_only",
+            trips._merge == "left_only",
+            trips.changed_stop_times > 0,
+        ],
+        ["added", "removed", "changed"],
+        "unchanged",
+    )
+    trips["status"] = status
+    trips["duration_change"] = trips.duration_after - trips.duration_before
+
+    exists_before = trips.status != "added"
+    exists_after = trips.status != "removed"
+    is_changed = trips.status == "changed"
+    summary = (
+        trips.assign(
+            trips_before=exists_before,
+            trips_after=exists_after,
+            added=trips.status == "added",
+            removed=trips.status == "removed",
+            changed=is_changed,
+            changed_stop_times=trips.changed_stop_times.where(is_changed, 0),
+            duration_change=trips.duration_change.where(is_changed),
+        )
+        .groupby(ROUTE_KEYS, dropna=False)
+        .agg(
+            trips_before=("trips_before", "sum"),
+            trips_after=("trips_after", "sum"),
+            added=("added", "sum"),
+            removed=("removed", "sum"),
+            changed=("changed", "sum"),
+            changed_stop_times=("changed_stop_times", "sum"),
+            mean_duration_change=("duration_change", "mean"),
+        )
+        .reset_index()
+    )
+
+    if not detail:
+        return FeedDiff(summary)
+    cols = [
+        "trip_id",
+        *ROUTE_KEYS,
+        "status",
+        "start_before",
+        "start_after",
+        "duration_before",
+        "duration_after",
+        "changed_stop_times",
+        "max_shift",
+    ]
+    return FeedDiff(summary, trips[cols].reset_index(drop=True))
@@ -0,0 +1,262 @@
+"""
+Estimate the result and cost of a recipe before running it on a huge feed:
+
+- `dry_run` simulates the steps on the trip stats alone (route, direction,
+  start time and number of stops per trip), i.e. without copying any stop times,
+  and returns the exact number of trips and stop times after each step
+  and the expected size of the resulting stop times (in memory and as CSV).
+  The trip stats are cached by the fiddler, i.e. a following run doesn't
+  compute them again.
+- `sample_run` runs the recipe on a random sample of the routes
+  (all operations work per route and direction) and extrapolates its runtime
+  and peak memory linearly to the number of stop times of the whole feed.
+"""
+
+from __future__ import annotations
+
+import copy
+import dataclasses
+import math
+import time
+import tracemalloc
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from gtfs_fiddler import kernels
+from gtfs_fiddler.fiddle import GtfsFiddler, filtered_route_ids
+from gtfs_fiddler.gtfs_time import to_seconds
+from gtfs_fiddler.recipe import Recipe, Step, run_recipe
+
+GROUP_KEYS = ["route_id", "direction_id"]
+# stop times used to estimate the bytes per row
+SIZE_SAMPLE_ROWS = 10_000
+STEP_COLUMNS = [
+    "operation",
+    "value",
+    "trips",
+    "stop_times",
+    "added_trips",
+    "removed_trips",
+    "added_stop_times",
+    "removed_stop_times",
+]
+
+
+@dataclass(frozen=True)
+class DryRun:
+    """
+    `trips` and `stop_times` before the recipe,
+    `steps` has one row per step with its operation and value, the number of
+    trips and stop times after the step and the number of added and removed ones.
+    `stop_time_bytes` and `stop_time_csv_bytes` are the (average) bytes per stop time
+    in memory and in stop_times.txt.
+    """
+
+    trips: int
+    stop_times: int
+    steps: DataFrame
+    stop_time_bytes: float
+    stop_time_csv_bytes: float
+
+    @property
+    def added_trips(self) -> int:
+        return int(self.steps.added_trips.sum())
+
+    @property
+    def added_stop_times(self) -> int:
+        return int(self.steps.added_stop_times.sum())
+
+    @property
+    def result_stop_times(self) -> int:
+        if len(self.steps) == 0:
+            return self.stop_times
+        return int(self.steps.stop_times.iat[-1])
+
+    @property
+    def memory_mb(self) -> float:
+        """
+        Expected size of the resulting stop times in memory
+        """
+        return self.result_stop_times * self.stop_time_bytes / 2**20
+
+    @property
+    def csv_mb(self) -> float:
+        """
+        Expected size of the resulting stop_times.txt (uncompressed)
+        """
+        return self.result_stop_times * self.stop_time_csv_bytes / 2**20
+
+
+@dataclass(frozen=True)
+class SampleRun:
+    """
+    Runtime and peak memory (allocated by Python and NumPy) of a recipe
+    for a sample of the routes with the given `fraction` of all stop times,
+    including the computation of the trip stats.
+    """
+
+    routes: int
+    fraction: float
+    seconds: float
+    peak_mb: float
+    added_trips: int
+
+    @property
+    def estimated_seconds(self) -> float:
+        return self.seconds / self.fraction
+
+    @property
+    def estimated_peak_mb(self) -> float:
+        return self.peak_mb / self.fraction
+
+
+def _sorted(t: DataFrame) -> DataFrame:
+    return t.sort_values([*GROUP_KEYS, "start"], kind="stable").reset_index(drop=True)
+
+
+def _simulate(t: DataFrame, step: Step, route_ids: set[str]) -> DataFrame:
+    """
+    The trips (route_id, direction_id, start and num_stops sorted by start per
+    route and direction) after the step, see the corresponding `GtfsFiddler` methods
+    """
+    if step.operation == "min_speed":
+        return t
+    selected = t[t.route_id.isin(route_ids).to_numpy()]
+    groups = selected.groupby(GROUP_KEYS, dropna=False, sort=False)
+    if step.operation in ("earliest_departure", "latest_departure"):
+        is_earliest = step.operation == "earliest_departure"
+        trip = groups.first() if is_earliest else groups.last()
+        target = float(step.value.seconds_of_day)
+        adjust = trip.start > target if is_earliest else trip.start < target
+        copies = trip[adjust.to_numpy()].reset_index().assign(start=target)
+        return _sorted(pd.concat([t, copies[t.columns]]))
+    if step.operation == "max_trip_interval":
+        interval = step.value * 60
+        gap = (groups.start.shift(-1) - selected.start).to_numpy()
+        trip = selected[gap > interval].assign(gap=gap[gap > interval])
+        repeats = np.ceil(trip.gap.to_numpy() / interval).astype(np.int64) - 1
+        offsets = np.floor(trip.gap.to_numpy() / (repeats + 1))
+        copies = trip.loc[trip.index.repeat(repeats), t.columns]
+        k = np.arange(len(copies)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        copies["start"] += np.repeat(offsets, repeats) * (k + 1)
+        return _sorted(pd.concat([t, copies]))
+    if step.operation == "min_headway":
+        keep = kernels.thin(
+            selected.start.to_numpy(dtype=float),
+            kernels.trip_boundaries(groups.ngroup().to_numpy()),
+            float(step.value * 60),
+        )
+        return t.drop(index=selected.index[~keep])
+    raise ValueError(f"unknown operation {step.operation}")
+
+
+def _bytes_per_row(df: DataFrame) -> tuple[float, float]:
+    """
+    Average bytes per row in memory and as CSV (of a sample of the rows)
+    """
+    if len(df) == 0:
+        return math.nan, math.nan
+    sample = df.sample(min(len(df), SIZE_SAMPLE_ROWS), random_state=0)
+    memory = sample.memory_usage(deep=True, index=False).sum()
+    csv = len(sample.to_csv(index=False).encode())
+    return memory / len(sample), csv / len(sample)
+
+
+def dry_run(fiddler: GtfsFiddler, recipe: Recipe) -> DryRun:
+    """
+    Simulate the recipe on the fiddler's trip stats, see module docs.
+    The fiddler's feed is not changed.
+
+    The counts are exact, except that trips removed by `min_headway`
+    among trips with the same start may differ in their number of stops.
+    """
+    stats = fiddler.trip_stats()
+    t = _sorted(
+        DataFrame(
+            {
+                "route_id": stats.route_id.to_numpy(),
+                "direction_id": stats.direction_id.to_numpy(),
+                "start": to_seconds(stats.start_time),
+                "num_stops": stats.num_stops.to_numpy(dtype=np.int64),
+            }
+        )
+    )
+    rows = []
+    for step in recipe.steps:
+        filter = fiddler.resolve_filter(step.filter)
+        num_trips, num_stop_times = len(t), int(t.num_stops.sum())
+        t = _simulate(t, step, filtered_route_ids(fiddler.routes, filter))
+        # each operation either adds or removes trips
+        trips_diff = len(t) - num_trips
+        stop_times_diff = int(t.num_stops.sum()) - num_stop_times
+        rows.append(
+            {
+                "operation": step.operation,
+                "value": str(step.value),
+                "trips": len(t),
+                "stop_times": num_stop_times + stop_times_diff,
+                "added_trips": max(trips_diff, 0),
+                "removed_trips": max(-trips_diff, 0),
+                "added_stop_times": max(stop_times_diff, 0),
+                "removed_stop_times": max(-stop_times_diff, 0),
+            }
+        )
+    steps = DataFrame(rows, columns=STEP_COLUMNS)
+    return DryRun(
+        len(stats), len(fiddler.stop_times), steps, *_bytes_per_row(fiddler.stop_times)
+    )
+
+
+def sample_run(
+    fiddler: GtfsFiddler, recipe: Recipe, route_fraction: float = 0.1, seed: int = 0
+) -> SampleRun:
+    """
+    Run the recipe on a random sample of the fiddler's routes (at least one),
+    see module docs. The recipe is run twice on the sample, the second time
+    with `tracemalloc` to measure the peak memory (without affecting the runtime).
+    The fiddler's feed is not changed.
+    """
+    # resolve the areas on the whole feed
+    recipe = Recipe(
+        tuple(
+            dataclasses.replace(step, filter=fiddler.resolve_filter(step.filter))
+            for step in recipe.steps
+        )
+    )
+    feed = fiddler.feed
+    route_ids = feed.trips.route_id.unique()
+    rng = np.random.default_rng(seed)
+    size = min(len(route_ids), max(1, round(route_fraction * len(route_ids))))
+    sampled = rng.choice(route_ids, size, replace=False)
+
+    sample = copy.copy(feed)
+    sample.trips = feed.trips[feed.trips.route_id.isin(sampled)]
+    trip_ids = sample.trips.trip_id
+    sample.stop_times = feed.stop_times[feed.stop_times.trip_id.isin(trip_ids)]
+    if feed.frequencies is not None:
+        sample.frequencies = feed.frequencies[feed.frequencies.trip_id.isin(trip_ids)]
+    backend = "pandas" if fiddler._polars is None else "polars"
+
+    start = time.perf_counter()
+    sample_fiddler = GtfsFiddler.from_feed(sample, backend=backend)
+    run_recipe(sample_fiddler, recipe)
+    added_trips = len(sample_fiddler.trips) - len(sample.trips)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    try:
+        run_recipe(GtfsFiddler.from_feed(sample, backend=backend), recipe)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return SampleRun(
+        routes=size,
+        fraction=len(sample.stop_times) / len(feed.stop_times),
+        seconds=seconds,
+        peak_mb=peak / 2**20,
+        added_trips=added_trips,
+    )
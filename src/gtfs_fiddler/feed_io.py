@@ -0,0 +1,253 @@
+"""
+Reading and writing GTFS feeds.
+
+gtfs_kit (and with it geopandas, folium, ...) is only imported
+when a feed is actually read or written, not when this module is imported.
+"""
+
+from __future__ import annotations
+
+import io
+import math
+import zipfile
+from collections.abc import Collection, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+from pathlib import Path
+from typing import IO, TYPE_CHECKING
+
+import pandas as pd
+from pandas import DataFrame
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
+if TYPE_CHECKING:
+    from gtfs_kit.feed import Feed
+
+
+def _constants():
+    import gtfs_kit.constants as cs
+
+    return cs
+
+
+@cache
+def gtfs_tables() -> list[str]:
+    """
+    Names of all GTFS tables known to gtfs_kit (in the order it writes them)
+    """
+    return list(_constants().GTFS_REF["table"].unique())
+
+
+def __getattr__(name: str):
+    # `GTFS_TABLES` without importing gtfs_kit on import of this module
+    if name == "GTFS_TABLES":
+        return gtfs_tables()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _open_member(p: Path, table: str) -> IO[bytes] | None:
+    """
+    Open `table`.txt of a zipped or unpacked GTFS feed (or None if missing/empty).
+    """
+    name = f"{table}.txt"
+    if p.is_file():
+        zf = zipfile.ZipFile(p)
+        if name not in zf.namelist() or zf.getinfo(name).file_size == 0:
+            zf.close()
+            return None
+        # the member stream keeps a reference to the zip file
+        return zf.open(name)
+    member = p / name
+    if not member.is_file() or member.stat().st_size == 0:
+        return None
+    return open(member, "rb")
+
+
+def _member_sizes(p: Path) -> dict[str, int]:
+    """
+    Uncompressed size of each table of a zipped or unpacked GTFS feed
+    """
+    if p.is_file():
+        with zipfile.ZipFile(p) as zf:
+            return {
+                info.filename.removesuffix(".txt"): info.file_size
+                for info in zf.infolist()
+            }
+    return {f.stem: f.stat().st_size for f in p.glob("*.txt")}
+
+
+def _read_csv_arrow(f: IO[bytes]) -> DataFrame | None:
+    """
+    Equivalent of `pd.read_csv(f, dtype=cs.DTYPE, encoding="utf-8-sig")`
+    (with `gtfs_kit.constants as cs`)
+    with the (multi-threaded) pyarrow CSV reader.
+    Returns None for column names with surrounding whitespace,
+    which would not match the dtypes.
+    """
+    table = pa_csv.read_csv(
+        f,
+        convert_options=pa_csv.ConvertOptions(
+            column_types={col: pa.string() for col in _constants().DTYPE},
+            strings_can_be_null=True,
+        ),
+    )
+    if any(name != name.strip() for name in table.column_names):
+        return None
+    return from_arrow(table)
+
+
+def from_arrow(table: "pa.Table") -> DataFrame:
+    """
+    Convert an Arrow table of a GTFS table to pandas with the dtypes
+    `gtfs_kit.read_feed` would use: missing strings are NaN (not None),
+    columns without any value are float (or str, see `gtfs_kit.constants.DTYPE`).
+    """
+    dtype = _constants().DTYPE
+    schema = pa.schema(
+        [
+            (
+                pa.field(
+                    field.name, pa.string() if field.name in dtype else pa.float64()
+                )
+                if pa.types.is_null(field.type)
+                else field
+            )
+            for field in table.schema
+        ]
+    )
+    # not zero-copy: pandas modifies columns in place, which fails for Arrow buffers
+    df = table.cast(schema).to_pandas()
+    for col in df.columns[df.dtypes == object]:
+        df[col] = df[col].where(df[col].notna(), math.nan)
+    return df
+
+
+def read_table(p: Path, table: str, use_pyarrow: bool = True) -> DataFrame | None:
+    """
+    Read a single GTFS table the same way `gtfs_kit.read_feed` does
+    (same dtypes, stripped column names).
+    If installed (and not disabled) the pyarrow CSV reader is used.
+    """
+    df = None
+    if use_pyarrow and pa is not None:
+        f = _open_member(Path(p), table)
+        if f is None:
+            return None
+        with f:
+            df = _read_csv_arrow(f)
+    if df is None:
+        f = _open_member(Path(p), table)
+        if f is None:
+            return None
+        with f:
+            df = pd.read_csv(f, dtype=_constants().DTYPE, encoding="utf-8-sig")
+    if df.empty:
+        return None
+    df.columns = [col.strip() for col in df.columns]
+    return df
+
+
+def read_table_chunks(
+    p: Path, table: str, chunksize: int, dtype: dict | type | None = None
+) -> Iterator[DataFrame]:
+    """
+    Read a single GTFS table in chunks of at most `chunksize` rows,
+    so that tables larger than the available memory can be processed.
+    The dtypes default to those of `gtfs_kit.read_feed`.
+    """
+    if dtype is None:
+        dtype = _constants().DTYPE
+    f = _open_member(Path(p), table)
+    if f is None:
+        return
+    with f:
+        for df in pd.read_csv(
+            f, dtype=dtype, encoding="utf-8-sig", chunksize=chunksize
+        ):
+            df.columns = [col.strip() for col in df.columns]
+            yield df
+
+
+def read_feed(
+    p: Path,
+    dist_units: str,
+    skip: Collection[str] = (),
+    max_workers: int | None = None,
+    use_pyarrow: bool = True,
+) -> Feed:
+    """
+    Read a GTFS feed directly from the zip file (without unpacking it first).
+    Tables listed in `skip` are not read and set to None.
+
+    The tables are read concurrently by a pool of `max_workers` threads
+    (largest tables first, so that reading stop_times starts immediately).
+    Parsing CSV only runs in parallel with the pyarrow CSV reader, i.e.
+    if pyarrow is installed (and not disabled with `use_pyarrow`).
+    """
+    p = Path(p)
+    if not p.exists():
+        raise ValueError(f"Path {p} does not exist")
+    sizes = _member_sizes(p)
+    tables = [t for t in gtfs_tables() if t not in skip]
+    tables.sort(key=lambda t: sizes.get(t, 0), reverse=True)
+    from gtfs_kit.feed import Feed
+
+    with ThreadPoolExecutor(max_workers) as pool:
+        futures = {t: pool.submit(read_table, p, t, use_pyarrow) for t in tables}
+        return Feed(
+            dist_units=dist_units, **{t: f.result() for t, f in futures.items()}
+        )
+
+
+def to_gtfs_csv(df: DataFrame, buf: IO[str], header: bool = True, ndigits: int = 6):
+    """
+    Write a GTFS table as CSV, formatted like `gtfs_kit.Feed.write` does
+    (integer columns without decimals, even in the presence of NaNs).
+    """
+    df = df.copy()
+    for col in set(_constants().INT_COLS) & set(df.columns):
+        df[col] = df[col].fillna(-1).astype(int).astype(str).replace("-1", "")
+    df.to_csv(buf, index=False, header=header, float_format=f"%.{ndigits}f")
+
+
+def write_feed(
+    feed: Feed,
+    p: Path,
+    stop_times: Iterable[DataFrame] | None = None,
+    ndigits: int = 6,
+):
+    """
+    Write the feed as GTFS zip file.
+
+    If `stop_times` is given, the stop times are taken from there
+    (instead of `feed.stop_times`) and streamed into the zip file chunk by chunk,
+    i.e. they never need to be in memory at once.
+    The header is that of the first chunk, the columns of all later chunks
+    are aligned to it (columns missing in a chunk are written empty).
+    """
+    with zipfile.ZipFile(p, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for table in gtfs_tables():
+            if table == "stop_times" and stop_times is not None:
+                chunks = stop_times
+            else:
+                df = getattr(feed, table)
+                if df is None:
+                    continue
+                chunks = [df]
+            with zf.open(f"{table}.txt", "w") as member:
+                buf = io.TextIOWrapper(member, encoding="utf-8", newline="")
+                columns = None
+                for chunk in chunks:
+                    header = columns is None
+                    if header:
+                        columns = chunk.columns
+                    elif not chunk.columns.equals(columns):
+                        chunk = chunk.reindex(columns=columns)
+                    to_gtfs_csv(chunk, buf, header, ndigits)
+                buf.flush()
+                buf.detach()
@@ -1,19 +1,37 @@
+from __future__ import annotations
+
+import copy
+import dataclasses
 import logging
 import math
-from collections.abc import Collection
+from collections.abc import Collection, Mapping
 from dataclasses import dataclass
 from datetime import date
 from pathlib import Path
+from typing import TYPE_CHECKING, Self
 
-import gtfs_kit as gk
-import gtfs_kit.helpers as hp
+import numpy as np
 import pandas as pd
-from gtfs_kit.feed import Feed
-from gtfs_kit.miscellany import restrict_to_dates
-from gtfs_kit.stop_times import append_dist_to_stop_times
 from pandas import DataFrame, Series
 
-from gtfs_fiddler.gtfs_time import GtfsTime
+from gtfs_fiddler import (
+    blocks,
+    feed_io,
+    kernels,
+    matsim,
+    patterns,
+    prune,
+    shape_dist,
+    spatial,
+    timetable,
+)
+from gtfs_fiddler.delta import AppendOnlyTable
+from gtfs_fiddler.segments import SegmentSpeedIndex, StopArea
+from gtfs_fiddler.diff import FeedDiff, diff_feeds
+from gtfs_fiddler.gtfs_time import GtfsTime, to_gtfs_kit_raw, to_seconds
+
+if TYPE_CHECKING:
+    from gtfs_kit.feed import Feed
 
 logger = logging.getLogger(__name__)
 
@@ -35,71 +53,163 @@ def cumcount(s: Series):
     return s.to_frame(name="x").groupby(by="x").cumcount().add(1)
 
 
-def compute_stop_time_stats(feed: Feed):
+def compute_stop_time_stats(
+    feed: Feed,
+    shape_dist_cache: dict[tuple, np.ndarray] | None = None,
+    stop_times: DataFrame | None = None,
+):
     """
-    returns a copy of the stop_times df with the additional columns
+    returns a copy of the stop_times df (sorted by trip_id and stop_sequence) with the additional columns
     `seconds_to_next_stop`, `dist_to_next_stop`, `speed` (in either mph or kph depending on the feed's distance unit).
     Also `arrival_time` and `departure_time` are converted to GtfsTime.
+
+    For computing the stats missing times of a trip are interpolated proportionally
+    to the shape distance. Missing distances are interpolated proportionally to the
+    time (or the stop position for stops without time) beforehand.
+    The interpolated times are available as `arrival_seconds` and `departure_seconds`,
+    `arrival_time` and `departure_time` keep the original (possibly missing) values.
+
+    If the feed has no `shape_dist_traveled` it is computed from the shapes
+    with `shape_dist.compute_shape_dist_traveled` (using `shape_dist_cache`).
+    If `stop_times` is given, the stats are computed for them instead of the
+    feed's stop_times (e.g. only for some trips).
     """
-    st = feed.stop_times
-    if "shape_dist_traveled" in st.columns:
-        st = st.copy()
-    else:
-        st = append_dist_to_stop_times(feed).stop_times
+    st = feed.stop_times if stop_times is None else stop_times
+    if "shape_dist_traveled" not in st.columns:
+        st = shape_dist.compute_shape_dist_traveled(feed, shape_dist_cache, st)
+    st = st.sort_values(by=["trip_id", "stop_sequence"])
+    boundaries = kernels.trip_boundaries(st.trip_id.to_numpy())
+
+    arrival = to_seconds(st.arrival_time)
+    departure = to_seconds(st.departure_time)
+    arrival, departure = (
+        np.where(np.isnan(arrival), departure, arrival),
+        np.where(np.isnan(departure), arrival, departure),
+    )
 
     # convert to km or mi
+    import gtfs_kit.helpers as hp
+
     if hp.is_metric(feed.dist_units):
         convert_dist = hp.get_convert_dist(feed.dist_units, "km")
     else:
         convert_dist = hp.get_convert_dist(feed.dist_units, "mi")
-    st.shape_dist_traveled = st.shape_dist_traveled.apply(convert_dist).ffill()
-
-    # ffill arrival and departure times for distance / seconds computation
-    # but keep the original to set it before returning
-    arrival_time_orig = st.arrival_time.apply(GtfsTime)
-    departure_time_orig = st.departure_time.apply(GtfsTime)
-    st.arrival_time = st.arrival_time.ffill().apply(GtfsTime)
-    st.departure_time = st.departure_time.ffill().apply(GtfsTime)
-
-    def seconds_to_next_stop(df):
-        departure = df.departure_time.reset_index(drop=True).apply(
-            lambda v: v.seconds_of_day
-        )
-        arrival = (
-            df.arrival_time[1:].reset_index(drop=True).apply(lambda v: v.seconds_of_day)
-        )
-        return arrival - departure
-
-    st = st.sort_values(by=["trip_id", "stop_sequence"])
-    st["seconds_to_next_stop"] = (
-        st.groupby(["trip_id"]).apply(seconds_to_next_stop).values
-    )
-    st["dist_to_next_stop"] = (
-        st.groupby("trip_id")["shape_dist_traveled"].diff(periods=-1) * -1
-    )
+    dist = convert_dist(st.shape_dist_traveled.to_numpy(dtype=float))
+    dist = kernels.interpolate(dist, arrival, boundaries)
+    dist = kernels.interpolate(dist, np.arange(len(st), dtype=float), boundaries)
+    st["shape_dist_traveled"] = dist
+
+    # leave the previous stop at its departure and reach the next one at its arrival
+    interpolated = kernels.interpolate(departure, dist, boundaries, arrival)
+    arrival = np.where(np.isnan(arrival), interpolated, arrival)
+    departure = np.where(np.isnan(departure), interpolated, departure)
+    st["arrival_seconds"] = arrival
+    st["departure_seconds"] = departure
+
+    # the last stop of each trip has no next stop
+    last = boundaries[1:][np.diff(boundaries) > 0] - 1
+    seconds_to_next_stop = np.roll(arrival, -1) - departure
+    seconds_to_next_stop[last] = math.nan
+    dist_to_next_stop = np.roll(dist, -1) - dist
+    dist_to_next_stop[last] = math.nan
+    st["seconds_to_next_stop"] = seconds_to_next_stop
+    st["dist_to_next_stop"] = dist_to_next_stop
     # speed in distance unit per hour
     st["speed"] = st.dist_to_next_stop / (st.seconds_to_next_stop / 3600)
 
-    st.arrival_time = arrival_time_orig
-    st.departure_time = departure_time_orig
+    st.arrival_time = st.arrival_time.apply(GtfsTime)
+    st.departure_time = st.departure_time.apply(GtfsTime)
     return st
 
 
+def _min_speed_times(
+    st: DataFrame, boundaries: np.ndarray, speeds: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    `kernels.segment_min_speed_times` for the output of `compute_stop_time_stats`
+    (with one speed per stop time, i.e. for the segment to the next stop).
+    The kernel works on the interpolated times,
+    but stops without times in the original feed stay without times.
+    """
+    arrival, departure = kernels.segment_min_speed_times(
+        st.arrival_seconds.to_numpy(),
+        st.departure_seconds.to_numpy(),
+        st.seconds_to_next_stop.to_numpy(),
+        st.dist_to_next_stop.to_numpy(),
+        boundaries,
+        speeds,
+    )
+    arrival[st.arrival_time.map(GtfsTime.isnan).to_numpy(dtype=bool)] = math.nan
+    departure[st.departure_time.map(GtfsTime.isnan).to_numpy(dtype=bool)] = math.nan
+    return arrival, departure
+
+
 @dataclass(frozen=True)
 class FiddleFilter:
     """
     Specify which routes should be affected.
     If both types and ids are given they are combined with AND (not OR).
+
+    `area` selects the routes with at least one trip serving a stop within
+    a `spatial.BBox`, `spatial.Radius` or shapely geometry (in lon/lat),
+    see `GtfsFiddler.resolve_filter`.
     """
 
     route_types: Collection[int] | None = None
     route_ids: Collection[str] | None = None
     route_short_names: Collection[str] | None = None
+    area: spatial.Area | None = None
 
 
 NO_FILTER = FiddleFilter()
 
 
+def filtered_route_ids(routes: DataFrame, filter: FiddleFilter) -> set[str]:
+    """
+    Ids of the routes selected by the filter
+    (with its area already resolved, see `GtfsFiddler.resolve_filter`)
+    """
+    if filter.area is not None:
+        raise ValueError("the filter's area must be resolved to route ids first")
+    selected = np.ones(len(routes), dtype=bool)
+    if filter.route_types is not None:
+        selected &= routes.route_type.isin(filter.route_types).to_numpy()
+    if filter.route_ids is not None:
+        selected &= routes.route_id.isin(filter.route_ids).to_numpy()
+    if filter.route_short_names is not None:
+        selected &= routes.route_short_name.isin(filter.route_short_names).to_numpy()
+    return set(routes.route_id[selected])
+
+
+@dataclass(frozen=True)
+class DepartureTargets:
+    """
+    Target departure times per route (see `GtfsFiddler.ensure_departures`):
+    per route id, else per route type, else `default` (None: no target).
+    """
+
+    default: GtfsTime | None = None
+    route_types: Mapping[int, GtfsTime] | None = None
+    route_ids: Mapping[str, GtfsTime] | None = None
+
+    def per_route(self, routes: DataFrame) -> Series:
+        """
+        Target in seconds of day per route_id (NaN for routes without target)
+        """
+        seconds = {}
+        if self.default is not None:
+            seconds = {id: self.default.seconds_of_day for id in routes.route_id}
+        for route_type, time in (self.route_types or {}).items():
+            ids = routes.route_id[routes.route_type == route_type]
+            seconds.update({id: time.seconds_of_day for id in ids})
+        for id, time in (self.route_ids or {}).items():
+            seconds[id] = time.seconds_of_day
+        return Series(seconds, index=routes.route_id, dtype=float)
+
+
+BACKENDS = ("pandas", "polars")
+
+
 class GtfsFiddler:
     """
     Built on top of gtfs_kit.Feed to:
@@ -107,24 +217,98 @@ class GtfsFiddler:
     1. Add additional trips
        - Earliest trip in the morning (for a specific time) with `GtfsFiddler.ensure_earliest_departure`
        - Latest trip in the evening (for a specific time) with `GtfsFiddler.ensure_latest_departure`
+       - Both at once, with target times per route, with `GtfsFiddler.ensure_departures`
        - Trips to shorten intervals (for a specified maximum interval duration) with `GtfsFiddler.ensure_max_trip_interval`
     2. Increase speed of trips (for a specified average speed between two stops) with `GtfsFiddler.ensure_min_speed`
+    3. Remove trips (for a specified minimum interval duration) with `GtfsFiddler.ensure_min_headway`
+       and everything no longer used by any trip with `GtfsFiddler.prune`
 
     All `ensure_*` methods take a `FiddleFilter` that can be omitted to affect all routes,
     or specified to only affect specific route types or ids.
 
+    With `backend="polars"` the enrichment of trips and all `ensure_*` methods
+    are computed with (multi-threaded) Polars instead of pandas,
+    see `gtfs_fiddler.polars_backend`.
+
     Also it provides typed access to the more of the feed's members (for autocompletion in IDE :)
     """
 
-    def __init__(self, p: Path, dist_units: str, restrict_to_date: date | None = None):
-        self._original_feed = gk.read_feed(p, dist_units=dist_units)
-        self._original_feed.validate()
+    def __init__(
+        self,
+        p: Path,
+        dist_units: str,
+        restrict_to_date: date | None = None,
+        backend: str = "pandas",
+    ):
+        # the same as `gtfs_kit.read_feed`, but reading the tables concurrently
+        original_feed = feed_io.read_feed(p, dist_units)
+        original_feed.validate()
+        self._init_feed(original_feed, restrict_to_date, backend)
+        # self._sorted_trips = GtfsFiddler._update_sorted_trips(self._feed)
+
+    @classmethod
+    def from_feed(
+        cls,
+        feed: Feed,
+        restrict_to_date: date | None = None,
+        backend: str = "pandas",
+    ) -> Self:
+        """
+        Create a fiddler for an already loaded feed (without validating it again).
+        The feed itself is not changed by the `ensure_*` methods.
+        """
+        fiddler = cls.__new__(cls)
+        fiddler._init_feed(feed, restrict_to_date, backend)
+        return fiddler
+
+    def _init_feed(
+        self, original_feed: Feed, restrict_to_date: date | None, backend: str
+    ):
+        if backend not in BACKENDS:
+            raise ValueError(f"backend must be one of {BACKENDS} but got {backend}")
+        if backend == "polars":
+            # optional dependency, only import when requested
+            from gtfs_fiddler import polars_backend
+
+            self._polars = polars_backend
+        else:
+            self._polars = None
+        self._original_feed = original_feed
+        # (stop_times, stats) of the last `stop_time_stats` call
+        self._stop_time_stats: tuple[DataFrame, DataFrame] | None = None
+        # (stop_times, patterns) of the last `stop_patterns` call
+        self._stop_patterns: tuple[DataFrame, DataFrame] | None = None
+        # (trips, stop_times, stats) of the last `trip_stats` call,
+        # kept up to date when trips are copied by the `ensure_*` methods
+        self._trip_stats: tuple[DataFrame, DataFrame, DataFrame] | None = None
+        # trips and stop times added by the `ensure_*` methods since the feed's
+        # tables were last materialized, see `delta`
+        self._added_trips = AppendOnlyTable("trip_id")
+        self._added_stop_times = AppendOnlyTable("trip_id", "stop_sequence")
+        # number of added stop time segments to sort with the feed's stop times
+        # (by `ensure_max_trip_interval`)
+        self._sorted_stop_time_segments = 0
+        # the stop times if they are sorted by trip_id and stop_sequence,
+        # kept sorted (as long as possible) to merge instead of sort added stop times
+        self._sorted_stop_times: DataFrame | None = None
+        # grid and stop -> trip index of the feed before fiddling, see `stop_index`
+        self._stop_index: spatial.StopIndex | None = None
+        # (stop_times, index) of the last `timetable_index` call
+        self._timetable_index: tuple[DataFrame, timetable.TimetableIndex] | None = None
+        # distances per (shape_id, stop pattern), see `shape_dist`
+        self._shape_dist_cache: dict[tuple, np.ndarray] = {}
         if restrict_to_date is not None:
+            from gtfs_kit.miscellany import restrict_to_dates
+
             datestr = restrict_to_date.isoformat().replace("-", "")
-            self._feed = restrict_to_dates(self._original_feed, [datestr])
+            self._base_feed = restrict_to_dates(self._original_feed, [datestr])
         else:
-            self._feed = self._original_feed
-        # self._sorted_trips = GtfsFiddler._update_sorted_trips(self._feed)
+            self._base_feed = self._original_feed
+        # the `ensure_*` methods replace (and never modify) the feed's tables,
+        # so a shallow copy is enough to keep the unmodified feed for `diff`
+        self._feed = copy.copy(self._base_feed)
+        if self._added_stop_times.is_sorted(self._feed.stop_times):
+            self._sorted_stop_times = self._feed.stop_times
 
     def trips_enriched(self, filter: FiddleFilter = NO_FILTER) -> DataFrame:
         """
@@ -134,8 +318,11 @@ class GtfsFiddler:
         """
         # TODO actually we don't need the distance for most calls
         # of this method. avoiding these calculations could improve runtimes.
+        filter = self.resolve_filter(filter)
+        if self._polars is not None:
+            return self._polars.trips_enriched(self.feed, filter)
 
-        trip_stats = self._feed.compute_trip_stats()
+        trip_stats = self.trip_stats()
         old_len = len(trip_stats)
         if filter.route_types is not None:
             trip_stats = trip_stats.query("route_type in @filter.route_types")
@@ -151,7 +338,8 @@ class GtfsFiddler:
         # add all columns previously present again
         missing_cols = set(self._feed.trips.columns) - set(trip_stats.columns)
         missing_cols.add("trip_id")
-        trip2service = self._feed.trips[sorted(missing_cols)]
+        trip2service, _ = self._added_trips.rows(self._feed.trips, trip_stats.trip_id)
+        trip2service = trip2service[sorted(missing_cols)]
         df = trip_stats.join(trip2service.set_index("trip_id"), on="trip_id")
         df.start_time = df.start_time.apply(GtfsTime)
         df.end_time = df.end_time.apply(GtfsTime)
@@ -159,38 +347,298 @@ class GtfsFiddler:
         if len(df) == 0:
             return df
 
-        def time_to_next_trip(df):
-            start = df.start_time.reset_index(drop=True)
-            next_start = df.start_time[1:].reset_index(drop=True)
-            return next_start - start
-
         df = df.sort_values(by=["route_id", "direction_id", "start_time"])
-        df["time_to_next_trip"] = (
-            df.groupby(["route_id", "direction_id"], dropna=False)
-            .apply(time_to_next_trip)
-            .values
+        # note: groupby().apply() would return a (wrongly shaped) DataFrame
+        # in case all groups have the same size, so shift instead
+        start = df.start_time.apply(lambda v: v.seconds_of_day)
+        next_start = start.groupby([df.route_id, df.direction_id], dropna=False).shift(
+            -1
+        )
+        df["time_to_next_trip"] = (next_start - start).apply(
+            lambda v: math.nan if math.isnan(v) else GtfsTime(v)
         )
 
         return df
 
+    def fork(self) -> Self:
+        """
+        An independent fiddler for the current feed, e.g. to run several scenarios
+        starting from the same (warm) fiddler. Both fiddlers share the feed's tables
+        (which are replaced and never modified by the `ensure_*` methods)
+        and all cached stats and indexes, which are only computed once.
+        """
+        self._materialize()
+        fiddler = copy.copy(self)
+        fiddler._feed = copy.copy(self._feed)
+        fiddler._added_trips = AppendOnlyTable("trip_id")
+        fiddler._added_stop_times = AppendOnlyTable("trip_id", "stop_sequence")
+        return fiddler
+
     @property
     def feed(self) -> Feed:
+        self._materialize()
         return self._feed
 
+    def _materialize(self):
+        """
+        Append the trips and stop times added since the last call
+        to the feed's tables (with a single concat per table).
+        """
+        if not self._added_trips.segments and not self._added_stop_times.segments:
+            return
+        trips, stop_times = self._feed.trips, self._feed.stop_times
+        num_segments = len(self._added_stop_times.segments)
+        self._feed.trips = self._added_trips.materialize(trips)
+        self._feed.stop_times = self._added_stop_times.materialize(
+            stop_times,
+            self._sorted_stop_time_segments,
+            base_sorted=stop_times is self._sorted_stop_times,
+        )
+        if num_segments > 0:
+            # still sorted if all added stop times were sorted into it
+            all_sorted = self._sorted_stop_time_segments == num_segments
+            self._sorted_stop_times = self._feed.stop_times if all_sorted else None
+        self._sorted_stop_time_segments = 0
+        # the cached trip stats already include the added trips
+        if self._trip_stats_valid(trips, stop_times):
+            self._trip_stats = (
+                self._feed.trips,
+                self._feed.stop_times,
+                self._trip_stats[2],
+            )
+
     @property
     def routes(self) -> DataFrame:
         return self._feed.routes
 
     @property
     def trips(self) -> DataFrame:
-        return self._feed.trips
+        return self.feed.trips
 
     def trips_for_route(self, route_id, direction_id) -> DataFrame:
-        return trips_for_route(self._feed.trips, route_id, direction_id)
+        return trips_for_route(self.trips, route_id, direction_id)
 
     @property
     def stop_times(self) -> DataFrame:
-        return self._feed.stop_times
+        return self.feed.stop_times
+
+    def _stop_times_by_trip(self) -> DataFrame:
+        """
+        A copy of the stop times sorted by trip_id and stop_sequence (with reset index),
+        only sorted if they are not known to be sorted already.
+        """
+        st = self.stop_times
+        if st is not self._sorted_stop_times:
+            st = st.sort_values(["trip_id", "stop_sequence"])
+        return st.reset_index(drop=True)
+
+    def stop_time_stats(self) -> DataFrame:
+        """
+        `compute_stop_time_stats` of the feed, cached as long as
+        the feed's stop_times are not replaced.
+        Note, that in-place modifications of the stop_times are not detected.
+        """
+        stop_times = self.stop_times
+        if self._stop_time_stats is None or self._stop_time_stats[0] is not stop_times:
+            stats = compute_stop_time_stats(self._feed, self._shape_dist_cache)
+            self._stop_time_stats = (stop_times, stats)
+        return self._stop_time_stats[1]
+
+    def trip_stats(self) -> DataFrame:
+        """
+        `gtfs_kit.Feed.compute_trip_stats` of the feed, cached as long as
+        the feed's trips and stop_times are not replaced
+        (except by the `ensure_*` methods adding copies of trips, which keep it up to date).
+        Note, that in-place modifications of the trips or stop_times are not detected.
+        """
+        trips, stop_times = self._feed.trips, self._feed.stop_times
+        if not self._trip_stats_valid(trips, stop_times):
+            trips, stop_times = self.trips, self.stop_times
+            self._trip_stats = (trips, stop_times, self._feed.compute_trip_stats())
+        return self._trip_stats[2]
+
+    def _trip_stats_valid(self, trips: DataFrame, stop_times: DataFrame) -> bool:
+        return (
+            self._trip_stats is not None
+            and self._trip_stats[0] is trips
+            and self._trip_stats[1] is stop_times
+        )
+
+    def _copy_trip_stats(
+        self,
+        trips: DataFrame,
+        stop_times: DataFrame,
+        original_trip_ids: Series,
+        trip_ids: Series,
+        offsets: np.ndarray,
+    ):
+        """
+        Update the cached trip stats (if valid for the given trips and stop_times
+        before copying) for copies of trips shifted by the given seconds,
+        instead of computing them again for the whole feed.
+        """
+        if not self._trip_stats_valid(trips, stop_times):
+            return
+        stats = self._trip_stats[2]
+        copies = stats.set_index("trip_id").loc[original_trip_ids].reset_index()
+        copies["trip_id"] = np.asarray(trip_ids)
+        for col in ["start_time", "end_time"]:
+            copies[col] = to_gtfs_kit_raw(to_seconds(copies[col]) + offsets)
+        # same order and index as computed by gtfs_kit
+        stats = pd.concat([stats, copies]).sort_values("trip_id")
+        stats = stats.reset_index(drop=True)
+        stats = stats.sort_values(["route_id", "direction_id", "start_time"])
+        self._trip_stats = (self._feed.trips, self._feed.stop_times, stats)
+
+    def _append_copies(self, copies: DataFrame, new_st: DataFrame, sort: bool = False):
+        """
+        Add copies of trips (`trip_id`, `new_trip_id` and `offset` in seconds,
+        e.g. computed by the polars backend) with their (already shifted) stop times,
+        keeping the cached trip stats up to date. With `sort` the stop times are
+        sorted into the feed's stop times when materialized, otherwise appended.
+        """
+        if len(copies) == 0:
+            logger.info("added 0 trips")
+            return
+        trips, stop_times = self._feed.trips, self._feed.stop_times
+        new_trips, _ = self._added_trips.rows(trips, copies.trip_id)
+        new_trips.trip_id = copies.new_trip_id.to_numpy()
+        self._added_trips.append(new_trips)
+        self._added_stop_times.append(new_st)
+        if sort:
+            self._sorted_stop_time_segments = len(self._added_stop_times.segments)
+        self._copy_trip_stats(
+            trips,
+            stop_times,
+            copies.trip_id,
+            copies.new_trip_id,
+            copies.offset.to_numpy(dtype=float),
+        )
+        logger.info(f"added {len(copies)} trips")
+
+    def stop_patterns(self) -> DataFrame:
+        """
+        `patterns.compute_stop_patterns` of the feed, i.e. each trip as pattern
+        and start time, cached as long as the feed's stop_times are not replaced.
+        """
+        stop_times = self.stop_times
+        if self._stop_patterns is None or self._stop_patterns[0] is not stop_times:
+            trips = patterns.compute_stop_patterns(self._feed)
+            self._stop_patterns = (stop_times, trips)
+        return self._stop_patterns[1]
+
+    def stop_index(self) -> spatial.StopIndex:
+        """
+        `spatial.StopIndex` of the feed before fiddling (built once),
+        trips added by fiddling serve the same stops as their original trips.
+        """
+        if self._stop_index is None:
+            self._stop_index = spatial.StopIndex(
+                self._base_feed.stops,
+                self._base_feed.stop_times,
+                self._base_feed.trips,
+            )
+        return self._stop_index
+
+    def timetable_index(self) -> timetable.TimetableIndex:
+        """
+        `timetable.TimetableIndex` of the (fiddled) feed,
+        cached as long as the feed's stop_times are not replaced.
+        """
+        stop_times = self.stop_times
+        if self._timetable_index is None or self._timetable_index[0] is not stop_times:
+            index = timetable.TimetableIndex(stop_times, self.trips)
+            self._timetable_index = (stop_times, index)
+        return self._timetable_index[1]
+
+    def next_departures(
+        self,
+        stop_id: str,
+        after: GtfsTime | str | int,
+        n: int = 5,
+        route_id: str | None = None,
+    ) -> list[timetable.Departure]:
+        """
+        The next `n` departures at the stop (of the route, if given)
+        at or after the given time, see `timetable_index`.
+        """
+        return self.timetable_index().next_departures(stop_id, after, n, route_id)
+
+    def resolve_filter(self, filter: FiddleFilter) -> FiddleFilter:
+        """
+        The filter with its `area` replaced by the ids of the routes touching it
+        (combined with the filter's `route_ids` with AND), see `stop_index`.
+        """
+        if filter.area is None:
+            return filter
+        route_ids = self.stop_index().route_ids(filter.area)
+        if filter.route_ids is not None:
+            route_ids &= set(filter.route_ids)
+        logger.info(f"{len(route_ids)} routes within the filter's area")
+        return dataclasses.replace(
+            filter, route_ids=tuple(sorted(route_ids)), area=None
+        )
+
+    def write_matsim(
+        self,
+        schedule_path: Path,
+        vehicles_path: Path,
+        crs: str | None = None,
+        vehicle_types: dict[str, matsim.VehicleType] | None = None,
+    ):
+        """
+        Write the feed as MATSim transit schedule and vehicles
+        (reusing the cached stop patterns), see `matsim.write_schedule`.
+        """
+        matsim.write_schedule(
+            self.feed,
+            schedule_path,
+            vehicles_path,
+            self.stop_patterns(),
+            crs,
+            vehicle_types,
+        )
+
+    def diff(self, detail: bool = False) -> FeedDiff:
+        """
+        Compare the current feed with the feed before fiddling
+        (the original feed restricted to the date, if given), see `diff.FeedDiff`.
+        Per trip details are only computed if `detail` is set.
+
+        Note, that modifications of the feed's tables in place
+        (instead of replacing them) are not detected.
+        """
+        return diff_feeds(self._base_feed, self.feed, detail)
+
+    def assign_blocks(self, min_layover_minutes: float = 0) -> blocks.VehicleCount:
+        """
+        Assign the trips added by the `ensure_*` methods (which copy the `block_id`
+        of the original trip) to existing vehicle blocks with enough time
+        (including the given layover before and after each trip) or to new blocks,
+        see `blocks`.
+
+        Returns the vehicles required afterwards.
+        """
+        trips = self.trips.copy()
+        added = ~trips.trip_id.isin(self._base_feed.trips.trip_id)
+        block_ids = blocks.assign_blocks(
+            self._feed, trips.trip_id[added], min_layover_minutes * 60
+        )
+        if "block_id" not in trips.columns:
+            trips["block_id"] = math.nan
+        trips["block_id"] = trips.block_id.astype(object)
+        trips.loc[added, "block_id"] = trips.trip_id[added].map(block_ids)
+        self._feed.trips = trips
+
+        count = self.vehicle_count()
+        logger.info(f"assigned {added.sum()} trips to blocks, {count}")
+        return count
+
+    def vehicle_count(self) -> blocks.VehicleCount:
+        """
+        Vehicles required by the current feed, see `blocks.VehicleCount`.
+        """
+        return blocks.vehicle_count(self.feed)
 
     def tripcount_per_route_and_service(self) -> Series:
         return self.trips.groupby(["route_id", "service_id"]).size()
@@ -207,7 +655,7 @@ class GtfsFiddler:
         departs later than the given time,
         this trip is copied and set to start at that time.
         """
-        self._ensure_earliest_or_latest_departure(target_time, filter, True)
+        self.ensure_departures(earliest=target_time, filter=filter)
 
     def ensure_latest_departure(
         self, target_time: GtfsTime, filter: FiddleFilter = NO_FILTER
@@ -217,7 +665,7 @@ class GtfsFiddler:
         departs earlier than the given time,
         this trip is copied and set to start at that time.
         """
-        self._ensure_earliest_or_latest_departure(target_time, filter, False)
+        self.ensure_departures(latest=target_time, filter=filter)
 
     def ensure_max_trip_interval(self, minutes: int, filter: FiddleFilter = NO_FILTER):
         """
@@ -227,9 +675,21 @@ class GtfsFiddler:
         Note, that this only works reliably if the feed was reduced to a single day.
         Otherwise the trips sorted by start time will be intermixed for different days.
         """
+        filter = self.resolve_filter(filter)
+        if self._polars is not None:
+            copies, new_st = self._polars.ensure_max_trip_interval(
+                self.feed, minutes, filter
+            )
+            # sorted into the stop times (once) when materialized
+            self._append_copies(copies, new_st, sort=True)
+            return
+
         suffix = "#densify"
         # get trips enriched with arrival/departure times
         t = self.trips_enriched(filter)
+        if len(t) == 0:
+            logger.info("added 0 trips")
+            return
         t = t[t.time_to_next_trip > GtfsTime(minutes * 60)]
 
         # multiply trips as required, calculate their time shift
@@ -246,96 +706,200 @@ class GtfsFiddler:
         ccount = cumcount(t.trip_id)
         t["trip_id"] = t["trip_id"] + ccount.astype(str)
         t["offset_seconds"] = t["offset_seconds"] * ccount
-        self._feed.trips = pd.concat([self.trips, t[self.trips.columns]]).reset_index(
-            drop=True
+        if len(t) == 0:
+            logger.info("added 0 trips")
+            return
+        trips, stop_times = self._feed.trips, self._feed.stop_times
+        self._added_trips.append(t[trips.columns].reset_index(drop=True))
+
+        # copy the stop times of the original trips (in the order of the new trips)
+        # and shift all of them at once
+        new_st, lengths = self._added_stop_times.rows(stop_times, t.trip_id_original)
+        new_st.trip_id = np.repeat(t.trip_id.to_numpy(), lengths)
+        arrival, departure = kernels.shift_times(
+            to_seconds(new_st.arrival_time),
+            to_seconds(new_st.departure_time),
+            np.concatenate([[0], np.cumsum(lengths)]),
+            t.offset_seconds.to_numpy(dtype=float),
+        )
+        new_st.arrival_time = to_gtfs_kit_raw(arrival)
+        new_st.departure_time = to_gtfs_kit_raw(departure)
+        # sorted into the stop times (once) when materialized
+        self._added_stop_times.append(new_st)
+        self._sorted_stop_time_segments = len(self._added_stop_times.segments)
+        self._copy_trip_stats(
+            trips,
+            stop_times,
+            t.trip_id_original,
+            t.trip_id,
+            t.offset_seconds.to_numpy(dtype=float),
         )
 
-        # copy required start times
-        st = self.stop_times.set_index("trip_id")
-        st.arrival_time = st.arrival_time.apply(GtfsTime)
-        st.departure_time = st.departure_time.apply(GtfsTime)
-        st = st.sort_values(["trip_id", "stop_sequence"])
-
-        def _lambda(s):
-            df = st.loc[s.trip_id_original]
-            df = GtfsFiddler._adjust_stop_times(
-                df, adjustment_seconds=s.offset_seconds
-            ).reset_index()
-            df.trip_id = s.trip_id
-            return df
+        logger.info(f"added {len(t)} trips")
 
-        collected_stop_times = t[
-            ["trip_id", "trip_id_original", "offset_seconds"]
-        ].apply(_lambda, axis=1)
-        new_st = pd.concat(list(collected_stop_times))
-        new_st.arrival_time = new_st.arrival_time.apply(str)
-        new_st.departure_time = new_st.departure_time.apply(str)
+    def ensure_min_headway(self, minutes: float, filter: FiddleFilter = NO_FILTER):
+        """
+        Counterpart of `ensure_max_trip_interval`: thin out trips (per route_id +
+        direction_id) so that no two remaining trips depart less than the given
+        minutes apart. Starting with the earliest trip, each trip departing
+        at least `minutes` after the last remaining one is kept, all others are removed
+        (with their stop times and frequencies, see `prune` for stops, shapes, ..
+        no longer used).
+
+        Runs on pandas for both backends.
+        Note, that this only works reliably if the feed was reduced to a single day.
+        """
+        filter = self.resolve_filter(filter)
+        route_ids = filtered_route_ids(self.routes, filter)
+        stats = self.trip_stats()
+        t = stats[stats.route_id.isin(route_ids).to_numpy()]
+        t = t.assign(start=to_seconds(t.start_time))
+        t = t.sort_values(["route_id", "direction_id", "start"], kind="stable")
+        groups = t.groupby(["route_id", "direction_id"], dropna=False, sort=False)
+        keep = kernels.thin(
+            t.start.to_numpy(dtype=float),
+            kernels.trip_boundaries(groups.ngroup().to_numpy()),
+            float(minutes * 60),
+        )
+        self._remove_trips(t.trip_id[~keep])
 
-        all_st = pd.concat([self.stop_times, new_st]).reset_index(drop=True)
-        self._feed.stop_times = all_st.sort_values(["trip_id", "stop_sequence"])
+    def _remove_trips(self, trip_ids: Series):
+        """
+        Remove the trips with their stop times and frequencies,
+        keeping the cached trip stats up to date.
+        """
+        if len(trip_ids) == 0:
+            logger.info("removed 0 trips")
+            return
+        trips, stop_times = self.trips, self.stop_times
+        self._feed.trips = trips[~trips.trip_id.isin(trip_ids)].reset_index(drop=True)
+        self._feed.stop_times = stop_times[
+            ~stop_times.trip_id.isin(trip_ids)
+        ].reset_index(drop=True)
+        if stop_times is self._sorted_stop_times:
+            self._sorted_stop_times = self._feed.stop_times
+        if self._feed.frequencies is not None:
+            frequencies = self._feed.frequencies
+            self._feed.frequencies = frequencies[~frequencies.trip_id.isin(trip_ids)]
+        if self._trip_stats_valid(trips, stop_times):
+            stats = self._trip_stats[2]
+            stats = stats[~stats.trip_id.isin(trip_ids)]
+            # same order and index as computed by gtfs_kit
+            stats = stats.sort_values("trip_id").reset_index(drop=True)
+            stats = stats.sort_values(["route_id", "direction_id", "start_time"])
+            self._trip_stats = (self._feed.trips, self._feed.stop_times, stats)
+        logger.info(f"removed {len(trip_ids)} trips")
+
+    def prune(self, columns: Mapping[str, Collection[str]] | None = None):
+        """
+        Remove all stops, shapes, services, routes, .. not used by any trip
+        and empty columns (or all optional columns not in `columns` per table),
+        e.g. after `ensure_min_headway`, see `prune.prune_feed`.
 
-        logger.info(f"added {len(t)} trips")
+        Typically the last step before writing the feed, since the other methods
+        need some optional columns (e.g. `trips.direction_id`).
+        """
+        sorted_before = self.stop_times is self._sorted_stop_times
+        self._feed = prune.prune_feed(self.feed, columns)
+        if sorted_before:
+            self._sorted_stop_times = self._feed.stop_times
 
-    def _ensure_earliest_or_latest_departure(
-        self, target_time: GtfsTime, filter: FiddleFilter, earliest: bool
+    def ensure_departures(
+        self,
+        earliest: DepartureTargets | GtfsTime | None = None,
+        latest: DepartureTargets | GtfsTime | None = None,
+        filter: FiddleFilter = NO_FILTER,
     ):
-        suffix = "#early" if earliest else "#late"
+        """
+        `ensure_earliest_departure` and `ensure_latest_departure` in a single pass
+        (i.e. with a single `trips_enriched` call), with target times per route id
+        or route type (see `DepartureTargets`, a plain `GtfsTime` applies to all routes).
+        Routes without target time are not changed.
+
+        The result is the same as calling `ensure_earliest_departure`
+        and then `ensure_latest_departure`.
+        """
+        filter = self.resolve_filter(filter)
+        if isinstance(earliest, GtfsTime):
+            earliest = DepartureTargets(earliest)
+        if isinstance(latest, GtfsTime):
+            latest = DepartureTargets(latest)
+        earliest, latest = (
+            None if t is None else t.per_route(self.routes) for t in (earliest, latest)
+        )
+        if self._polars is not None:
+            copies, new_st = self._polars.ensure_departures(
+                self.feed, earliest, latest, filter
+            )
+            self._append_copies(copies, new_st)
+            return
+
         # get trips enriched with arrival/departure times
         t = self.trips_enriched(filter)
+        groups = t.groupby(["route_id", "direction_id"], dropna=False)
 
         # find the first/last trip of routes that need adjustment
-        if earliest:
-            first_trip = t.groupby(["route_id", "direction_id"], dropna=False).first()
-            trips_to_adjust = first_trip[first_trip.start_time > target_time].trip_id
-        else:
-            last_trip = t.groupby(["route_id", "direction_id"], dropna=False).last()
-            trips_to_adjust = last_trip[last_trip.start_time < target_time].trip_id
+        # and copy them with suffix and target start time (earliest first)
+        copies = []
+        for targets, suffix, is_earliest in [
+            (earliest, "#early", True),
+            (latest, "#late", False),
+        ]:
+            if targets is None:
+                continue
+            trip = groups.first() if is_earliest else groups.last()
+            start = trip.start_time.map(lambda v: v.seconds_of_day).to_numpy(float)
+            target = trip.index.get_level_values("route_id").map(targets)
+            target = np.asarray(target, dtype=float)
+            adjust = start > target if is_earliest else start < target
+            copies.append(
+                DataFrame(
+                    {
+                        "trip_id": trip.trip_id[adjust].to_numpy(),
+                        "new_trip_id": trip.trip_id[adjust].to_numpy() + suffix,
+                        "target": target[adjust],
+                        "late": not is_earliest,
+                    }
+                )
+            )
+        if not copies:
+            return
+        copies = pd.concat(copies).reset_index(drop=True)
 
-        # copy and adjust these trips, add them to the feed's trips
-        dup_trips = self.trips.set_index("trip_id").loc[trips_to_adjust]
-        dup_trips = dup_trips.copy().reset_index()
-        dup_trips.trip_id = dup_trips.trip_id + suffix
-        self._feed.trips = pd.concat([self.trips, dup_trips]).reset_index(drop=True)
+        # copy these trips and add them to the feed's trips
+        trips, stop_times = self._feed.trips, self._feed.stop_times
+        dup_trips, _ = self._added_trips.rows(trips, copies.trip_id)
+        dup_trips.trip_id = copies.new_trip_id.to_numpy()
+        self._added_trips.append(dup_trips)
 
         # also copy and adjust relevant stop times
-        st = self.stop_times.set_index("trip_id")
-        dup_times = st.loc[trips_to_adjust].copy().reset_index()
-        dup_times.trip_id = dup_times.trip_id + suffix
-        dup_times.arrival_time = dup_times.arrival_time.apply(GtfsTime)
-        dup_times.departure_time = dup_times.departure_time.apply(GtfsTime)
-        dup_times = dup_times.sort_values(["trip_id", "stop_sequence"])
-        dup_times = dup_times.groupby("trip_id").apply(
-            lambda df: GtfsFiddler._adjust_stop_times(df, desired_start=target_time)
-        )
-        dup_times.arrival_time = dup_times.arrival_time.apply(GtfsTime.to_gtfs_kit_raw)
-        dup_times.departure_time = dup_times.departure_time.apply(
-            GtfsTime.to_gtfs_kit_raw
+        # (earliest copies first, each sorted by trip_id and stop_sequence)
+        dup_times, lengths = self._added_stop_times.rows(stop_times, copies.trip_id)
+        dup_times.trip_id = np.repeat(copies.new_trip_id.to_numpy(), lengths)
+        dup_times["_copy"] = np.repeat(copies.index.to_numpy(), lengths)
+        dup_times["_late"] = np.repeat(copies.late.to_numpy(), lengths)
+        dup_times = dup_times.sort_values(["_late", "trip_id", "stop_sequence"])
+        copy_of_trip = dup_times._copy.to_numpy()
+        dup_times = dup_times.drop(columns=["_copy", "_late"])
+        # set the departure time of each trip's first stop to the desired start time
+        # and adjust all other departure and arrival times accordingly
+        arrival = to_seconds(dup_times.arrival_time)
+        departure = to_seconds(dup_times.departure_time)
+        boundaries = kernels.trip_boundaries(dup_times.trip_id.to_numpy())
+        first = copies.iloc[copy_of_trip[boundaries[:-1]]]
+        offsets = first.target.to_numpy() - departure[boundaries[:-1]]
+        arrival, departure = kernels.shift_times(
+            arrival, departure, boundaries, offsets
         )
-        self._feed.stop_times = pd.concat([self.stop_times, dup_times]).reset_index(
-            drop=True
+        dup_times.arrival_time = to_gtfs_kit_raw(arrival)
+        dup_times.departure_time = to_gtfs_kit_raw(departure)
+        self._added_stop_times.append(dup_times)
+        self._copy_trip_stats(
+            trips, stop_times, first.trip_id, first.new_trip_id, offsets
         )
 
         logger.info(f"added {len(dup_trips)} trips")
 
-    @staticmethod
-    def _adjust_stop_times(
-        stop_times: DataFrame,
-        adjustment_seconds: int | None = None,
-        desired_start: GtfsTime | None = None,
-    ):
-        """
-        set the departure time of the first stop to the desired start time
-        and adjust all other departure and arrival times accordingly
-        """
-        if adjustment_seconds is not None:
-            adjustment = GtfsTime(adjustment_seconds)
-        else:
-            adjustment = desired_start - stop_times.iloc[0].departure_time
-
-        stop_times.arrival_time = stop_times.arrival_time + adjustment
-        stop_times.departure_time = stop_times.departure_time + adjustment
-        return stop_times
-
     def ensure_min_speed(
         self,
         route_type2speed: dict[int, float] | None = None,
@@ -347,48 +911,117 @@ class GtfsFiddler:
         of the first stop. If the original travel time was shorter
         than the one calculated with the given speed it is left intact.
 
-        Both route types and ids can be used together to select which routes are affected.
+        Both route types and ids can be used together to select which routes are affected
+        (speeds per route id take precedence over speeds per route type).
         Speed must be given either mph or kph depending on the feed's distance unit.
         """
-        st = compute_stop_time_stats(self.feed)
-        trip2route = self.trips.join(
-            self.routes.set_index("route_id").route_type, on="route_id"
-        )[["trip_id", "route_id", "route_type"]]
-        st = st.join(trip2route.set_index("trip_id"), on="trip_id")
-
-        def adjust_trips_for_route_type(df):
-            route_type = int(df.name)
-            if route_type not in route_type2speed:
-                return df
-            speed = route_type2speed[route_type]
-            new_df = df.groupby("trip_id").apply(
-                lambda v: GtfsFiddler._ensure_min_speed_of_trip(v, speed),
-            )
-            return new_df.reset_index(drop=True)
-
-        # TODO check performance
-        def adjust_trips_for_route_id(df):
-            route_id = str(df.name)
-            if route_id not in route_id2speed:
-                return df
-            speed = route_id2speed[route_id]
-            new_df = df.groupby("trip_id").apply(
-                lambda v: GtfsFiddler._ensure_min_speed_of_trip(v, speed),
+        if self._polars is not None:
+            st = self._stop_times_by_trip()
+            self._polars.ensure_min_speed(
+                self._feed, st, route_type2speed, route_id2speed, self._shape_dist_cache
             )
-            return new_df.reset_index(drop=True)
+            self.feed.stop_times = self._sorted_stop_times = st
+            return
+
+        trips = self.trips.join(
+            self.routes.set_index("route_id").route_type, on="route_id"
+        )
+        speeds = trips.route_id.map(route_id2speed or {})
+        speeds = speeds.fillna(trips.route_type.map(route_type2speed or {}))
+        trip2speed = Series(speeds.to_numpy(dtype=float), index=trips.trip_id)
+
+        # the new times only depend on the pattern and speed,
+        # so they are computed for one representative trip of each
+        t = self.stop_patterns()
+        t = t.assign(speed=t.trip_id.map(trip2speed).to_numpy(dtype=float))
+        t = t[t.speed.notna()]
+        t["key"] = t.groupby(["pattern_id", "speed"]).ngroup()
+        # stop times, their stats and the patterns are sorted by trip_id and stop_sequence
+        st = self._stop_times_by_trip()
+        speeds = np.repeat(t.speed.to_numpy(), t.num_stops)
+        self._ensure_min_speed_per_pattern(st, t, speeds)
+
+    def ensure_segment_min_speed(
+        self,
+        segment2speed: dict[tuple[str, str], float] | None = None,
+        stop_areas: list[StopArea] | None = None,
+        filter: FiddleFilter = NO_FILTER,
+    ):
+        """
+        Like `ensure_min_speed`, but with speeds per segment between two consecutive stops
+        of a trip, given per (from_stop_id, to_stop_id) or for all segments
+        within a `segments.StopArea` (see `segments.SegmentSpeedIndex` for precedence).
+        Only the travel times of the matching segments are reduced
+        (and all following stop times of the trip shifted accordingly).
 
-        new_st = st
-        if route_type2speed is not None:
-            new_st = new_st.groupby("route_type").apply(adjust_trips_for_route_type)
-        if route_id2speed is not None:
-            new_st = new_st.groupby("route_id").apply(adjust_trips_for_route_id)
+        Runs on pandas for both backends.
+        """
+        index = SegmentSpeedIndex(segment2speed, stop_areas or ())
+        st = self._stop_times_by_trip()
+        t = self.stop_patterns()
+        if filter != NO_FILTER:
+            route_ids = filtered_route_ids(self.routes, self.resolve_filter(filter))
+            trip_ids = self.trips.trip_id[self.trips.route_id.isin(route_ids)]
+            t = t[t.trip_id.isin(trip_ids)]
+
+        # look up the rules for all stop times at once,
+        # then only adjust the trips with at least one matching segment
+        rows = patterns.rows_of(t.first_row, t.num_stops)
+        boundaries = np.concatenate([[0], np.cumsum(t.num_stops)])
+        speeds = index.lookup(st.stop_id.to_numpy()[rows], boundaries)
+        matching = np.zeros(len(t), dtype=bool)
+        if len(t) > 0:
+            matching = np.add.reduceat(~np.isnan(speeds), boundaries[:-1]) > 0
+        speeds = speeds[np.repeat(matching, t.num_stops)]
+        t = t[matching]
+        # segment speeds only depend on the stop ids, i.e. on the pattern
+        t = t.assign(key=pd.factorize(t.pattern_id)[0])
+        self._ensure_min_speed_per_pattern(st, t, speeds)
+
+    def _ensure_min_speed_per_pattern(
+        self, st: DataFrame, t: DataFrame, speeds: np.ndarray
+    ):
+        """
+        Set the stop times of the trips `t` (stop patterns with a `key`:
+        trips with the same key get the same times relative to their start)
+        to the min speed times of one representative trip per key
+        and replace the feed's stop times with `st`.
 
-        # convert GtfsTime back to str, clean unnecessary cols, sort
-        new_st = new_st[self.stop_times.columns]
-        new_st.arrival_time = new_st.arrival_time.apply(GtfsTime.to_gtfs_kit_raw)
-        new_st.departure_time = new_st.departure_time.apply(GtfsTime.to_gtfs_kit_raw)
-        new_st = new_st.sort_values(["trip_id", "stop_sequence"]).reset_index(drop=True)
-        self.feed.stop_times = new_st.reset_index(drop=True)
+        `st` are the stop times sorted by trip_id and stop_sequence (with reset index),
+        `speeds` the speed per segment of the trips' stop times (trip after trip).
+        """
+        if len(t) == 0:
+            self.feed.stop_times = self._sorted_stop_times = st
+            return
+        # position of each trip's first speed
+        t = t.assign(offset=np.cumsum(t.num_stops) - t.num_stops)
+        reps = t.drop_duplicates("key").sort_values("key")
+        logger.info(f"adjusting {len(t)} trips with {len(reps)} patterns")
+
+        rep_st = compute_stop_time_stats(
+            self._feed,
+            self._shape_dist_cache,
+            st.iloc[patterns.rows_of(reps.first_row, reps.num_stops)],
+        )
+        rep_boundaries = np.concatenate([[0], np.cumsum(reps.num_stops)])
+        arrival, departure = _min_speed_times(
+            rep_st,
+            rep_boundaries,
+            speeds[patterns.rows_of(reps.offset, reps.num_stops)],
+        )
+        rep_start = np.repeat(reps.start_seconds.to_numpy(), reps.num_stops)
+
+        # broadcast the times relative to the start to all trips
+        rows = patterns.rows_of(t.first_row, t.num_stops)
+        source = patterns.rows_of(rep_boundaries[:-1][t.key], t.num_stops)
+        start = np.repeat(t.start_seconds.to_numpy(), t.num_stops)
+        st.loc[rows, "arrival_time"] = to_gtfs_kit_raw(
+            arrival[source] - rep_start[source] + start
+        )
+        st.loc[rows, "departure_time"] = to_gtfs_kit_raw(
+            departure[source] - rep_start[source] + start
+        )
+        self.feed.stop_times = self._sorted_stop_times = st
 
     @staticmethod
     def _ensure_min_speed_of_trip(df: DataFrame, speed: float) -> DataFrame:
@@ -403,22 +1036,10 @@ class GtfsFiddler:
         Returns a copy of the input df with
         changed "arrival_time" and "departure_time"
         """
-        seconds_to_next_stop_new = (df.dist_to_next_stop / speed) * 3600
-        seconds_to_next_stop_min = pd.DataFrame(
-            [df.seconds_to_next_stop.values, seconds_to_next_stop_new.values]
-        ).min()
-        traveltime_cumsum = seconds_to_next_stop_min.shift(periods=1).cumsum()
-        traveltime_cumsum.iloc[0] = 0
-
-        stay_seconds = (df.departure_time - df.arrival_time).apply(
-            lambda v: v.seconds_of_day
+        arrival, departure = _min_speed_times(
+            df, np.array([0, len(df)]), np.full(len(df), speed, dtype=float)
         )
-        first_arrival_time = df.iloc[0].arrival_time
         df = df.copy()
-        df["arrival_time"] = (
-            traveltime_cumsum.apply(GtfsTime) + first_arrival_time
-        ).values
-        # guarantee that missing values in original feed stay missing
-        df.loc[stay_seconds.isna(), "arrival_time"] = GtfsTime(math.nan)
-        df["departure_time"] = df.arrival_time + stay_seconds
+        df["arrival_time"] = [GtfsTime(v) for v in arrival]
+        df["departure_time"] = [GtfsTime(v) for v in departure]
         return df
@@ -1,6 +1,80 @@
 import math
+from collections.abc import Iterable
+from functools import lru_cache
 from typing import Self
 
+import numpy as np
+import pandas as pd
+from pandas import Series
+
+
+def _round(seconds: int | float) -> int | float:
+    """
+    Round float seconds (NaN stays NaN)
+    """
+    if type(seconds) is int or math.isnan(seconds):
+        return seconds
+    return round(seconds)
+
+
+def to_seconds(times: Series) -> np.ndarray:
+    """
+    Vectorized conversion of HH:MM[:SS] strings to seconds of day
+    (as float array, NaN for missing values).
+    """
+    if times.dtype != object:
+        # e.g. a column with only missing values
+        return times.to_numpy(dtype=float)
+    # there are far less distinct times than stop times: only parse each once
+    codes, uniques = pd.factorize(times)
+    tokens = Series(uniques).str.split(":", expand=True).reindex(columns=[0, 1, 2])
+    try:
+        tokens = tokens.astype(float)
+    except ValueError:
+        raise ValueError(f"expected HH:MM:SS format but got {list(uniques)}")
+    seconds = tokens[0] * 60 * 60 + tokens[1] * 60 + tokens[2].fillna(0)
+    seconds = np.append(seconds.to_numpy(dtype=float), math.nan)
+    # missing values have code -1, i.e. the appended NaN
+    return seconds[codes]
+
+
+def to_gtfs_kit_raw(seconds: np.ndarray) -> np.ndarray:
+    """
+    Vectorized (and rounding) equivalent of `GtfsTime.to_gtfs_kit_raw`:
+    HH:MM:SS strings or NaN for missing values.
+    """
+    seconds = Series(np.round(seconds))
+    valid = seconds.notna()
+    s = seconds[valid].astype(np.int64)
+    formatted = (
+        (s // (60 * 60)).astype(str).str.zfill(2)
+        + ":"
+        + (s // 60 % 60).astype(str).str.zfill(2)
+        + ":"
+        + (s % 60).astype(str).str.zfill(2)
+    )
+    result = np.full(len(seconds), math.nan, dtype=object)
+    result[valid.to_numpy()] = formatted.to_numpy()
+    return result
+
+
+@lru_cache(maxsize=2**16)
+def _parse(time: str) -> int | float:
+    """
+    HH:MM[:SS] string to seconds of day.
+    Cached, since feeds repeat the same few thousand times over and over.
+    """
+    if time == "":
+        return math.nan
+    tokens = time.split(":")
+    try:
+        seconds = int(tokens[0]) * 60 * 60 + int(tokens[1]) * 60
+        if len(tokens) > 2:
+            seconds += int(tokens[2])
+    except (ValueError, IndexError):
+        raise ValueError(f"expected HH:MM:SS format but got {time}")
+    return seconds
+
 
 class GtfsTime:
     """
@@ -9,31 +83,42 @@ class GtfsTime:
     Allows for hour values larger than 24.
     """
 
+    __slots__ = ("seconds_of_day",)
+
     def __init__(self, time: Self | str | int | float):
         """
         Args:
           time:
              either a HH:MM[:SS] string or seconds of day. float values are rounded.
         """
-        if isinstance(time, GtfsTime):
+        # most frequent case first
+        if type(time) is int:
+            self.seconds_of_day = time
+        elif isinstance(time, str):
+            self.seconds_of_day = _parse(time)
+        elif isinstance(time, GtfsTime):
             self.seconds_of_day = time.seconds_of_day
         elif isinstance(time, int):
-            self.seconds_of_day = time
-        elif isinstance(time, float):
-            self.seconds_of_day = time
-            if not math.isnan(time):
-                self.seconds_of_day = round(time)
-        elif time == "":
-            self.seconds_of_day = math.nan
+            self.seconds_of_day = int(time)
         else:
-            tokens = time.split(":")
-            try:
-                self.seconds_of_day = int(tokens[0]) * 60 * 60
-                self.seconds_of_day += int(tokens[1]) * 60
-                if len(tokens) > 2:
-                    self.seconds_of_day += int(tokens[2])
-            except:
-                raise ValueError(f"expected HH:MM:SS format but got {time}")
+            self.seconds_of_day = _round(time)
+
+    @classmethod
+    def _of(cls, seconds: int | float) -> Self:
+        """
+        Fast constructor skipping the type dispatch of `__init__`
+        """
+        time = object.__new__(cls)
+        time.seconds_of_day = _round(seconds)
+        return time
+
+    @staticmethod
+    def parse_many(times: Iterable[str | float]) -> np.ndarray:
+        """
+        Bulk conversion of HH:MM[:SS] strings (or NaN for missing values)
+        to a float array of seconds of day, see `to_seconds`.
+        """
+        return to_seconds(Series(list(times), dtype=object))
 
     def isnan(self) -> bool:
         return math.isnan(self.seconds_of_day)
@@ -58,7 +143,7 @@ class GtfsTime:
         return f"{hours:02}:{minutes:02}:{seconds:02}"
 
     def __hash__(self):
-        return self.seconds_of_day
+        return hash(self.seconds_of_day)
 
     def __eq__(self, other: Self) -> bool:
         return self.seconds_of_day == other.seconds_of_day
@@ -73,10 +158,10 @@ class GtfsTime:
         secs = other
         if isinstance(other, GtfsTime):
             secs = other.seconds_of_day
-        return GtfsTime(self.seconds_of_day - secs)
+        return GtfsTime._of(self.seconds_of_day - secs)
 
     def __add__(self, other: int | float | Self) -> Self:
         secs = other
         if isinstance(other, GtfsTime):
             secs = other.seconds_of_day
-        return GtfsTime(self.seconds_of_day + secs)
+        return GtfsTime._of(self.seconds_of_day + secs)
@@ -0,0 +1,283 @@
+"""
+Segmented kernels rewriting stop times of many trips at once.
+
+All kernels work on flat float arrays of seconds of day (NaN for missing times)
+of stop times sorted by trip_id and stop_sequence. Trips are given as
+boundary offsets, i.e. the stop times of trip i are `boundaries[i]:boundaries[i+1]`.
+`thin` works the same way on trips (start times) grouped by route and direction.
+
+If numba is installed the kernels are JIT-compiled loops,
+otherwise equivalent vectorized NumPy implementations are used.
+numba is only imported (and the loops compiled) on the first call of a kernel,
+importing it takes longer than many fiddles. The compiled kernels are only cached
+on disk if `NUMBA_CACHE_DIR` is set (numba would write next to this module otherwise,
+i.e. into the installed package).
+"""
+
+import functools
+import os
+
+import numpy as np
+
+
+def _jit(loop, fallback):
+    """
+    `loop` JIT-compiled with numba on the first call if installed, else `fallback`
+    """
+    kernel = None
+
+    @functools.wraps(loop)
+    def call(*args):
+        nonlocal kernel
+        if kernel is None:
+            try:
+                from numba import njit
+            except ImportError:
+                kernel = fallback
+            else:
+                kernel = njit(cache="NUMBA_CACHE_DIR" in os.environ)(loop)
+        return kernel(*args)
+
+    return call
+
+
+def trip_boundaries(trip_ids: np.ndarray) -> np.ndarray:
+    """
+    Boundary offsets of trips in a sorted array of trip ids
+    (including 0 and len(trip_ids))
+    """
+    if len(trip_ids) == 0:
+        return np.zeros(1, dtype=np.int64)
+    starts = np.flatnonzero(trip_ids[1:] != trip_ids[:-1]) + 1
+    return np.concatenate([[0], starts, [len(trip_ids)]]).astype(np.int64)
+
+
+def interpolate(
+    values: np.ndarray,
+    by: np.ndarray,
+    boundaries: np.ndarray,
+    next_values: np.ndarray | None = None,
+) -> np.ndarray:
+    """
+    Fill missing values of each trip by linear interpolation between the previous
+    and the next known value of the same trip, proportionally to `by`
+    (e.g. the shape distance). Where `by` does not increase between the two known
+    values the stop position is used instead.
+    Values before the first / after the last known value of a trip
+    and values with missing `by` (if `by` increases) stay missing.
+
+    If given, the next known value is taken from `next_values` instead
+    (e.g. departure -> arrival), which must be missing at the same positions.
+
+    Always vectorized, there is no loop to be JIT-compiled.
+    """
+    if next_values is None:
+        next_values = values
+    n = len(values)
+    position = np.arange(n)
+    known = ~np.isnan(values)
+    # index of the previous / next known value (regardless of the trip)
+    prev = np.maximum.accumulate(np.where(known, position, -1))
+    nxt = np.minimum.accumulate(np.where(known, position, n)[::-1])[::-1]
+
+    # restrict to the own trip
+    lengths = np.diff(boundaries)
+    start = np.repeat(boundaries[:-1], lengths)
+    end = np.repeat(boundaries[1:], lengths)
+    fill = ~known & (prev >= start) & (nxt < end)
+    i, prev, nxt = position[fill], prev[fill], nxt[fill]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        span = by[nxt] - by[prev]
+        fraction = np.where(
+            span > 0, (by[i] - by[prev]) / span, (i - prev) / (nxt - prev)
+        )
+    result = values.astype(float)
+    result[i] = values[prev] + fraction * (next_values[nxt] - values[prev])
+    return result
+
+
+def _shift_times_loop(
+    arrival: np.ndarray,
+    departure: np.ndarray,
+    boundaries: np.ndarray,
+    offsets: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Shift all stop times of trip i by `offsets[i]` seconds.
+
+    Returns the new arrival and departure times.
+    """
+    new_arrival = np.empty_like(arrival)
+    new_departure = np.empty_like(departure)
+    for trip in range(len(boundaries) - 1):
+        for i in range(boundaries[trip], boundaries[trip + 1]):
+            # NaN + offset stays NaN
+            new_arrival[i] = arrival[i] + offsets[trip]
+            new_departure[i] = departure[i] + offsets[trip]
+    return new_arrival, new_departure
+
+
+def _shift_times_numpy(
+    arrival: np.ndarray,
+    departure: np.ndarray,
+    boundaries: np.ndarray,
+    offsets: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    NumPy equivalent of `_shift_times_loop`
+    """
+    per_row = np.repeat(offsets, np.diff(boundaries))
+    return arrival + per_row, departure + per_row
+
+
+def _segment_min_speed_times_loop(
+    arrival: np.ndarray,
+    departure: np.ndarray,
+    seconds_to_next_stop: np.ndarray,
+    dist_to_next_stop: np.ndarray,
+    boundaries: np.ndarray,
+    segment_speeds: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Reduce the travel time between stop i and the next stop of the same trip
+    in case traveling at `segment_speeds[i]` is faster
+    (see `GtfsFiddler.ensure_min_speed`). Segments with NaN speed keep their
+    travel time, trips with NaN speed for all segments are not changed at all.
+    The time spent at a stop is retained.
+
+    `seconds_to_next_stop` and `dist_to_next_stop` as computed by `compute_stop_time_stats`.
+
+    Returns the new arrival and departure times.
+    """
+    new_arrival = arrival.copy()
+    new_departure = departure.copy()
+    for trip in range(len(boundaries) - 1):
+        start = boundaries[trip]
+        end = boundaries[trip + 1]
+        if np.all(np.isnan(segment_speeds[start:end])):
+            continue
+        first_arrival = arrival[start]
+        traveltime = 0.0
+        for i in range(start, end):
+            if i > start:
+                # NaNs are skipped (like pandas' min and cumsum do),
+                # and only if both are missing the travel time is missing
+                seconds = seconds_to_next_stop[i - 1]
+                seconds_new = dist_to_next_stop[i - 1] / segment_speeds[i - 1] * 3600
+                if np.isnan(seconds):
+                    seconds = seconds_new
+                elif seconds_new < seconds:
+                    seconds = seconds_new
+                if np.isnan(seconds):
+                    cumsum = np.nan
+                else:
+                    traveltime += seconds
+                    cumsum = traveltime
+            else:
+                cumsum = 0.0
+            stay = departure[i] - arrival[i]
+            # missing values in the original feed stay missing
+            new_arrival[i] = np.round(cumsum) + first_arrival + stay * 0
+            new_departure[i] = new_arrival[i] + stay
+    return new_arrival, new_departure
+
+
+def _segment_min_speed_times_numpy(
+    arrival: np.ndarray,
+    departure: np.ndarray,
+    seconds_to_next_stop: np.ndarray,
+    dist_to_next_stop: np.ndarray,
+    boundaries: np.ndarray,
+    segment_speeds: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    NumPy equivalent of `_segment_min_speed_times_loop`
+    """
+    lengths = np.diff(boundaries)
+    starts = boundaries[:-1][lengths > 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # fmin ignores NaNs, i.e. only if both are missing the travel time is missing
+        seconds = np.fmin(
+            seconds_to_next_stop, dist_to_next_stop / segment_speeds * 3600
+        )
+
+    # travel time of the previous segment, zero for the first stop of each trip
+    previous = np.empty_like(seconds)
+    previous[1:] = seconds[:-1]
+    previous[starts] = 0
+    # segmented cumsum skipping NaNs
+    cumsum = np.cumsum(np.nan_to_num(previous))
+    cumsum -= np.repeat(cumsum[starts], lengths[lengths > 0])
+    cumsum[np.isnan(previous)] = np.nan
+
+    stay = departure - arrival
+    first_arrival = np.repeat(arrival[starts], lengths[lengths > 0])
+    # missing values in the original feed stay missing
+    new_arrival = np.round(cumsum) + first_arrival + stay * 0
+    new_departure = new_arrival + stay
+
+    with_speed = np.concatenate([[0], np.cumsum(~np.isnan(segment_speeds))])
+    with_speed = with_speed[boundaries[1:]] - with_speed[boundaries[:-1]]
+    unchanged = np.repeat(with_speed == 0, lengths)
+    new_arrival[unchanged] = arrival[unchanged]
+    new_departure[unchanged] = departure[unchanged]
+    return new_arrival, new_departure
+
+
+def _thin_loop(
+    starts: np.ndarray, boundaries: np.ndarray, min_gap: float
+) -> np.ndarray:
+    """
+    Which start times of each group (sorted) to keep: the first one
+    and then each one at least `min_gap` after the previously kept one.
+    Missing start times (sorted last) are always kept.
+    """
+    keep = np.zeros(len(starts), dtype=np.bool_)
+    for i in range(len(boundaries) - 1):
+        last = -np.inf
+        for j in range(boundaries[i], boundaries[i + 1]):
+            if np.isnan(starts[j]):
+                keep[j] = True
+            elif starts[j] >= last + min_gap:
+                keep[j] = True
+                last = starts[j]
+    return keep
+
+
+def _thin_numpy(
+    starts: np.ndarray, boundaries: np.ndarray, min_gap: float
+) -> np.ndarray:
+    """
+    NumPy equivalent of `_thin_loop`: all groups advance to their next kept start
+    at once (with `searchsorted`), i.e. one iteration per kept trip of the longest group
+    """
+    keep = np.isnan(starts)
+    if keep.all():
+        return keep
+    lengths = np.diff(boundaries)
+    group = np.repeat(np.arange(len(lengths)), lengths)
+    # a single sorted key for all groups, with each group's range
+    # (plus the gap) below the start of the next group
+    lo = np.nanmin(starts)
+    span = np.nanmax(starts) - lo + min_gap + 1
+    key = group * span + np.where(keep, span - 1, starts - lo)
+    known = np.concatenate([[0], np.cumsum(~keep)])
+    ends = boundaries[:-1] + known[boundaries[1:]] - known[boundaries[:-1]]
+    current = boundaries[:-1].copy()
+    active = current < ends
+    while active.any():
+        kept = current[active]
+        keep[kept] = True
+        following = np.searchsorted(key, key[kept] + min_gap, side="left")
+        # without a gap the next start is kept even if equal
+        current[active] = np.maximum(following, kept + 1)
+        active = current < ends
+    return keep
+
+
+shift_times = _jit(_shift_times_loop, _shift_times_numpy)
+segment_min_speed_times = _jit(
+    _segment_min_speed_times_loop, _segment_min_speed_times_numpy
+)
+thin = _jit(_thin_loop, _thin_numpy)
@@ -0,0 +1,292 @@
+"""
+Export of a feed as MATSim transit schedule (transitSchedule.xml, v2)
+and transit vehicles (transitVehicles.xml, v2), i.e. without writing GTFS
+and converting it with pt2matsim's GtfsToSchedule first:
+
+- a stop facility per stop served by any trip,
+- a transit line per route with a transit route per stop pattern
+  (see `patterns.compute_stop_patterns`: same stops, shape and times relative
+  to the first departure), its route profile taken from one of its trips,
+- a departure per trip at its start time (or per departure of a trip in
+  `frequencies`) and a vehicle per departure, typed by transport mode
+  (derived from the route type like pt2matsim does).
+
+Links of the transit routes are not written, map the schedule to a network
+with pt2matsim's PublicTransitMapper afterwards.
+
+Both files are written incrementally while iterating over the transit routes
+(with all times formatted at once beforehand), i.e. neither an XML tree
+nor the documents are ever held in memory. Files ending with `.gz` are gzipped.
+"""
+
+from __future__ import annotations
+
+import gzip
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, TYPE_CHECKING
+from xml.sax.saxutils import quoteattr
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from gtfs_fiddler import kernels, patterns
+from gtfs_fiddler.gtfs_time import to_gtfs_kit_raw, to_seconds
+
+if TYPE_CHECKING:
+    from gtfs_kit.feed import Feed
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_DOCTYPE = (
+    '<!DOCTYPE transitSchedule SYSTEM "http://www.matsim.org/files/dtd/'
+    'transitSchedule_v2.dtd">'
+)
+VEHICLES_NAMESPACE = (
+    'xmlns="http://www.matsim.org/files/dtd" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    'xsi:schemaLocation="http://www.matsim.org/files/dtd '
+    'http://www.matsim.org/files/dtd/vehicleDefinitions_v2.0.xsd"'
+)
+
+# transport mode per basic GTFS route type
+ROUTE_TYPE_MODES = {
+    0: "tram",
+    1: "subway",
+    2: "rail",
+    3: "bus",
+    4: "ferry",
+    5: "cablecar",
+    6: "gondola",
+    7: "funicular",
+    11: "trolleybus",
+    12: "monorail",
+}
+# transport mode per hundred of extended GTFS route types (e.g. 700-799: bus)
+EXTENDED_ROUTE_TYPE_MODES = {
+    1: "rail",
+    2: "bus",
+    4: "subway",
+    7: "bus",
+    8: "trolleybus",
+    9: "tram",
+    10: "ferry",
+    12: "ferry",
+    13: "gondola",
+    14: "funicular",
+}
+
+
+@dataclass(frozen=True)
+class VehicleType:
+    seats: int = 70
+    standing: int = 0
+    length: float = 18.0
+    width: float = 1.0
+    pce: float = 1.0
+
+
+def transport_mode(route_type: int) -> str:
+    """
+    MATSim transport mode of a (basic or extended) GTFS route type,
+    "other" for unknown types
+    """
+    if route_type in ROUTE_TYPE_MODES:
+        return ROUTE_TYPE_MODES[route_type]
+    return EXTENDED_ROUTE_TYPE_MODES.get(route_type // 100, "other")
+
+
+def _open(p: Path) -> IO[str]:
+    p = Path(p)
+    if p.suffix == ".gz":
+        return gzip.open(p, "wt", encoding="utf-8")
+    return open(p, "w", encoding="utf-8")
+
+
+def _coords(stops: DataFrame, crs: str | None) -> tuple[np.ndarray, np.ndarray]:
+    lon = stops.stop_lon.to_numpy(dtype=float)
+    lat = stops.stop_lat.to_numpy(dtype=float)
+    if crs is None:
+        return lon, lat
+    # dependency of geopandas, i.e. installed with gtfs_kit
+    from pyproj import Transformer
+
+    return Transformer.from_crs("EPSG:4326", crs, always_xy=True).transform(lon, lat)
+
+
+def departures(feed: Feed, stop_patterns: DataFrame) -> DataFrame:
+    """
+    One row per departure with the trip's stop pattern (see `compute_stop_patterns`)
+    and `departure_id` and `departure` (seconds of day): the trip's start
+    or, for trips in `frequencies`, each start from `start_time` (inclusive)
+    to `end_time` (exclusive) every `headway_secs`.
+    """
+    d = stop_patterns.assign(
+        departure_id=stop_patterns.trip_id, departure=stop_patterns.start_seconds
+    )
+    frequencies = feed.frequencies
+    if frequencies is None or len(frequencies) == 0:
+        return d
+    start = to_seconds(frequencies.start_time)
+    end = to_seconds(frequencies.end_time)
+    headway = frequencies.headway_secs.to_numpy(dtype=float)
+    counts = np.maximum(np.ceil((end - start) / headway), 0).astype(np.int64)
+    per_trip = d.set_index("trip_id")
+    repeated = per_trip.loc[np.repeat(frequencies.trip_id.to_numpy(), counts)]
+    repeated = repeated.reset_index()
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    repeated["departure"] = np.repeat(start, counts) + k * np.repeat(headway, counts)
+    repeated["departure_id"] = (
+        repeated.trip_id + "_" + pd.Series(k, index=repeated.index).astype(str)
+    )
+    is_frequency = d.trip_id.isin(frequencies.trip_id).to_numpy()
+    return pd.concat([d[~is_frequency], repeated], ignore_index=True)
+
+
+def _route_profiles(st: DataFrame, reps: DataFrame) -> tuple[np.ndarray, ...]:
+    """
+    Stop ids and arrival / departure offsets (HH:MM:SS, NaN if missing)
+    of the representative trips' stop times (trip after trip),
+    interior missing times interpolated by stop position.
+    """
+    rows = patterns.rows_of(reps.first_row.to_numpy(), reps.num_stops.to_numpy())
+    boundaries = np.concatenate([[0], np.cumsum(reps.num_stops)])
+    position = np.arange(len(rows), dtype=float)
+    start = np.repeat(reps.start_seconds.to_numpy(dtype=float), reps.num_stops)
+    offsets = []
+    for col in ["arrival_time", "departure_time"]:
+        seconds = to_seconds(st[col].iloc[rows])
+        seconds = kernels.interpolate(seconds, position, boundaries)
+        offsets.append(to_gtfs_kit_raw(seconds - start))
+    return st.stop_id.to_numpy()[rows], offsets[0], offsets[1]
+
+
+def write_schedule(
+    feed: Feed,
+    schedule_path: Path,
+    vehicles_path: Path,
+    stop_patterns: DataFrame | None = None,
+    crs: str | None = None,
+    vehicle_types: dict[str, VehicleType] | None = None,
+):
+    """
+    Write the feed as MATSim transit schedule and vehicles, see module docs.
+
+    `stop_patterns` are the feed's stop patterns if already computed
+    (e.g. `GtfsFiddler.stop_patterns`), stop coordinates are transformed to `crs`
+    (e.g. "EPSG:31287", default: WGS84 lon/lat) with pyproj.
+    Vehicle types are given per transport mode (default: `VehicleType()`).
+    """
+    if stop_patterns is None:
+        stop_patterns = patterns.compute_stop_patterns(feed)
+    st = feed.stop_times.sort_values(["trip_id", "stop_sequence"])
+    routes = feed.routes.set_index("route_id")
+
+    d = departures(feed, stop_patterns)
+    d["route_id"] = d.trip_id.map(feed.trips.set_index("trip_id").route_id)
+    d = d.sort_values(["route_id", "departure", "departure_id"], kind="stable")
+    # transit routes in the order of their first departure per line
+    group = d.groupby(["route_id", "pattern_id"], sort=False).ngroup().to_numpy()
+    d = d.iloc[np.argsort(group, kind="stable")]
+    group_boundaries = kernels.trip_boundaries(np.sort(group))
+    reps = d.iloc[group_boundaries[:-1]]
+    stop_ids, arrival_offsets, departure_offsets = _route_profiles(st, reps)
+    profile_boundaries = np.concatenate([[0], np.cumsum(reps.num_stops)])
+
+    modes = reps.route_id.map(routes.route_type).map(transport_mode).to_numpy()
+    departure_times = to_gtfs_kit_raw(d.departure.to_numpy(dtype=float))
+    departure_ids = d.departure_id.to_numpy()
+
+    served = feed.stops[feed.stops.stop_id.isin(st.stop_id).to_numpy()]
+    x, y = _coords(served, crs)
+    names = served.stop_name if "stop_name" in served.columns else None
+
+    vehicle_types = vehicle_types or {}
+    with _open(schedule_path) as schedule, _open(vehicles_path) as vehicles:
+        schedule.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        schedule.write(SCHEDULE_DOCTYPE + "\n<transitSchedule>\n")
+        schedule.write("\t<attributes>\n")
+        schedule.write(
+            '\t\t<attribute name="coordinateReferenceSystem" '
+            f'class="java.lang.String">{crs or "EPSG:4326"}</attribute>\n'
+        )
+        schedule.write("\t</attributes>\n\t<transitStops>\n")
+        for i, stop_id in enumerate(served.stop_id):
+            name = "" if names is None or pd.isna(names.iat[i]) else names.iat[i]
+            schedule.write(
+                f"\t\t<stopFacility id={quoteattr(stop_id)} "
+                f'x="{x[i]}" y="{y[i]}" name={quoteattr(name)} isBlocking="false"/>\n'
+            )
+        schedule.write("\t</transitStops>\n")
+
+        vehicles.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        vehicles.write(f"<vehicleDefinitions {VEHICLES_NAMESPACE}>\n")
+        for mode in sorted(set(modes)):
+            t = vehicle_types.get(mode, VehicleType())
+            vehicles.write(
+                f"\t<vehicleType id={quoteattr(mode)}>\n"
+                f'\t\t<capacity seats="{t.seats}" '
+                f'standingRoomInPersons="{t.standing}"/>\n'
+                f'\t\t<length meter="{t.length}"/>\n'
+                f'\t\t<width meter="{t.width}"/>\n'
+                f'\t\t<passengerCarEquivalents pce="{t.pce}"/>\n'
+                "\t</vehicleType>\n"
+            )
+
+        route_ids = reps.route_id.to_numpy()
+        for g, route_id in enumerate(route_ids):
+            if g == 0 or route_ids[g - 1] != route_id:
+                route = routes.loc[route_id]
+                name = route.get("route_short_name")
+                if pd.isna(name):
+                    name = route.get("route_long_name")
+                name = "" if pd.isna(name) else str(name)
+                schedule.write(
+                    f"\t<transitLine id={quoteattr(route_id)} "
+                    f"name={quoteattr(name)}>\n"
+                )
+                n = 0
+            lines = [
+                f"\t\t<transitRoute id={quoteattr(f'{route_id}_{n}')}>\n",
+                f"\t\t\t<transportMode>{modes[g]}</transportMode>\n",
+                "\t\t\t<routeProfile>\n",
+            ]
+            first, last = profile_boundaries[g], profile_boundaries[g + 1] - 1
+            for i in range(first, last + 1):
+                offsets = ""
+                if i != first and not pd.isna(arrival_offsets[i]):
+                    offsets += f' arrivalOffset="{arrival_offsets[i]}"'
+                if i != last and not pd.isna(departure_offsets[i]):
+                    offsets += f' departureOffset="{departure_offsets[i]}"'
+                lines.append(
+                    f"\t\t\t\t<stop refId={quoteattr(stop_ids[i])}{offsets} "
+                    'awaitDeparture="true"/>\n'
+                )
+            lines.append("\t\t\t</routeProfile>\n\t\t\t<departures>\n")
+            vehicle_lines = []
+            mode = quoteattr(modes[g])
+            for j in range(group_boundaries[g], group_boundaries[g + 1]):
+                # a vehicle per departure, like pt2matsim
+                vehicle_id = quoteattr(f"veh_{j}_{modes[g]}")
+                lines.append(
+                    f"\t\t\t\t<departure id={quoteattr(departure_ids[j])} "
+                    f'departureTime="{departure_times[j]}" '
+                    f"vehicleRefId={vehicle_id}/>\n"
+                )
+                vehicle_lines.append(f"\t<vehicle id={vehicle_id} type={mode}/>\n")
+            lines.append("\t\t\t</departures>\n\t\t</transitRoute>\n")
+            if g == len(route_ids) - 1 or route_ids[g + 1] != route_id:
+                lines.append("\t</transitLine>\n")
+            schedule.writelines(lines)
+            vehicles.writelines(vehicle_lines)
+            n += 1
+
+        schedule.write("</transitSchedule>\n")
+        vehicles.write("</vehicleDefinitions>\n")
+    logger.info(
+        f"wrote {len(served)} stops, {len(set(route_ids))} lines, "
+        f"{len(reps)} transit routes "
+        f"and {len(d)} departures"
+    )
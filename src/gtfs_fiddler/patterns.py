@@ -0,0 +1,86 @@
+"""
+Stop pattern deduplication.
+
+Many trips of a route only differ in their start time: they serve the same stops
+with the same times relative to their first departure. Such trips share a stop
+pattern, and everything depending only on the relative times (e.g. the min speed
+adjustment) can be computed once per pattern and broadcast to all its trips.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from gtfs_fiddler import kernels
+from gtfs_fiddler.gtfs_time import to_seconds
+
+if TYPE_CHECKING:
+    from gtfs_kit.feed import Feed
+
+
+def compute_stop_patterns(feed: Feed) -> DataFrame:
+    """
+    Returns one row per trip (sorted by trip_id) with the columns
+
+    - `pattern_id`: trips have the same pattern if they have the same shape_id,
+      stop_ids, shape distances (if present) and arrival/departure times
+      relative to the departure at their first stop (missing times included)
+    - `start_seconds`: departure at the first stop (0 if missing,
+      i.e. such trips only share a pattern if all times are the same)
+    - `first_row` and `num_stops`: position of the trip's stop times
+      in the stop times sorted by trip_id and stop_sequence
+    """
+    st = feed.stop_times.sort_values(["trip_id", "stop_sequence"])
+    boundaries = kernels.trip_boundaries(st.trip_id.to_numpy())
+    num_stops = np.diff(boundaries)
+    departure = to_seconds(st.departure_time)
+    start_seconds = np.nan_to_num(departure[boundaries[:-1]])
+    start = np.repeat(start_seconds, num_stops)
+
+    rows = DataFrame(
+        {
+            "stop_id": st.stop_id.to_numpy(),
+            "arrival": to_seconds(st.arrival_time) - start,
+            "departure": departure - start,
+        }
+    )
+    if "shape_dist_traveled" in st.columns:
+        rows["dist"] = st.shape_dist_traveled.to_numpy(dtype=float)
+    row_hash = pd.util.hash_pandas_object(rows, index=False).to_numpy()
+
+    trips = DataFrame(
+        {
+            "trip_id": st.trip_id.to_numpy()[boundaries[:-1]],
+            "start_seconds": start_seconds,
+            "first_row": boundaries[:-1],
+            "num_stops": num_stops,
+        }
+    )
+    if "shape_id" in feed.trips.columns:
+        shape_ids = trips.trip_id.map(feed.trips.set_index("trip_id").shape_id)
+    else:
+        shape_ids = pd.Series(None, index=trips.index, dtype=object)
+    keys = [
+        (shape_id, tuple(row_hash[first : first + n]))
+        for shape_id, first, n in zip(
+            shape_ids.where(shape_ids.notna(), None), trips.first_row, num_stops
+        )
+    ]
+    trips.insert(1, "pattern_id", pd.factorize(pd.Series(keys, dtype=object))[0])
+    return trips
+
+
+def rows_of(first_row: np.ndarray, num_stops: np.ndarray) -> np.ndarray:
+    """
+    Positions of all stop times of the given trips
+    (as returned by `compute_stop_patterns`), trip after trip.
+    """
+    first_row = np.asarray(first_row, dtype=np.int64)
+    num_stops = np.asarray(num_stops, dtype=np.int64)
+    offsets = np.cumsum(num_stops) - num_stops
+    within = np.arange(num_stops.sum()) - np.repeat(offsets, num_stops)
+    return np.repeat(first_row, num_stops) + within
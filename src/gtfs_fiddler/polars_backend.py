@@ -0,0 +1,449 @@
+"""
+Polars implementation of the computation-heavy parts of `GtfsFiddler`.
+
+Selected with `GtfsFiddler(..., backend="polars")`. All computations run on
+(multi-threaded) Polars lazy frames, which are only collected (once per call)
+and converted to pandas for the result. The functions never modify the feed:
+the `ensure_*` functions return the copied trips and their stop times
+(or the new stop times), which `GtfsFiddler` adds to the feed the same way as
+with the default pandas backend (keeping its caches up to date),
+so the feed stays the same as with the pandas backend.
+"""
+
+import math
+
+import gtfs_kit.helpers as hp
+import numpy as np
+import pandas as pd
+import polars as pl
+from gtfs_kit.feed import Feed
+from pandas import DataFrame, Series
+
+from gtfs_fiddler import shape_dist
+from gtfs_fiddler.gtfs_time import GtfsTime
+
+ROUTE_KEYS = ["route_id", "direction_id"]
+
+
+def _seconds(col: str) -> pl.Expr:
+    """
+    HH:MM[:SS] strings to seconds of day (null for missing values)
+    """
+    tokens = pl.col(col).str.split(":")
+    return (
+        tokens.list.get(0).cast(pl.Int64) * 3600
+        + tokens.list.get(1).cast(pl.Int64) * 60
+        + tokens.list.get(2, null_on_oob=True).cast(pl.Int64).fill_null(0)
+    )
+
+
+def _time_str(seconds: pl.Expr) -> pl.Expr:
+    """
+    seconds of day to HH:MM:SS strings (as formatted by `GtfsTime`)
+    """
+    seconds = seconds.cast(pl.Int64)
+    return pl.format(
+        "{}:{}:{}",
+        (seconds // 3600).cast(pl.String).str.zfill(2),
+        (seconds // 60 % 60).cast(pl.String).str.zfill(2),
+        (seconds % 60).cast(pl.String).str.zfill(2),
+    )
+
+
+def _to_gtfs_kit_raw(s: pd.Series) -> pd.Series:
+    """
+    Polars nulls end up as None in pandas, but gtfs_kit uses NaN for missing strings
+    """
+    return s.where(s.notna(), math.nan)
+
+
+def _dist_factor(feed: Feed) -> float:
+    """
+    factor to convert distances of the feed to km or mi
+    """
+    if hp.is_metric(feed.dist_units):
+        return hp.get_convert_dist(feed.dist_units, "km")(1)
+    return hp.get_convert_dist(feed.dist_units, "mi")(1)
+
+
+def _filtered_trips(feed: Feed, filter) -> pl.LazyFrame:
+    trips = pl.from_pandas(feed.trips).lazy()
+    if "direction_id" not in feed.trips.columns:
+        trips = trips.with_columns(direction_id=pl.lit(None, pl.Int64))
+    if "shape_id" not in feed.trips.columns:
+        trips = trips.with_columns(shape_id=pl.lit(None, pl.String))
+    routes = pl.from_pandas(
+        feed.routes[["route_id", "route_short_name", "route_type"]]
+    ).lazy()
+    trips = trips.join(routes, on="route_id", how="inner")
+    if filter.route_types is not None:
+        trips = trips.filter(pl.col("route_type").is_in(list(filter.route_types)))
+    if filter.route_ids is not None:
+        trips = trips.filter(pl.col("route_id").is_in(list(filter.route_ids)))
+    if filter.route_short_names is not None:
+        trips = trips.filter(
+            pl.col("route_short_name").is_in(list(filter.route_short_names))
+        )
+    return trips
+
+
+def _stop_times(feed: Feed) -> pl.LazyFrame:
+    """
+    The stop times (with their `_row` in the feed's stop_times) sorted by trip_id
+    and stop_sequence, with `arrival` and `departure` in seconds
+    """
+    cols = ["trip_id", "stop_sequence", "stop_id", "arrival_time", "departure_time"]
+    if "shape_dist_traveled" in feed.stop_times.columns:
+        cols.append("shape_dist_traveled")
+    return (
+        pl.from_pandas(feed.stop_times[cols])
+        .lazy()
+        .with_row_index("_row")
+        .with_columns(
+            arrival=_seconds("arrival_time"), departure=_seconds("departure_time")
+        )
+        .sort(["trip_id", "stop_sequence"])
+    )
+
+
+def _trips_enriched(feed: Feed, filter, st: pl.LazyFrame | None = None) -> pl.LazyFrame:
+    """
+    Trips with start and end time (in seconds) and time to next trip (in seconds).
+    Sorted by route_id, direction_id, start_time.
+    `st` are the `_stop_times` of the feed (if already converted).
+    """
+    if st is None:
+        st = _stop_times(feed)
+    has_dist = "shape_dist_traveled" in feed.stop_times.columns
+    distance = (
+        pl.col("shape_dist_traveled").max() * _dist_factor(feed)
+        if has_dist
+        else pl.lit(None, pl.Float64)
+    )
+    stats = st.group_by("trip_id").agg(
+        num_stops=pl.len(),
+        start_time=pl.col("departure").first(),
+        end_time=pl.col("departure").last(),
+        start_stop_id=pl.col("stop_id").first(),
+        end_stop_id=pl.col("stop_id").last(),
+        distance=distance,
+    )
+    duration = (pl.col("end_time") - pl.col("start_time")) / 3600
+    return (
+        _filtered_trips(feed, filter)
+        .join(stats, on="trip_id", how="inner")
+        .with_columns(duration=duration)
+        .with_columns(speed=pl.col("distance") / pl.col("duration"))
+        .sort(ROUTE_KEYS + ["start_time"], nulls_last=True)
+        .with_columns(
+            time_to_next_trip=pl.col("start_time").shift(-1).over(ROUTE_KEYS)
+            - pl.col("start_time")
+        )
+    )
+
+
+def trips_enriched(feed: Feed, filter) -> DataFrame:
+    """
+    See `GtfsFiddler.trips_enriched`.
+    In contrast to the pandas backend no `is_loop` column is provided
+    and `distance` is only set if the feed's stop_times contain `shape_dist_traveled`.
+    """
+    df = _trips_enriched(feed, filter).collect().to_pandas()
+    for col in ["start_time", "end_time"]:
+        df[col] = df[col].apply(GtfsTime)
+    df["time_to_next_trip"] = df.time_to_next_trip.apply(
+        lambda v: math.nan if pd.isna(v) else GtfsTime(int(v))
+    )
+    return df
+
+
+def _interpolate(
+    values: pl.Expr, by: pl.Expr, next_values: pl.Expr | None = None
+) -> pl.Expr:
+    """
+    See `kernels.interpolate` (to be evaluated over trips)
+    """
+    if next_values is None:
+        next_values = values
+    known = values.is_not_null()
+    position = pl.int_range(pl.len())
+    prev_position = pl.when(known).then(position).forward_fill()
+    next_position = pl.when(known).then(position).backward_fill()
+    prev_by = pl.when(known).then(by).forward_fill()
+    next_by = pl.when(known).then(by).backward_fill()
+    fraction = (
+        pl.when(next_by - prev_by > 0)
+        .then((by - prev_by) / (next_by - prev_by))
+        .otherwise((position - prev_position) / (next_position - prev_position))
+    )
+    prev_value = values.forward_fill()
+    return values.fill_null(
+        prev_value + fraction * (next_values.backward_fill() - prev_value)
+    )
+
+
+def compute_stop_time_stats(
+    feed: Feed,
+    shape_dist_cache: dict[tuple, np.ndarray] | None = None,
+    stop_times: DataFrame | None = None,
+) -> pl.LazyFrame:
+    """
+    See `fiddle.compute_stop_time_stats` (not collected yet).
+    `arrival_time` and `departure_time` are kept as seconds of day (null if missing),
+    the interpolated values used for computing the stats are available as
+    `arrival_seconds` and `departure_seconds`.
+    """
+    st = feed.stop_times if stop_times is None else stop_times
+    if "shape_dist_traveled" not in st.columns:
+        st = shape_dist.compute_shape_dist_traveled(feed, shape_dist_cache, st)
+    lf = (
+        pl.from_pandas(
+            st[
+                [
+                    "trip_id",
+                    "stop_sequence",
+                    "arrival_time",
+                    "departure_time",
+                    "shape_dist_traveled",
+                ]
+            ]
+        )
+        .lazy()
+        .sort(["trip_id", "stop_sequence"])
+    )
+
+    lf = lf.with_columns(
+        arrival_time=_seconds("arrival_time"),
+        departure_time=_seconds("departure_time"),
+        shape_dist_traveled=pl.col("shape_dist_traveled").cast(pl.Float64)
+        * _dist_factor(feed),
+    ).with_columns(
+        arrival_seconds=pl.coalesce("arrival_time", "departure_time").cast(pl.Float64),
+        departure_seconds=pl.coalesce("departure_time", "arrival_time").cast(
+            pl.Float64
+        ),
+    )
+    position = pl.int_range(pl.len()).cast(pl.Float64)
+    lf = lf.with_columns(
+        shape_dist_traveled=_interpolate(
+            pl.col("shape_dist_traveled"), pl.col("arrival_seconds")
+        ).over("trip_id")
+    ).with_columns(
+        shape_dist_traveled=_interpolate(pl.col("shape_dist_traveled"), position).over(
+            "trip_id"
+        )
+    )
+    # leave the previous stop at its departure and reach the next one at its arrival
+    interpolated = _interpolate(
+        pl.col("departure_seconds"),
+        pl.col("shape_dist_traveled"),
+        pl.col("arrival_seconds"),
+    ).over("trip_id")
+    lf = lf.with_columns(
+        arrival_seconds=pl.col("arrival_seconds").fill_null(interpolated),
+        departure_seconds=pl.col("departure_seconds").fill_null(interpolated),
+    )
+    lf = lf.with_columns(
+        seconds_to_next_stop=(
+            pl.col("arrival_seconds").shift(-1) - pl.col("departure_seconds")
+        ).over("trip_id"),
+        dist_to_next_stop=(
+            pl.col("shape_dist_traveled").shift(-1) - pl.col("shape_dist_traveled")
+        ).over("trip_id"),
+    )
+    return lf.with_columns(
+        speed=pl.col("dist_to_next_stop") / (pl.col("seconds_to_next_stop") / 3600)
+    )
+
+
+def _copies(
+    feed: Feed, st: pl.LazyFrame, copies: pl.LazyFrame, sort_by: list[str]
+) -> tuple[DataFrame, DataFrame]:
+    """
+    Collect the copies of trips (`trip_id`, `new_trip_id` and `offset` in seconds)
+    and their stop times (shifted by the offset, sorted by `sort_by`)
+    as pandas DataFrames, see `GtfsFiddler._append_copies`
+    """
+    times = (
+        st.join(copies.with_row_index("_copy"), on="trip_id", how="inner")
+        .sort(sort_by)
+        .select(
+            "_row",
+            "new_trip_id",
+            arrival_time=_time_str(pl.col("arrival") + pl.col("offset")),
+            departure_time=_time_str(pl.col("departure") + pl.col("offset")),
+        )
+    )
+    copies, times = pl.collect_all(
+        [copies.select("trip_id", "new_trip_id", "offset"), times]
+    )
+    new_st = feed.stop_times.iloc[times["_row"].to_numpy()].reset_index(drop=True)
+    new_st["trip_id"] = times["new_trip_id"].to_numpy()
+    for col in ["arrival_time", "departure_time"]:
+        new_st[col] = _to_gtfs_kit_raw(times[col].to_pandas()).to_numpy()
+    return copies.to_pandas(), new_st
+
+
+def ensure_departures(
+    feed: Feed, earliest: Series | None, latest: Series | None, filter
+) -> tuple[DataFrame, DataFrame]:
+    """
+    See `GtfsFiddler.ensure_departures`, with the target times
+    as seconds of day per route_id (NaN for routes without target).
+    Returns the copied trips and their stop times, see `_copies`.
+    """
+    st = _stop_times(feed)
+    t = _trips_enriched(feed, filter, st)
+    first_departure = st.group_by("trip_id").agg(
+        first_departure=pl.col("departure").first()
+    )
+    copies = []
+    for targets, suffix, is_earliest in [
+        (earliest, "#early", True),
+        (latest, "#late", False),
+    ]:
+        if targets is None:
+            continue
+        targets = pl.DataFrame(
+            {
+                "route_id": targets.index.to_numpy(dtype=object),
+                "target": targets.to_numpy(dtype=float),
+            },
+            schema={"route_id": pl.String, "target": pl.Float64},
+        ).with_columns(pl.col("target").fill_nan(None))
+        groups = t.group_by(ROUTE_KEYS, maintain_order=True)
+        trip = groups.first() if is_earliest else groups.last()
+        adjust = (
+            pl.col("start_time") > pl.col("target")
+            if is_earliest
+            else pl.col("start_time") < pl.col("target")
+        )
+        copies.append(
+            trip.join(targets.lazy(), on="route_id", how="inner", maintain_order="left")
+            .filter(adjust)
+            .select(
+                "trip_id",
+                new_trip_id=pl.col("trip_id") + suffix,
+                target="target",
+                late=pl.lit(not is_earliest),
+            )
+        )
+    if not copies:
+        return (
+            DataFrame(columns=["trip_id", "new_trip_id", "offset"]),
+            feed.stop_times[:0],
+        )
+    # set the departure time of each trip's first stop to the desired start time
+    copies = (
+        pl.concat(copies)
+        .join(first_departure, on="trip_id", how="left", maintain_order="left")
+        .with_columns(offset=pl.col("target") - pl.col("first_departure"))
+    )
+    # earliest copies first, each sorted by trip_id and stop_sequence
+    return _copies(feed, st, copies, ["late", "new_trip_id", "stop_sequence"])
+
+
+def ensure_max_trip_interval(
+    feed: Feed, minutes: int, filter
+) -> tuple[DataFrame, DataFrame]:
+    """
+    See `GtfsFiddler.ensure_max_trip_interval`.
+    Returns the copied trips and their stop times, see `_copies`.
+    """
+    suffix = "#densify"
+    interval = minutes * 60
+    st = _stop_times(feed)
+    copies = (
+        _trips_enriched(feed, filter, st)
+        .filter(pl.col("time_to_next_trip") > interval)
+        .with_columns(
+            # integer ceil division (float division may be off by an ulp)
+            repeats=(pl.col("time_to_next_trip") + interval - 1) // interval
+            - 1
+        )
+        .select(
+            "trip_id",
+            offset=pl.col("time_to_next_trip") // (pl.col("repeats") + 1),
+            repeat=pl.int_ranges(1, pl.col("repeats") + 1),
+        )
+        .explode("repeat")
+        .with_columns(
+            new_trip_id=pl.col("trip_id") + suffix + pl.col("repeat").cast(pl.String),
+            offset=pl.col("offset") * pl.col("repeat"),
+        )
+    )
+    # same order as the trips (and the pandas backend)
+    return _copies(feed, st, copies, ["_copy", "stop_sequence"])
+
+
+def ensure_min_speed(
+    feed: Feed,
+    stop_times: DataFrame,
+    route_type2speed: dict[int, float] | None = None,
+    route_id2speed: dict[str, float] | None = None,
+    shape_dist_cache: dict[tuple, np.ndarray] | None = None,
+):
+    """
+    See `GtfsFiddler.ensure_min_speed`, sets the new times in `stop_times`
+    (the feed's stop times sorted by trip_id and stop_sequence, with reset index).
+    Speeds per route id take precedence over speeds per route type.
+
+    Unlike the pandas backend, which computes the new times once per stop
+    pattern and speed, this computes them for every stop time in one pass.
+    """
+    trip2speed = (
+        pl.from_pandas(feed.trips[["trip_id", "route_id"]])
+        .lazy()
+        .join(
+            pl.from_pandas(feed.routes[["route_id", "route_type"]]).lazy(),
+            on="route_id",
+            how="left",
+        )
+        .select(
+            "trip_id",
+            speed=pl.col("route_id").replace_strict(
+                route_id2speed or {}, default=None, return_dtype=pl.Float64
+            ),
+            type_speed=pl.col("route_type").replace_strict(
+                route_type2speed or {}, default=None, return_dtype=pl.Float64
+            ),
+        )
+        .select("trip_id", min_speed=pl.coalesce("speed", "type_speed"))
+    )
+
+    cum = pl.col("min_seconds").shift(1).cum_sum().over("trip_id")
+    first = pl.int_range(pl.len()).over("trip_id") == 0
+    stay = pl.col("departure_seconds") - pl.col("arrival_seconds")
+    arrival = pl.when(first).then(0).otherwise(cum).round(0) + pl.col(
+        "arrival_seconds"
+    ).first().over("trip_id")
+    times = (
+        compute_stop_time_stats(feed, shape_dist_cache, stop_times)
+        .join(trip2speed, on="trip_id", how="left", maintain_order="left")
+        .with_columns(
+            min_seconds=pl.min_horizontal(
+                "seconds_to_next_stop",
+                pl.col("dist_to_next_stop") / pl.col("min_speed") * 3600,
+            ),
+        )
+        .with_columns(
+            # stops without times in the original feed stay without times
+            # (the NumPy kernel propagates NaNs with `stay * 0` instead)
+            arrival_new=pl.when(pl.col("arrival_time").is_not_null()).then(arrival),
+            departure_new=pl.when(pl.col("departure_time").is_not_null()).then(
+                arrival + stay
+            ),
+        )
+        .select(
+            changed=pl.col("min_speed").is_not_null(),
+            arrival_time=_time_str(pl.col("arrival_new")),
+            departure_time=_time_str(pl.col("departure_new")),
+        )
+        .collect()
+    )
+
+    # stop times of both frames are sorted by (the unique) trip_id + stop_sequence
+    changed = times["changed"].to_numpy()
+    times = times.filter(pl.col("changed"))
+    for col in ["arrival_time", "departure_time"]:
+        stop_times.loc[changed, col] = _to_gtfs_kit_raw(times[col].to_pandas()).values
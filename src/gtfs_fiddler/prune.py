@@ -0,0 +1,137 @@
+"""
+Removing everything from a feed that isn't used by its trips, e.g. after
+`GtfsFiddler.ensure_min_headway` or restricting it to a date, to shrink the input
+of downstream simulations (e.g. MATSim via pt2matsim, whose runtime scales with
+the number of stops and trips):
+
+- routes without trips and agencies without routes,
+- stops not served by any stop time (except the parent stations of served stops),
+- shapes and services (calendar, calendar_dates) not referenced by any trip,
+- frequencies, transfers and fare rules of removed trips, stops and routes,
+- columns without any value (except those required by GTFS) or, if listed
+  per table, all columns except the listed and required ones (see `prune_feed`).
+
+Each table is reduced with a single vectorized `isin` per referenced key.
+"""
+
+from __future__ import annotations
+
+import copy
+import logging
+from collections.abc import Collection, Mapping
+from typing import TYPE_CHECKING
+
+from pandas import DataFrame
+
+from gtfs_fiddler import feed_io
+
+if TYPE_CHECKING:
+    from gtfs_kit.feed import Feed
+
+logger = logging.getLogger(__name__)
+
+
+def required_columns(table: str) -> list[str]:
+    """
+    Columns of the table required by GTFS (according to gtfs_kit)
+    """
+    import gtfs_kit.constants as cs
+
+    ref = cs.GTFS_REF
+    return ref.column[(ref.table == table) & ref.column_required].tolist()
+
+
+def _keep(df: DataFrame, col: str, values, keep_missing: bool = False) -> DataFrame:
+    """
+    Rows of `df` with `col` in `values` (or missing, if `keep_missing`)
+    """
+    if col not in df.columns:
+        return df
+    selected = df[col].isin(values)
+    if keep_missing:
+        selected |= df[col].isna()
+    return df[selected.to_numpy()]
+
+
+def strip_columns(
+    df: DataFrame, table: str, keep: Collection[str] | None = None
+) -> DataFrame:
+    """
+    The table without columns that have no value at all
+    and (if `keep` is given) without columns not in `keep`,
+    but always with the columns required by GTFS and those in `keep`
+    (the table itself if no column is removed).
+    """
+    required = set(required_columns(table))
+    if keep is None:
+        empty = df.columns[df.isna().all().to_numpy()] if len(df) > 0 else []
+        drop = [c for c in df.columns if c in empty and c not in required]
+    else:
+        drop = [c for c in df.columns if c not in keep and c not in required]
+    if not drop:
+        return df
+    return df.drop(columns=drop)
+
+
+def prune_feed(
+    feed: Feed, columns: Mapping[str, Collection[str]] | None = None
+) -> Feed:
+    """
+    A copy of the feed without the rows not used by its trips and without
+    empty columns, see module docs. The feed itself is not modified.
+
+    `columns` lists the (optional) columns to keep per table (even if empty),
+    all other optional columns of these tables are removed.
+    Note, that `GtfsFiddler` needs e.g. `trips.direction_id` and `trips.shape_id`.
+    """
+    pruned = copy.copy(feed)
+    trips, stop_times = feed.trips, feed.stop_times
+
+    pruned.routes = _keep(feed.routes, "route_id", trips.route_id.unique())
+    if feed.agency is not None and "agency_id" in pruned.routes.columns:
+        pruned.agency = _keep(
+            feed.agency, "agency_id", pruned.routes.agency_id.unique()
+        )
+
+    stop_ids = stop_times.stop_id.unique()
+    if "parent_station" in feed.stops.columns:
+        served = feed.stops[feed.stops.stop_id.isin(stop_ids)]
+        parents = served.parent_station.dropna().unique()
+        stop_ids = set(stop_ids) | set(parents)
+    pruned.stops = _keep(feed.stops, "stop_id", stop_ids)
+
+    if feed.shapes is not None and "shape_id" in trips.columns:
+        pruned.shapes = _keep(feed.shapes, "shape_id", trips.shape_id.unique())
+    service_ids = trips.service_id.unique()
+    for table in ["calendar", "calendar_dates"]:
+        if getattr(feed, table) is not None:
+            setattr(
+                pruned, table, _keep(getattr(feed, table), "service_id", service_ids)
+            )
+    if feed.frequencies is not None:
+        pruned.frequencies = _keep(feed.frequencies, "trip_id", trips.trip_id.unique())
+    if feed.transfers is not None:
+        transfers = feed.transfers
+        for col in ["from_stop_id", "to_stop_id"]:
+            transfers = _keep(transfers, col, pruned.stops.stop_id)
+        for col in ["from_trip_id", "to_trip_id"]:
+            transfers = _keep(transfers, col, trips.trip_id, keep_missing=True)
+        pruned.transfers = transfers
+    if feed.fare_rules is not None:
+        pruned.fare_rules = _keep(
+            feed.fare_rules, "route_id", pruned.routes.route_id, keep_missing=True
+        )
+
+    for table in feed_io.gtfs_tables():
+        df = getattr(pruned, table)
+        if df is None:
+            continue
+        df = strip_columns(df, table, (columns or {}).get(table))
+        before = getattr(feed, table)
+        if len(df) < len(before) or len(df.columns) < len(before.columns):
+            logger.info(
+                f"{table}: {len(df)}/{len(before)} rows, "
+                f"{len(df.columns)}/{len(before.columns)} columns"
+            )
+        setattr(pruned, table, df)
+    return pruned
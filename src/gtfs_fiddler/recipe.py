@@ -0,0 +1,312 @@
+"""
+Declarative fiddle recipes: a list of steps (operation, value and `FiddleFilter`),
+read from TOML or YAML (requires the `yaml` extra) files, e.g.
+
+```toml
+[[steps]]
+operation = "min_speed"
+speed = 25
+filter = { route_types = [0, 3] }
+
+[[steps]]
+operation = "earliest_departure"
+time = "05:00"
+
+[[steps]]
+operation = "max_trip_interval"
+minutes = 15
+filter = { route_short_names = ["110", "111"] }
+
+[[steps]]
+operation = "max_trip_interval"
+minutes = 10
+# also `radius = { lon = .., lat = .., meters = .. }` or `polygon = [[lon, lat], ..]`
+filter = { bbox = [145.76, -16.93, 145.78, -16.91] }
+```
+
+`run_recipe` produces the same feed (up to the order of rows) as executing
+the steps one by one with `run_step`, but with fewer passes over the feed:
+
+- `min_speed` steps only change the times relative to a trip's first departure,
+  while all other operations only look at first departures and copy (or remove)
+  trips.
+  So all `min_speed` steps are executed first, which means the copies inherit
+  the adjusted times instead of being adjusted again.
+- Consecutive `min_speed` steps affecting different routes are merged into a
+  single `GtfsFiddler.ensure_min_speed` call, i.e. a single stop time stats pass.
+- Consecutive `earliest_departure` and `latest_departure` steps (affecting
+  different routes per operation) are merged into a single
+  `GtfsFiddler.ensure_departures` call with targets per route,
+  i.e. a single pass over the trips.
+- The trip stats all other operations are based on are computed once
+  and then kept up to date for the added and removed trips
+  (see `GtfsFiddler.trip_stats`).
+"""
+
+import dataclasses
+import logging
+import tomllib
+from dataclasses import dataclass
+from pathlib import Path
+
+from pandas import DataFrame
+
+from gtfs_fiddler.fiddle import (
+    NO_FILTER,
+    DepartureTargets,
+    FiddleFilter,
+    GtfsFiddler,
+    filtered_route_ids,
+)
+from gtfs_fiddler.gtfs_time import GtfsTime
+from gtfs_fiddler.spatial import BBox, Radius
+
+logger = logging.getLogger(__name__)
+
+# operation -> name of its value
+OPERATIONS = {
+    "earliest_departure": "time",
+    "latest_departure": "time",
+    "max_trip_interval": "minutes",
+    "min_headway": "minutes",
+    "min_speed": "speed",
+}
+DEPARTURE_OPERATIONS = ("earliest_departure", "latest_departure")
+FILTER_KEYS = ("route_types", "route_ids", "route_short_names")
+AREA_KEYS = ("bbox", "radius", "polygon")
+
+
+@dataclass(frozen=True)
+class Step:
+    """
+    A single operation with its value:
+    `time` (`GtfsTime`) for earliest/latest departure,
+    `minutes` (int) for max trip interval and min headway
+    and `speed` (float) for min speed.
+    """
+
+    operation: str
+    value: GtfsTime | int | float
+    filter: FiddleFilter = NO_FILTER
+
+
+@dataclass(frozen=True)
+class Recipe:
+    steps: tuple[Step, ...]
+
+
+@dataclass(frozen=True)
+class Batch:
+    """
+    Steps of the same operation executed together, see `plan`
+    (operation `departures` for earliest and latest departure steps).
+    """
+
+    operation: str
+    steps: tuple[Step, ...]
+
+
+def _number(name: str, value) -> float:
+    # bools are numbers in Python, but most likely a mistake here
+    if isinstance(value, bool) or not isinstance(value, int | float | str):
+        raise ValueError(f"{name} must be a number but got {value!r}")
+    return float(value)
+
+
+def _expect_list(name: str, value) -> list:
+    if not isinstance(value, list | tuple):
+        raise ValueError(f"{name} must be a list but got {value!r}")
+    return value
+
+
+def parse_step(data: dict) -> Step:
+    if not isinstance(data, dict):
+        raise ValueError(f"step must be a table/object but got {data!r}")
+    data = dict(data)
+    operation = data.pop("operation", None)
+    if not isinstance(operation, str) or operation not in OPERATIONS:
+        raise ValueError(
+            f"operation must be one of {list(OPERATIONS)} but got {operation}"
+        )
+    value_name = OPERATIONS[operation]
+    if value_name not in data:
+        raise ValueError(f"{operation} requires {value_name}")
+    value = data.pop(value_name)
+    if value_name == "time":
+        value = GtfsTime(str(value))
+    elif value_name == "minutes":
+        value = int(_number(value_name, value))
+    else:
+        value = _number(value_name, value)
+
+    filter_data = data.pop("filter", {})
+    if not isinstance(filter_data, dict):
+        raise ValueError(f"filter must be a table/object but got {filter_data!r}")
+    filter_data = dict(filter_data)
+    if data:
+        raise ValueError(f"unexpected keys for {operation}: {sorted(data)}")
+    area_data = {k: filter_data.pop(k) for k in AREA_KEYS if k in filter_data}
+    unknown = set(filter_data) - set(FILTER_KEYS)
+    if unknown:
+        raise ValueError(
+            f"filter keys must be in {FILTER_KEYS + AREA_KEYS} but got {unknown}"
+        )
+    if len(area_data) > 1:
+        raise ValueError(f"at most one of {AREA_KEYS} allowed but got {area_data}")
+    filter = FiddleFilter(
+        **{
+            key: tuple(
+                int(_number(key, v)) if key == "route_types" else str(v)
+                for v in _expect_list(key, values)
+            )
+            for key, values in filter_data.items()
+        },
+        area=parse_area(**area_data) if area_data else None,
+    )
+    return Step(operation, value, filter)
+
+
+def parse_area(
+    bbox: list | None = None, radius: dict | None = None, polygon: list | None = None
+):
+    """
+    `FiddleFilter.area` from a bbox [min_lon, min_lat, max_lon, max_lat],
+    a radius {lon, lat, meters} or a polygon [[lon, lat], ..]
+    """
+    if bbox is not None:
+        if not isinstance(bbox, list | tuple) or len(bbox) != 4:
+            raise ValueError("bbox must be [min_lon, min_lat, max_lon, max_lat]")
+        return BBox(*(_number("bbox", v) for v in bbox))
+    if radius is not None:
+        if not isinstance(radius, dict) or set(radius) != {"lon", "lat", "meters"}:
+            raise ValueError(f"radius must have lon, lat and meters but got {radius}")
+        return Radius(**{k: _number(k, v) for k, v in radius.items()})
+    if not isinstance(polygon, list | tuple) or not all(
+        isinstance(p, list | tuple) and len(p) == 2 for p in polygon
+    ):
+        raise ValueError(f"polygon must be [[lon, lat], ..] but got {polygon}")
+    import shapely
+
+    return shapely.Polygon(
+        [(_number("lon", lon), _number("lat", lat)) for lon, lat in polygon]
+    )
+
+
+def parse_recipe(data: dict) -> Recipe:
+    """
+    Recipe from a dict with a list of `steps`, each with an `operation`,
+    the operation's value and an optional `filter` (with the fields of `FiddleFilter`).
+    Raises a ValueError for invalid recipes.
+    """
+    if not isinstance(data, dict):
+        raise ValueError(f"recipe must be a table/object but got {data!r}")
+    unknown = set(data) - {"steps"}
+    if unknown:
+        raise ValueError(f"unexpected keys in recipe: {sorted(unknown)}")
+    steps = _expect_list("steps", data.get("steps", []))
+    return Recipe(tuple(parse_step(step) for step in steps))
+
+
+def load_recipe(path: Path) -> Recipe:
+    """
+    Load a recipe from a .toml or .yaml/.yml file, see `parse_recipe`
+    """
+    path = Path(path)
+    if path.suffix == ".toml":
+        with open(path, "rb") as f:
+            return parse_recipe(tomllib.load(f))
+    if path.suffix in (".yaml", ".yml"):
+        # optional dependency, only import when requested
+        import yaml
+
+        with open(path) as f:
+            return parse_recipe(yaml.safe_load(f) or {})
+    raise ValueError(f"expected a .toml, .yaml or .yml file but got {path}")
+
+
+def plan(recipe: Recipe, routes: DataFrame) -> list[Batch]:
+    """
+    Order and batch the recipe's steps for execution, see module docs.
+    The areas of the steps' filters must be resolved already
+    (see `GtfsFiddler.resolve_filter`).
+    """
+    batches = []
+    batch_route_ids: set[str] = set()
+    for step in recipe.steps:
+        if step.operation != "min_speed":
+            continue
+        step_route_ids = filtered_route_ids(routes, step.filter)
+        if batches and not (batch_route_ids & step_route_ids):
+            batches[-1] = Batch("min_speed", batches[-1].steps + (step,))
+            batch_route_ids |= step_route_ids
+        else:
+            batches.append(Batch("min_speed", (step,)))
+            batch_route_ids = step_route_ids
+    # route ids per departure operation of the current departures batch
+    departure_route_ids: dict[str, set[str]] = {}
+    for step in recipe.steps:
+        if step.operation == "min_speed":
+            continue
+        if step.operation not in DEPARTURE_OPERATIONS:
+            batches.append(Batch(step.operation, (step,)))
+            continue
+        step_route_ids = filtered_route_ids(routes, step.filter)
+        route_ids = departure_route_ids.get(step.operation, set())
+        if batches[-1:] and batches[-1].operation == "departures":
+            if not (route_ids & step_route_ids):
+                batches[-1] = Batch("departures", batches[-1].steps + (step,))
+                departure_route_ids[step.operation] = route_ids | step_route_ids
+                continue
+        batches.append(Batch("departures", (step,)))
+        departure_route_ids = {step.operation: step_route_ids}
+    return batches
+
+
+def run_step(fiddler: GtfsFiddler, step: Step):
+    """
+    Execute a single step (without any optimization)
+    """
+    if step.operation == "earliest_departure":
+        fiddler.ensure_earliest_departure(step.value, step.filter)
+    elif step.operation == "latest_departure":
+        fiddler.ensure_latest_departure(step.value, step.filter)
+    elif step.operation == "max_trip_interval":
+        fiddler.ensure_max_trip_interval(step.value, step.filter)
+    elif step.operation == "min_headway":
+        fiddler.ensure_min_headway(step.value, step.filter)
+    elif step.operation == "min_speed":
+        ids = filtered_route_ids(fiddler.routes, fiddler.resolve_filter(step.filter))
+        fiddler.ensure_min_speed(route_id2speed={id: step.value for id in ids})
+    else:
+        raise ValueError(f"unknown operation {step.operation}")
+
+
+def run_recipe(fiddler: GtfsFiddler, recipe: Recipe):
+    """
+    Execute all steps of the recipe, see module docs.
+    """
+    # resolve the areas only once (and before the feed is changed)
+    steps = tuple(
+        dataclasses.replace(step, filter=fiddler.resolve_filter(step.filter))
+        for step in recipe.steps
+    )
+    for batch in plan(Recipe(steps), fiddler.routes):
+        logger.info(f"{batch.operation}: {[str(s.value) for s in batch.steps]}")
+        if batch.operation == "min_speed":
+            route_id2speed = {}
+            for step in batch.steps:
+                ids = filtered_route_ids(fiddler.routes, step.filter)
+                route_id2speed.update({id: step.value for id in ids})
+            fiddler.ensure_min_speed(route_id2speed=route_id2speed)
+        elif batch.operation == "departures":
+            targets = {operation: {} for operation in DEPARTURE_OPERATIONS}
+            for step in batch.steps:
+                ids = filtered_route_ids(fiddler.routes, step.filter)
+                targets[step.operation].update({id: step.value for id in ids})
+            fiddler.ensure_departures(
+                DepartureTargets(route_ids=targets["earliest_departure"]),
+                DepartureTargets(route_ids=targets["latest_departure"]),
+            )
+        else:
+            for step in batch.steps:
+                run_step(fiddler, step)
@@ -0,0 +1,108 @@
+"""
+Speed rules per segment, i.e. per pair of consecutive stops of a trip
+(see `GtfsFiddler.ensure_segment_min_speed`), e.g. for a dedicated bus lane
+between two stops or all streets within an area.
+
+Rules are looked up for all stop times at once: stop ids are encoded as integer
+codes, each segment as a single int64 key of its two stop codes, which are matched
+against the keys of the rules with a hash index.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Collection, Sequence
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from gtfs_fiddler import spatial
+
+if TYPE_CHECKING:
+    import shapely
+
+
+@dataclass(frozen=True)
+class StopArea:
+    """
+    All segments between two stops of the area (in this order or the other)
+    """
+
+    stop_ids: Collection[str]
+    speed: float
+
+
+def stop_ids_within(stops: DataFrame, polygon: shapely.Geometry) -> list[str]:
+    """
+    Ids of the stops within the polygon (given in lon/lat) or on its boundary,
+    e.g. for a `StopArea` (the same stops as for `FiddleFilter.area`)
+    """
+    inside = spatial.contains(
+        polygon, stops.stop_lon.to_numpy(float), stops.stop_lat.to_numpy(float)
+    )
+    return stops.stop_id[inside].tolist()
+
+
+class SegmentSpeedIndex:
+    """
+    Index of speeds per (from_stop_id, to_stop_id) and per `StopArea`.
+    Speeds per stop pair take precedence over stop areas,
+    later stop areas take precedence over earlier ones.
+    """
+
+    def __init__(
+        self,
+        segment2speed: dict[tuple[str, str], float] | None = None,
+        stop_areas: Sequence[StopArea] = (),
+    ):
+        segment2speed = segment2speed or {}
+        stop_ids = [s for segment in segment2speed for s in segment]
+        for area in stop_areas:
+            stop_ids.extend(area.stop_ids)
+        self._stop_codes = pd.Index(pd.unique(pd.Series(stop_ids, dtype=object)))
+
+        from_codes = self._stop_codes.get_indexer([s for s, _ in segment2speed])
+        to_codes = self._stop_codes.get_indexer([s for _, s in segment2speed])
+        self._segment_keys = pd.Index(self._key(from_codes, to_codes))
+        self._segment_speeds = np.array(list(segment2speed.values()), dtype=float)
+
+        # per area: whether a stop code is within the area (unknown stops never are)
+        self._areas = []
+        for area in stop_areas:
+            inside = np.zeros(len(self._stop_codes) + 1, dtype=bool)
+            inside[self._stop_codes.get_indexer(list(area.stop_ids))] = True
+            inside[-1] = False
+            self._areas.append((inside, float(area.speed)))
+
+    def _key(self, from_codes: np.ndarray, to_codes: np.ndarray) -> np.ndarray:
+        from_codes = np.asarray(from_codes, dtype=np.int64)
+        to_codes = np.asarray(to_codes, dtype=np.int64)
+        keys = from_codes * len(self._stop_codes) + to_codes
+        # unknown stops (code -1) never match
+        keys[(from_codes < 0) | (to_codes < 0)] = -1
+        return keys
+
+    def __len__(self) -> int:
+        return len(self._segment_keys) + len(self._areas)
+
+    def lookup(self, stop_ids: np.ndarray, boundaries: np.ndarray) -> np.ndarray:
+        """
+        Speed of the segment from each stop to the next stop of the same trip
+        (NaN for segments without rule and the last stop of each trip)
+        for stop ids sorted by trip_id and stop_sequence,
+        with trips given as boundary offsets (see `kernels`).
+        """
+        codes = self._stop_codes.get_indexer(np.asarray(stop_ids, dtype=object))
+        next_codes = np.roll(codes, -1)
+        is_last = np.zeros(len(codes), dtype=bool)
+        is_last[boundaries[1:][np.diff(boundaries) > 0] - 1] = True
+        next_codes[is_last] = -1
+
+        speeds = np.full(len(codes), np.nan)
+        for inside, speed in self._areas:
+            speeds[inside[codes] & inside[next_codes]] = speed
+        rule = self._segment_keys.get_indexer(self._key(codes, next_codes))
+        speeds[rule >= 0] = self._segment_speeds[rule[rule >= 0]]
+        return speeds
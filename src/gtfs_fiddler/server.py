@@ -0,0 +1,301 @@
+"""
+Local fiddle service keeping parsed feeds warm between jobs, e.g. for interactive
+scenario tools that can't afford to import, load and validate the feed for each run:
+
+    python -m gtfs_fiddler.server cairns=data/cairns_gtfs.zip --port 8765
+
+Jobs are posted as JSON to `/fiddle` with the feed's name, an optional date
+and the steps of a recipe (see `recipe.parse_recipe`), e.g.
+
+    {"feed": "cairns", "date": "2014-06-01",
+     "steps": [{"operation": "max_trip_interval", "minutes": 10}]}
+
+and the resulting GTFS zip is streamed back (chunked, i.e. without writing it
+to disk or building it in memory first). `GET /feeds` lists the loaded feeds.
+
+Per feed and date a warm `GtfsFiddler` (with its trip stats, stop patterns and
+stop index computed) is kept, each job runs on a `GtfsFiddler.fork` of it,
+i.e. a copy-on-write view sharing all unmodified tables and indexes.
+The server only listens on localhost (or a Unix socket) and has no authentication.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import socketserver
+import threading
+from collections import OrderedDict
+from datetime import date
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from gtfs_fiddler import feed_io
+from gtfs_fiddler.fiddle import GtfsFiddler
+from gtfs_fiddler.recipe import parse_recipe, run_recipe
+
+if TYPE_CHECKING:
+    from gtfs_kit.feed import Feed
+
+logger = logging.getLogger(__name__)
+
+
+class FeedStore:
+    """
+    Loaded feeds by name and warm fiddlers per (name, date),
+    the least recently used of which are dropped above `max_fiddlers`.
+    """
+
+    def __init__(self, feeds: dict[str, Feed], max_fiddlers: int = 8):
+        self.feeds = feeds
+        self.max_fiddlers = max_fiddlers
+        self._fiddlers: OrderedDict[tuple, GtfsFiddler] = OrderedDict()
+        self._locks: dict[tuple, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, paths: dict[str, Path], dist_units: str, **kwargs) -> "FeedStore":
+        """
+        Read and validate the feeds (name -> path)
+        """
+        feeds = {}
+        for name, p in paths.items():
+            logger.info(f"loading {name} from {p}")
+            feeds[name] = feed_io.read_feed(p, dist_units)
+            feeds[name].validate()
+        return cls(feeds, **kwargs)
+
+    def _warm_fiddler(self, name: str, restrict_to_date: date | None) -> GtfsFiddler:
+        key = (name, restrict_to_date)
+        with self._lock:
+            if key in self._fiddlers:
+                self._fiddlers.move_to_end(key)
+                return self._fiddlers[key]
+            lock = self._locks.setdefault(key, threading.Lock())
+        # only one thread warms up a fiddler, others wait for it
+        with lock:
+            with self._lock:
+                if key in self._fiddlers:
+                    return self._fiddlers[key]
+            logger.info(f"warming up {name} on {restrict_to_date}")
+            fiddler = GtfsFiddler.from_feed(self.feeds[name], restrict_to_date)
+            fiddler.trip_stats()
+            fiddler.stop_patterns()
+            fiddler.stop_index()
+            with self._lock:
+                self._fiddlers[key] = fiddler
+                while len(self._fiddlers) > self.max_fiddlers:
+                    dropped, _ = self._fiddlers.popitem(last=False)
+                    self._locks.pop(dropped, None)
+        return fiddler
+
+    def fiddler(self, name: str, restrict_to_date: date | None = None) -> GtfsFiddler:
+        """
+        A fiddler for the feed (restricted to the date) to run a job on.
+        Raises a KeyError for unknown feeds.
+        """
+        if name not in self.feeds:
+            raise KeyError(name)
+        return self._warm_fiddler(name, restrict_to_date).fork()
+
+
+def run_job(store: FeedStore, job: dict) -> GtfsFiddler:
+    """
+    Run the steps of the job (see module docs) on a fiddler of the store.
+    Raises a KeyError for unknown feeds and a ValueError for invalid jobs.
+    """
+    if not isinstance(job, dict):
+        raise ValueError(f"expected a JSON object but got {job}")
+    job = dict(job)
+    name = job.pop("feed", None)
+    if not isinstance(name, str):
+        raise ValueError(f"feed must be a string but got {name!r}")
+    restrict_to_date = job.pop("date", None)
+    if restrict_to_date is not None:
+        if not isinstance(restrict_to_date, str):
+            raise ValueError(
+                f"date must be a string like '2014-06-01' but got {restrict_to_date!r}"
+            )
+        restrict_to_date = date.fromisoformat(restrict_to_date)
+    recipe = parse_recipe(job)
+    if name not in store.feeds:
+        raise KeyError(name)
+    fiddler = store.fiddler(name, restrict_to_date)
+    run_recipe(fiddler, recipe)
+    return fiddler
+
+
+class _ChunkedWriter:
+    """
+    Write-only file object sending HTTP/1.1 chunks
+    """
+
+    def __init__(self, wfile):
+        self._wfile = wfile
+
+    def write(self, b) -> int:
+        if len(b) > 0:
+            self._wfile.write(f"{len(b):x}\r\n".encode())
+            self._wfile.write(b)
+            self._wfile.write(b"\r\n")
+        return len(b)
+
+    def flush(self):
+        self._wfile.flush()
+
+    def close(self):
+        self._wfile.write(b"0\r\n\r\n")
+        self._wfile.flush()
+
+
+class FiddleRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # set by `make_server`
+    store: FeedStore
+
+    def log_message(self, format, *args):
+        logger.info(format % args)
+
+    def _send_json(self, status: HTTPStatus, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/feeds":
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": f"unknown {self.path}"})
+            return
+        self._send_json(HTTPStatus.OK, sorted(self.store.feeds))
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            # the body can't be skipped, i.e. the connection can't be reused
+            self.close_connection = True
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": "invalid Content-Length"})
+            return
+        body = self.rfile.read(length)
+        if self.path != "/fiddle":
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": f"unknown {self.path}"})
+            return
+        try:
+            # also raises a ValueError for invalid JSON
+            job = json.loads(body)
+            feed = job.get("feed") if isinstance(job, dict) else None
+            if isinstance(feed, str) and feed not in self.store.feeds:
+                self._send_json(HTTPStatus.NOT_FOUND, {"error": f"unknown feed {feed}"})
+                return
+            fiddler = run_job(self.store, job)
+        except ValueError as e:
+            logger.info(f"invalid job: {e}")
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+            return
+        except Exception:
+            logger.exception("job failed")
+            self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "job failed"})
+            return
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        out = _ChunkedWriter(self.wfile)
+        try:
+            feed_io.write_feed(fiddler.feed, out)
+        except Exception:
+            # the status is sent already, so close the connection without
+            # the last chunk, i.e. the client sees an incomplete response
+            # instead of a complete but broken zip
+            logger.exception("writing the feed failed")
+            self.close_connection = True
+            return
+        out.close()
+
+
+class _UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # `BaseHTTPRequestHandler` expects a (host, port) client address
+        return request, ("local", 0)
+
+
+def make_server(
+    store: FeedStore,
+    port: int = 8765,
+    unix_socket: Path | None = None,
+) -> socketserver.BaseServer:
+    """
+    HTTP server for the store on localhost (port 0 picks a free port)
+    or on the Unix socket (if given), call `serve_forever` to start it.
+    """
+    handler = type("Handler", (FiddleRequestHandler,), {"store": store})
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+        return _UnixHTTPServer(str(unix_socket), handler)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "feeds", nargs="+", type=str, help="feeds to load as name=path/to/gtfs.zip"
+    )
+    parser.add_argument(
+        "--dist-unit",
+        type=str,
+        default="km",
+        help="distance unit (used in the input GTFS files)",
+    )
+    parser.add_argument("--port", type=int, default=8765, help="port on localhost")
+    parser.add_argument(
+        "--unix-socket",
+        type=str,
+        default=None,
+        help="listen on this Unix socket instead of localhost",
+    )
+    parser.add_argument(
+        "--max-fiddlers",
+        type=int,
+        default=8,
+        help="warm fiddlers (per feed and date) kept in memory",
+    )
+    args = parser.parse_args()
+
+    paths = {}
+    for arg in args.feeds:
+        name, sep, p = arg.partition("=")
+        if not sep:
+            parser.error(f"expected name=path but got {arg}")
+        paths[name] = Path(p)
+    store = FeedStore.load(paths, args.dist_unit, max_fiddlers=args.max_fiddlers)
+    server = make_server(store, args.port, args.unix_socket)
+    if isinstance(server.server_address, tuple):
+        where = f"http://127.0.0.1:{server.server_address[1]}"
+    else:
+        where = server.server_address
+    logger.info(f"serving {sorted(store.feeds)} on {where}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    logFormat = "%(asctime)s %(name)s %(levelname)s | %(message)s"
+    logging.basicConfig(
+        format=logFormat, datefmt="%Y-%m-%d %H:%M:%S", level=logging.INFO
+    )
+    main()
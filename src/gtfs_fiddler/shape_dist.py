@@ -0,0 +1,240 @@
+"""
+Fast replacement for gtfs_kit's `append_dist_to_stop_times`.
+
+Instead of projecting the stops of each trip onto its shape with shapely,
+distances are computed once per shape and stop pattern (the sequence of stop_ids
+of a trip) with vectorized NumPy linear referencing and broadcast to all trips
+sharing that pattern.
+
+Coordinates are projected to a local equirectangular plane per shape
+for finding the closest point of the shape, distances along the shape are haversine.
+Trips without shape (or feeds without `trips.shape_id`) get the haversine
+distances from stop to stop instead.
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+from pandas import DataFrame
+
+if TYPE_CHECKING:
+    from gtfs_kit.feed import Feed
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_M = 6_371_000
+
+# limit the size of the (stops x shape segments) matrices
+MAX_MATRIX_SIZE = 2_000_000
+
+
+def haversine(
+    lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray
+) -> np.ndarray:
+    """
+    Great-circle distance in meters between coordinates given in degrees
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+class _Shape:
+    """
+    A shape prepared for linear referencing
+    """
+
+    def __init__(self, lat: np.ndarray, lon: np.ndarray):
+        self.lat0 = math.radians(float(np.mean(lat)))
+        xy = self.to_xy(lat, lon)
+        self.start = xy[:-1]
+        self.direction = xy[1:] - xy[:-1]
+        self.length2 = (self.direction**2).sum(axis=1)
+        segment_length = haversine(lat[:-1], lon[:-1], lat[1:], lon[1:])
+        self.cumulative = np.concatenate([[0], np.cumsum(segment_length)])
+
+    def to_xy(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        x = EARTH_RADIUS_M * np.radians(lon) * math.cos(self.lat0)
+        y = EARTH_RADIUS_M * np.radians(lat)
+        return np.column_stack([x, y])
+
+    def candidates(self, xy: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Project points onto each segment of the shape.
+
+        Returns two (points x segments) matrices:
+        the distance along the shape and the squared distance to the projected point.
+        """
+        offset = xy[:, None, :] - self.start[None, :, :]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = (offset * self.direction[None, :, :]).sum(axis=2) / self.length2
+        t = np.clip(np.nan_to_num(t), 0, 1)
+        closest = self.start[None, :, :] + t[:, :, None] * self.direction[None, :, :]
+        d2 = ((xy[:, None, :] - closest) ** 2).sum(axis=2)
+        segment_length = np.diff(self.cumulative)
+        along = self.cumulative[None, :-1] + t * segment_length[None, :]
+        return along, d2
+
+    def project(self, xy: np.ndarray) -> np.ndarray:
+        """
+        Distances (in meters) along the shape of the given stop coordinates.
+
+        Each stop is assigned to the closest point of the shape. If this
+        is not monotonic (e.g. for loops passing a stop twice), the stops are
+        assigned to the (non-decreasing) sequence of segments with the smallest sum
+        of distances to the stops instead.
+        """
+        if len(self.start) == 0 or len(xy) == 0:
+            return np.zeros(len(xy))
+        chunk = max(1, MAX_MATRIX_SIZE // len(self.start))
+        dists = []
+        for i in range(0, len(xy), chunk):
+            along, d2 = self.candidates(xy[i : i + chunk])
+            dists.append(along[np.arange(len(along)), np.argmin(d2, axis=1)])
+        dists = np.concatenate(dists)
+        if np.all(np.diff(dists) >= 0):
+            return dists
+
+        # dynamic programming over stops: cost[j] is the smallest sum of distances
+        # with the current stop on segment j and all previous stops on segments <= j
+        # (going backwards on the same segment is penalized by the distance)
+        segments = np.arange(len(self.start))
+        alongs, predecessors = [], []
+        for i in range(len(xy)):
+            along, d2 = self.candidates(xy[i : i + 1])
+            along, d = along[0], np.sqrt(d2[0])
+            if i == 0:
+                cost = d
+                predecessors.append(segments)
+            else:
+                # best previous segment < j
+                best = np.minimum.accumulate(cost)
+                best_segment = np.maximum.accumulate(
+                    np.where(cost == best, segments, 0)
+                )
+                earlier = np.concatenate([[np.inf], best[:-1]])
+                earlier_segment = np.concatenate([[0], best_segment[:-1]])
+                same = cost + np.maximum(alongs[-1] - along, 0)
+                predecessors.append(
+                    np.where(same <= earlier, segments, earlier_segment)
+                )
+                cost = np.minimum(same, earlier) + d
+            alongs.append(along)
+        j = int(np.argmin(cost))
+        for i in range(len(xy) - 1, -1, -1):
+            dists[i] = alongs[i][j]
+            j = predecessors[i][j]
+        # stops on the same segment may still be slightly out of order
+        return np.maximum.accumulate(dists)
+
+
+def _stop_patterns(st: DataFrame) -> DataFrame:
+    """
+    One row per trip (of the sorted stop times) with its shape_id, stop pattern
+    (the tuple of stop_ids), number of stop times and offset of its first stop time.
+    """
+    lengths = st.groupby("trip_id", sort=False).size()
+    trips = lengths.rename("length").reset_index()
+    trips["start"] = np.concatenate([[0], np.cumsum(lengths.to_numpy())[:-1]])
+    trips["pattern"] = st.groupby("trip_id", sort=False).stop_id.agg(tuple).values
+    trips["shape_id"] = st.groupby("trip_id", sort=False).shape_id.first().values
+    return trips
+
+
+def compute_shape_dist_traveled(
+    feed: Feed,
+    cache: dict[tuple, np.ndarray] | None = None,
+    stop_times: DataFrame | None = None,
+) -> DataFrame:
+    """
+    Returns a copy of the feed's stop_times (sorted by trip_id and stop_sequence)
+    with `shape_dist_traveled` (in the feed's distance units) computed
+    from the shapes (or from stop to stop for trips without shape),
+    see module docstring. Stops without coordinates have missing distances.
+
+    Distances (in meters) are stored in `cache` per (shape_id, stop pattern),
+    pass the same dict to later calls to avoid recomputing them.
+    If `stop_times` is given, they are used instead of the feed's stop_times.
+    """
+    if cache is None:
+        cache = {}
+    if stop_times is None:
+        stop_times = feed.stop_times
+    st = stop_times.drop(columns="shape_dist_traveled", errors="ignore")
+    st = st.sort_values(["trip_id", "stop_sequence"])
+    if "shape_id" in feed.trips.columns:
+        shape_ids = st.trip_id.map(feed.trips.set_index("trip_id").shape_id)
+        st["shape_id"] = shape_ids.astype(object).where(shape_ids.notna(), None)
+    else:
+        st["shape_id"] = None
+    trips = _stop_patterns(st)
+    trip_keys = list(trips[["shape_id", "pattern"]].itertuples(index=False, name=None))
+
+    keys = list(dict.fromkeys(trip_keys))
+    missing = [k for k in keys if k not in cache]
+    if len(missing) > 0:
+        _compute_patterns(feed, missing, cache)
+        logger.info(
+            f"computed distances of {len(missing)}/{len(keys)} stop patterns "
+            f"for {len(trips)} trips"
+        )
+
+    # broadcast the distances of each pattern to all its trips
+    dists = [cache[k] for k in keys]
+    offsets = np.cumsum([0] + [len(d) for d in dists])
+    key2offset = dict(zip(keys, offsets[:-1]))
+    lengths = trips.length.to_numpy()
+    row = np.repeat([key2offset[k] for k in trip_keys], lengths).astype(int)
+    row += np.arange(len(st)) - np.repeat(trips.start.to_numpy(), lengths)
+    dists = np.concatenate(dists) if len(dists) > 0 else np.zeros(0)
+
+    import gtfs_kit.helpers as hp
+
+    m_to_dist = hp.get_convert_dist("m", feed.dist_units)
+    st["shape_dist_traveled"] = m_to_dist(dists[row])
+    return st.drop(columns="shape_id")
+
+
+def _compute_patterns(feed: Feed, keys: list[tuple], cache: dict[tuple, np.ndarray]):
+    """
+    Compute the distances of the given (shape_id, stop pattern) keys into `cache`
+    """
+    stops = feed.stops.set_index("stop_id")[["stop_lat", "stop_lon"]]
+    shape_ids = {shape_id for shape_id, _ in keys}
+    shapes = feed.shapes
+    if shapes is None:
+        shapes = DataFrame(
+            columns=["shape_id", "shape_pt_lat", "shape_pt_lon", "shape_pt_sequence"]
+        )
+    shapes = shapes[shapes.shape_id.isin(shape_ids)].sort_values(
+        ["shape_id", "shape_pt_sequence"]
+    )
+    prepared = {
+        shape_id: _Shape(
+            df.shape_pt_lat.to_numpy(float), df.shape_pt_lon.to_numpy(float)
+        )
+        for shape_id, df in shapes.groupby("shape_id", sort=False)
+    }
+    for key in keys:
+        shape_id, pattern = key
+        shape = prepared.get(shape_id)
+        coords = stops.reindex(list(pattern))
+        known = coords.notna().all(axis=1).to_numpy()
+        lat = coords.stop_lat.to_numpy(float)[known]
+        lon = coords.stop_lon.to_numpy(float)[known]
+        dists = np.full(len(pattern), math.nan)
+        if shape is not None:
+            dists[known] = shape.project(shape.to_xy(lat, lon))
+        elif known.any():
+            # no shape: straight from stop to stop
+            segment_length = haversine(lat[:-1], lon[:-1], lat[1:], lon[1:])
+            dists[known] = np.concatenate([[0], np.cumsum(segment_length)])
+        cache[key] = dists
@@ -0,0 +1,136 @@
+"""
+Run many fiddle scenarios (e.g. recipes with different filters or targets)
+on the same base feed in parallel worker processes (requires the `shared` extra),
+using an Arrow cache of the parsed tables.
+
+`save_feed` stores the parsed base feed once as uncompressed Arrow IPC files,
+which `load_feed` memory-maps and converts to pandas, i.e. the workers
+don't parse the CSVs again and read the files from the shared OS page cache.
+The base feed itself is not shared between the workers: the conversion is not
+zero-copy (gtfs_kit and the fiddler need writable pandas tables with Python
+strings), so each worker holds its own copy and memory grows with the number
+of workers times the size of the feed.
+
+Within a worker the base feed is loaded once and shared by all its scenarios:
+each scenario runs on a `GtfsFiddler.from_feed` view, the trips and stop times
+it adds are kept as `delta.AppendOnlyTable` segments and the `ensure_*` methods
+replace (and never modify) tables, i.e. the tables a scenario doesn't change
+are not copied.
+"""
+
+import json
+import logging
+from collections.abc import Collection, Iterable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+import pyarrow as pa
+from gtfs_kit.feed import Feed
+from pandas import DataFrame
+
+from gtfs_fiddler import feed_io
+from gtfs_fiddler.fiddle import GtfsFiddler
+from gtfs_fiddler.recipe import Recipe, run_recipe
+
+logger = logging.getLogger(__name__)
+
+META_FILE = "feed.json"
+
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    recipe: Recipe
+
+
+def save_feed(feed: Feed, directory: Path):
+    """
+    Store all tables of the feed as Arrow IPC files (one per table) in the directory
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for table in feed_io.GTFS_TABLES:
+        df = getattr(feed, table)
+        if df is None:
+            continue
+        arrow_table = pa.Table.from_pandas(df, preserve_index=False)
+        with pa.ipc.new_file(directory / f"{table}.arrow", arrow_table.schema) as w:
+            w.write_table(arrow_table)
+    (directory / META_FILE).write_text(json.dumps({"dist_units": feed.dist_units}))
+
+
+def load_feed(directory: Path, skip: Collection[str] = ()) -> Feed:
+    """
+    Memory-map a feed stored with `save_feed` and convert it to pandas.
+    Tables listed in `skip` are not loaded and set to None.
+    """
+    directory = Path(directory)
+    meta = json.loads((directory / META_FILE).read_text())
+    tables = {}
+    for table in feed_io.GTFS_TABLES:
+        path = directory / f"{table}.arrow"
+        if table in skip or not path.exists():
+            continue
+        # the buffers of the table keep the memory map open
+        source = pa.memory_map(str(path), "r")
+        tables[table] = feed_io.from_arrow(pa.ipc.open_file(source).read_all())
+    return Feed(dist_units=meta["dist_units"], **tables)
+
+
+# base feeds already loaded by this (worker) process, per directory
+_base_feeds: dict[Path, Feed] = {}
+
+
+def _base_feed(directory: Path) -> Feed:
+    directory = Path(directory).resolve()
+    if directory not in _base_feeds:
+        _base_feeds[directory] = load_feed(directory)
+    return _base_feeds[directory]
+
+
+def run_scenario(
+    directory: Path,
+    scenario: Scenario,
+    out_dir: Path | None = None,
+    backend: str = "pandas",
+) -> DataFrame:
+    """
+    Run the scenario's recipe on the base feed stored in the directory
+    (loaded only once per process) and write the result to `out_dir`/<name>.zip
+    (if given).
+
+    Returns the summary of the scenario's `GtfsFiddler.diff`.
+    """
+    fiddler = GtfsFiddler.from_feed(_base_feed(directory), backend=backend)
+    run_recipe(fiddler, scenario.recipe)
+    if out_dir is not None:
+        feed_io.write_feed(fiddler.feed, Path(out_dir) / f"{scenario.name}.zip")
+    logger.info(f"finished scenario {scenario.name}")
+    return fiddler.diff().summary
+
+
+def run_scenarios(
+    directory: Path,
+    scenarios: Iterable[Scenario],
+    out_dir: Path | None = None,
+    max_workers: int | None = None,
+    backend: str = "pandas",
+) -> dict[str, DataFrame]:
+    """
+    `run_scenario` for all scenarios in a pool of `max_workers` processes,
+    each with its own copy of the base feed (see module docs).
+
+    Returns the diff summary per scenario name.
+    """
+    scenarios = list(scenarios)
+    if len({s.name for s in scenarios}) != len(scenarios):
+        raise ValueError("scenario names must be unique")
+    if out_dir is not None:
+        Path(out_dir).mkdir(parents=True, exist_ok=True)
+    with ProcessPoolExecutor(max_workers) as pool:
+        futures = {
+            s.name: pool.submit(run_scenario, directory, s, out_dir, backend)
+            for s in scenarios
+        }
+        return {name: future.result() for name, future in futures.items()}
@@ -0,0 +1,219 @@
+"""
+Spatial selection of routes for `FiddleFilter.area`: all routes with at least
+one trip serving a stop within a bounding box (`BBox`), a radius around a point
+(`Radius`) or any shapely geometry (e.g. a polygon), all given in lon/lat.
+
+`StopIndex` is built once per feed:
+
+- a uniform grid over the stop coordinates, with the stops sorted by grid cell,
+  so the candidate stops of an area are a few contiguous slices (one per grid column
+  overlapping the area's bounds, found with `searchsorted`)
+  and only these are tested exactly, and
+- an inverted index of the trips serving each stop (as offsets into
+  the trips sorted by stop), i.e. no join of the area with the stop times per query.
+
+shapely is only imported for geometries, i.e. not for boxes and radii.
+"""
+
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from gtfs_fiddler import patterns
+from gtfs_fiddler.shape_dist import EARTH_RADIUS_M, haversine
+
+if TYPE_CHECKING:
+    import shapely
+
+
+@dataclass(frozen=True)
+class BBox:
+    min_lon: float
+    min_lat: float
+    max_lon: float
+    max_lat: float
+
+
+@dataclass(frozen=True)
+class Radius:
+    lon: float
+    lat: float
+    meters: float
+
+
+if TYPE_CHECKING:
+    Area = BBox | Radius | shapely.Geometry
+
+
+def __getattr__(name: str):
+    # `Area` at runtime (e.g. for `typing.get_type_hints(FiddleFilter)`),
+    # shapely is only imported when it is requested, not on import of this module
+    if name == "Area":
+        import shapely
+
+        return BBox | Radius | shapely.Geometry
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def area_bounds(area: Area) -> tuple[float, float, float, float]:
+    """
+    (min_lon, min_lat, max_lon, max_lat) containing the area
+    """
+    if isinstance(area, BBox):
+        return area.min_lon, area.min_lat, area.max_lon, area.max_lat
+    if isinstance(area, Radius):
+        dlat = math.degrees(area.meters / EARTH_RADIUS_M)
+        cos_lat = math.cos(math.radians(min(abs(area.lat) + dlat, 90)))
+        dlon = 180 if cos_lat < 1e-9 else min(dlat / cos_lat, 180)
+        return area.lon - dlon, area.lat - dlat, area.lon + dlon, area.lat + dlat
+    import shapely
+
+    return tuple(shapely.bounds(area))
+
+
+def contains(area: Area, lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+    """
+    Whether each coordinate is within the area (or on its boundary)
+    """
+    if isinstance(area, BBox):
+        return (
+            (lon >= area.min_lon)
+            & (lon <= area.max_lon)
+            & (lat >= area.min_lat)
+            & (lat <= area.max_lat)
+        )
+    if isinstance(area, Radius):
+        return haversine(lat, lon, area.lat, area.lon) <= area.meters
+    import shapely
+
+    return shapely.intersects_xy(area, lon, lat)
+
+
+class StopIndex:
+    """
+    Grid index over the stops and inverted index of the trips serving each stop,
+    see module docs. Without `cell_degrees` the grid has about as many cells as stops.
+    """
+
+    def __init__(
+        self,
+        stops: DataFrame,
+        stop_times: DataFrame,
+        trips: DataFrame,
+        cell_degrees: float | None = None,
+    ):
+        lon = stops.stop_lon.to_numpy(float)
+        lat = stops.stop_lat.to_numpy(float)
+        known = ~(np.isnan(lon) | np.isnan(lat))
+        lon, lat = lon[known], lat[known]
+        stop_ids = stops.stop_id.to_numpy(dtype=object)[known]
+
+        self._min_lon = lon.min() if len(lon) > 0 else 0.0
+        self._min_lat = lat.min() if len(lat) > 0 else 0.0
+        if cell_degrees is None:
+            extent = max(np.ptp(lon), np.ptp(lat)) if len(lon) > 0 else 0.0
+            cell_degrees = extent / max(1.0, math.sqrt(len(lon))) or 1.0
+        self._cell = cell_degrees
+        cx, cy = self._cell_of(lon, lat)
+        self._columns = int(cx.max()) + 1 if len(lon) > 0 else 0
+        self._rows = int(cy.max()) + 1 if len(lat) > 0 else 0
+        keys = cx * self._rows + cy
+        order = np.argsort(keys, kind="stable")
+        self._keys = keys[order]
+        self._lon, self._lat = lon[order], lat[order]
+        self._stop_ids = pd.Index(stop_ids[order])
+
+        # trips per stop (by position in the sorted stops)
+        self._trip_ids = pd.Index(pd.unique(trips.trip_id))
+        route_ids = trips.set_index("trip_id").route_id
+        self._trip_route_ids = route_ids.loc[self._trip_ids].to_numpy(dtype=object)
+        pairs = stop_times[["stop_id", "trip_id"]].drop_duplicates()
+        stop_codes = self._stop_ids.get_indexer(pairs.stop_id)
+        trip_codes = self._trip_ids.get_indexer(pairs.trip_id)
+        valid = (stop_codes >= 0) & (trip_codes >= 0)
+        stop_codes, trip_codes = stop_codes[valid], trip_codes[valid]
+        order = np.argsort(stop_codes, kind="stable")
+        self._stop_trips = trip_codes[order]
+        self._stop_offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(stop_codes, minlength=len(self._stop_ids)))]
+        )
+
+    @classmethod
+    def from_stop_routes(
+        cls,
+        stops: DataFrame,
+        stop_routes: DataFrame,
+        cell_degrees: float | None = None,
+    ) -> "StopIndex":
+        """
+        Index over the distinct (stop_id, route_id) pairs of `stop_routes`
+        instead of all stop times: each route stands in for its trips, so
+        `route_ids` is unchanged while `trip_ids` returns route ids
+        """
+        route_ids = pd.unique(stop_routes.route_id)
+        return cls(
+            stops,
+            DataFrame(
+                {"stop_id": stop_routes.stop_id, "trip_id": stop_routes.route_id}
+            ),
+            DataFrame({"trip_id": route_ids, "route_id": route_ids}),
+            cell_degrees,
+        )
+
+    def _cell_of(self, lon, lat) -> tuple[np.ndarray, np.ndarray]:
+        cx = np.floor((np.asarray(lon) - self._min_lon) / self._cell).astype(np.int64)
+        cy = np.floor((np.asarray(lat) - self._min_lat) / self._cell).astype(np.int64)
+        return cx, cy
+
+    def __len__(self) -> int:
+        return len(self._stop_ids)
+
+    def _stops_within(self, area: Area) -> np.ndarray:
+        """
+        Positions of the (sorted) stops within the area
+        """
+        if len(self._stop_ids) == 0:
+            return np.zeros(0, dtype=np.int64)
+        min_lon, min_lat, max_lon, max_lat = area_bounds(area)
+        (x0, x1), (y0, y1) = self._cell_of([min_lon, max_lon], [min_lat, max_lat])
+        x0, x1 = max(x0, 0), min(x1, self._columns - 1)
+        y0, y1 = max(y0, 0), min(y1, self._rows - 1)
+        if x0 > x1 or y0 > y1:
+            return np.zeros(0, dtype=np.int64)
+        # one slice of candidates per grid column
+        columns = np.arange(x0, x1 + 1) * self._rows
+        starts = np.searchsorted(self._keys, columns + y0)
+        ends = np.searchsorted(self._keys, columns + y1 + 1)
+        candidates = patterns.rows_of(starts, ends - starts)
+        inside = contains(area, self._lon[candidates], self._lat[candidates])
+        return candidates[inside]
+
+    def stop_ids(self, area: Area) -> list[str]:
+        """
+        Ids of the stops within the area
+        """
+        return self._stop_ids[self._stops_within(area)].tolist()
+
+    def _trip_codes(self, area: Area) -> np.ndarray:
+        stops = self._stops_within(area)
+        starts, ends = self._stop_offsets[stops], self._stop_offsets[stops + 1]
+        positions = patterns.rows_of(starts, ends - starts)
+        return np.unique(self._stop_trips[positions])
+
+    def trip_ids(self, area: Area) -> list[str]:
+        """
+        Ids of the trips serving at least one stop within the area
+        """
+        return self._trip_ids[self._trip_codes(area)].tolist()
+
+    def route_ids(self, area: Area) -> set[str]:
+        """
+        Ids of the routes with at least one trip serving a stop within the area
+        """
+        return set(self._trip_route_ids[self._trip_codes(area)])
@@ -0,0 +1,129 @@
+"""
+Next departures at a stop (optionally of a single route) after a given time,
+e.g. to inspect the fiddled feed interactively (see `GtfsFiddler.next_departures`).
+
+`TimetableIndex` is built once per feed from its stop times: the departures
+(in seconds) sorted by stop and time, and sorted by stop, route and time,
+each with the trip codes in a parallel array and the offsets of each stop
+(and stop and route) in a dict. So a query is a dict lookup, a binary search
+(`bisect` on a memoryview of the departures, i.e. without any copy or NumPy
+call overhead) and a slice, instead of filtering all stop times.
+
+Only stop times where passengers can board are departures, i.e. not the last stop
+of a trip and not stops with `pickup_type` 1 (no pickup). Missing departure
+times fall back to the arrival time, stop times without both
+(and trips without `route_id`) are skipped.
+Trips defined by frequencies are listed with the times of their stop times.
+"""
+
+from __future__ import annotations
+
+import bisect
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from gtfs_fiddler.gtfs_time import GtfsTime, to_seconds
+
+
+class Departure(NamedTuple):
+    time: GtfsTime
+    trip_id: str
+    route_id: str
+
+
+def _offsets(keys: np.ndarray) -> tuple[np.ndarray, list[int]]:
+    """
+    Distinct (sorted) keys and their first and last+1 positions
+    """
+    unique, first = np.unique(keys, return_index=True)
+    return unique, np.append(first, len(keys)).tolist()
+
+
+class TimetableIndex:
+    """
+    Departures per stop (and route) sorted by time, see module docs.
+    """
+
+    def __init__(self, stop_times: DataFrame, trips: DataFrame):
+        st = stop_times[["trip_id", "stop_id", "stop_sequence"]]
+        departure = to_seconds(stop_times.departure_time)
+        departure = np.where(
+            np.isnan(departure), to_seconds(stop_times.arrival_time), departure
+        )
+        last = st.groupby("trip_id").stop_sequence.transform("max").to_numpy()
+        boarding = ~np.isnan(departure) & (st.stop_sequence.to_numpy() != last)
+        if "pickup_type" in stop_times.columns:
+            boarding &= stop_times.pickup_type.to_numpy(dtype=float) != 1
+
+        # trips without route can't be queried per route, i.e. are skipped
+        trips = trips[trips.route_id.notna().to_numpy()]
+        trip_ids = pd.Index(pd.unique(trips.trip_id))
+        route_ids = trips.set_index("trip_id").route_id
+        # route per trip (by trip code)
+        self._trip_routes = route_ids.loc[trip_ids].to_numpy(dtype=object)
+        route_codes, route_ids = pd.factorize(self._trip_routes)
+        self._trip_ids = trip_ids.to_numpy(dtype=object)
+        trip_codes = trip_ids.get_indexer(st.trip_id)
+        boarding &= trip_codes >= 0
+        stop_codes, stop_ids = pd.factorize(st.stop_id.to_numpy(dtype=object))
+        stop_codes, trip_codes = stop_codes[boarding], trip_codes[boarding]
+        departure = departure[boarding].astype(np.int64)
+        route_codes = route_codes[trip_codes]
+
+        # by stop and time
+        order = np.lexsort((trip_codes, departure, stop_codes))
+        self._departures = memoryview(departure[order])
+        self._trips = trip_codes[order]
+        stops, offsets = _offsets(stop_codes[order])
+        self._stops = {
+            stop_ids[s]: (offsets[i], offsets[i + 1]) for i, s in enumerate(stops)
+        }
+
+        # by stop, route and time
+        order = np.lexsort((trip_codes, departure, route_codes, stop_codes))
+        self._route_departures = memoryview(departure[order])
+        self._route_trips = trip_codes[order]
+        pairs = stop_codes[order] * len(route_ids) + route_codes[order]
+        pairs, offsets = _offsets(pairs)
+        stops, routes = np.divmod(pairs, max(len(route_ids), 1))
+        self._stop_routes = {
+            (stop_ids[s], route_ids[r]): (offsets[i], offsets[i + 1])
+            for i, (s, r) in enumerate(zip(stops, routes))
+        }
+
+    def __len__(self) -> int:
+        return len(self._departures)
+
+    def next_departures(
+        self,
+        stop_id: str,
+        after: GtfsTime | str | int,
+        n: int = 5,
+        route_id: str | None = None,
+    ) -> list[Departure]:
+        """
+        The next `n` departures at the stop (of the route, if given)
+        at or after the given time, sorted by time
+        (empty for unknown stops or routes).
+        """
+        if route_id is None:
+            lo, hi = self._stops.get(stop_id, (0, 0))
+            departures, trips = self._departures, self._trips
+        else:
+            lo, hi = self._stop_routes.get((stop_id, route_id), (0, 0))
+            departures, trips = self._route_departures, self._route_trips
+        seconds = GtfsTime(after).seconds_of_day
+        first = bisect.bisect_left(departures, seconds, lo, hi)
+        last = min(first + n, hi)
+        trip_codes = trips[first:last]
+        return [
+            Departure(GtfsTime._of(d), trip_id, route_id)
+            for d, trip_id, route_id in zip(
+                departures[first:last].tolist(),
+                self._trip_ids[trip_codes],
+                self._trip_routes[trip_codes],
+            )
+        ]
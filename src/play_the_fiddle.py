@@ -3,12 +3,21 @@ Reduce GTFS feed to a single day and densify trips for that day
 """
 
 import logging
+import shutil
 import sys
 from datetime import date
 from pathlib import Path
 import argparse
+from gtfs_fiddler.cache import (
+    RESULT_SUFFIX,
+    ResultCache,
+    feed_key,
+    restricted_feed,
+)
+from gtfs_fiddler.estimate import dry_run, sample_run
 from gtfs_fiddler.fiddle import FiddleFilter, GtfsFiddler
 from gtfs_fiddler.gtfs_time import GtfsTime
+from gtfs_fiddler.recipe import Recipe, Step, load_recipe, parse_area, run_recipe
 
 logFormat = "%(asctime)s %(name)s %(levelname)s | %(message)s"
 logging.basicConfig(format=logFormat, datefmt="%Y-%m-%d %H:%M:%S", level=logging.INFO)
@@ -36,10 +45,16 @@ def main(args):
         if args.filter_route_short_names is None
         else [v.strip() for v in args.filter_route_short_names.split(",")]
     )
+    area = (
+        None
+        if args.filter_bbox is None
+        else parse_area(bbox=[float(v) for v in args.filter_bbox.split(",")])
+    )
     filter = FiddleFilter(
         route_types=route_types,
         route_ids=route_ids,
         route_short_names=route_short_names,
+        area=area,
     )
     earliest_departure = (
         GtfsTime(args.earliest_departure)
@@ -49,31 +64,74 @@ def main(args):
     latest_departure = (
         GtfsTime(args.latest_departure) if args.latest_departure is not None else None
     )
+    recipe = load_recipe(Path(args.recipe)) if args.recipe is not None else None
 
-    logger.info(f"loading {in_file} (reducing it to {the_date})")
-    fiddler = GtfsFiddler(in_file, args.dist_unit, the_date)
-
+    # the steps given as arguments are executed before the steps of the recipe
+    steps = []
     if earliest_departure is not None:
-        logger.info(f"ensure earliest departure at {earliest_departure}")
-        fiddler.ensure_earliest_departure(earliest_departure, filter)
-
+        steps.append(Step("earliest_departure", earliest_departure, filter))
     if latest_departure is not None:
-        logger.info(f"ensure latest departure at {latest_departure}")
-        fiddler.ensure_latest_departure(latest_departure, filter)
-
+        steps.append(Step("latest_departure", latest_departure, filter))
     if args.interval_minutes is not None:
-        logger.info(f"ensure max trip interval: {args.interval_minutes} minutes")
-        fiddler.ensure_max_trip_interval(args.interval_minutes, filter)
-
-    # logger.info(f"increasing speed of buses and trams")
-    # fiddler.ensure_min_speed(route_type2speed={0: 25, 3: 25})
+        steps.append(Step("max_trip_interval", args.interval_minutes, filter))
+    if args.min_headway_minutes is not None:
+        steps.append(Step("min_headway", args.min_headway_minutes, filter))
+    if recipe is not None:
+        steps.extend(recipe.steps)
 
-    # logger.info(f"increasing speed of selected routes (SHOW Salzburg)")
-    # route_ids = ["42", "s7v4", "rc3d", "nq8b", "w1k2", "tcn7"]
-    # fiddler.ensure_min_speed(route_id2speed={id: 50 for id in route_ids})
+    if args.cache_dir is None:
+        logger.info(f"loading {in_file} (reducing it to {the_date})")
+        fiddler = GtfsFiddler(in_file, args.dist_unit, the_date)
+    else:
+        cache = ResultCache(Path(args.cache_dir), args.cache_max_mb * 2**20)
+        key = feed_key(in_file, the_date, args.dist_unit)
+        result_key = cache.key(key, repr(steps), f"prune={args.prune}")
+        cached = cache.get(result_key, RESULT_SUFFIX)
+        if cached is not None and args.matsim_dir is None and not args.dry_run:
+            logger.info(f"copying cached result to {out_file}")
+            shutil.copyfile(cached, out_file)
+            return
+        logger.info(f"loading {in_file} (reducing it to {the_date})")
+        feed = restricted_feed(cache, in_file, the_date, args.dist_unit, key)
+        fiddler = GtfsFiddler.from_feed(feed)
+    if args.dry_run:
+        estimate(fiddler, Recipe(tuple(steps)), args.sample_routes)
+        return
+    run_recipe(fiddler, Recipe(tuple(steps)))
+    if args.prune:
+        fiddler.prune()
 
     logger.info(f"writing result to {out_file}")
     fiddler.feed.write(out_file)
+    if args.cache_dir is not None:
+        cache.put(result_key, RESULT_SUFFIX, lambda tmp: shutil.copyfile(out_file, tmp))
+    if args.matsim_dir is not None:
+        matsim_dir = Path(args.matsim_dir)
+        matsim_dir.mkdir(parents=True, exist_ok=True)
+        logger.info(f"writing MATSim transit schedule and vehicles to {matsim_dir}")
+        fiddler.write_matsim(
+            matsim_dir / "transitSchedule.xml.gz",
+            matsim_dir / "transitVehicles.xml.gz",
+            crs=args.matsim_crs,
+        )
+
+
+def estimate(fiddler: GtfsFiddler, recipe: Recipe, route_fraction: float | None):
+    result = dry_run(fiddler, recipe)
+    logger.info(f"dry run:\n{result.steps.to_string()}")
+    logger.info(
+        f"{result.added_trips} trips and {result.added_stop_times} stop times added, "
+        f"stop times: {result.memory_mb:.0f} MB in memory, "
+        f"{result.csv_mb:.0f} MB as CSV"
+    )
+    if route_fraction is not None:
+        sample = sample_run(fiddler, recipe, route_fraction)
+        logger.info(
+            f"sample of {sample.routes} routes ({sample.fraction:.1%} of stop times): "
+            f"{sample.seconds:.1f}s, peak {sample.peak_mb:.0f} MB, "
+            f"estimated {sample.estimated_seconds:.0f}s, "
+            f"peak {sample.estimated_peak_mb:.0f} MB for the whole feed"
+        )
 
 
 if __name__ == "__main__":
@@ -107,12 +165,24 @@ if __name__ == "__main__":
         default=None,
         help="only affect certain routes (comma-separated list)",
     )
+    parser.add_argument(
+        "--filter-bbox",
+        type=str,
+        default=None,
+        help="only affect routes serving stops within min_lon,min_lat,max_lon,max_lat",
+    )
     parser.add_argument(
         "--interval-minutes",
         type=int,
         default=None,
         help="ensure maximum duration of intervals (between two trips)",
     )
+    parser.add_argument(
+        "--min-headway-minutes",
+        type=int,
+        default=None,
+        help="remove trips departing less than this after the previous one",
+    )
     parser.add_argument(
         "--earliest-departure",
         type=str,
@@ -125,6 +195,53 @@ if __name__ == "__main__":
         default=None,
         help="ensure latest departure per route and direction (hh:mm)",
     )
+    parser.add_argument(
+        "--recipe",
+        type=str,
+        default=None,
+        help="recipe file (.toml or .yaml) with further steps, see gtfs_fiddler.recipe",
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="remove stops, shapes, services, .. and empty columns not used by any trip",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="only report the trips and stop times that would be added or removed",
+    )
+    parser.add_argument(
+        "--sample-routes",
+        type=float,
+        default=None,
+        help="with --dry-run: run on this fraction of the routes to estimate runtime",
+    )
+    parser.add_argument(
+        "--matsim-dir",
+        type=str,
+        default=None,
+        help="also write a MATSim transit schedule and vehicles (without links) here",
+    )
+    parser.add_argument(
+        "--matsim-crs",
+        type=str,
+        default=None,
+        help="coordinate reference system of the MATSim stops, e.g. EPSG:31256",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="cache restricted feeds and results here (trusted directory only, "
+        "cached feeds are unpickled), see gtfs_fiddler.cache",
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=int,
+        default=1024,
+        help="maximum size of the cache (least recently used entries are evicted)",
+    )
     args = parser.parse_args()
 
     main(args)
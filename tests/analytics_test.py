@@ -0,0 +1,56 @@
+import pytest
+
+from gtfs_fiddler import analytics
+from gtfs_fiddler.fiddle import GtfsFiddler
+from gtfs_fiddler.gtfs_time import GtfsTime
+
+from .fiddle_test import CAIRNS_GTFS, DIST_UNIT, SUNDAY
+
+
+def test_invalid_level():
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    with pytest.raises(ValueError):
+        analytics.headway_stats(fiddler.feed, "agency")
+
+
+def test_headway_stats__same_as_trips_enriched():
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    stats = analytics.headway_stats(fiddler.feed).set_index(
+        ["route_id", "direction_id"]
+    )
+    stats = stats.map(lambda v: v.seconds_of_day if isinstance(v, GtfsTime) else v)
+    te = fiddler.trips_enriched()
+    te = te.map(lambda v: v.seconds_of_day if isinstance(v, GtfsTime) else v)
+    te = te.groupby(["route_id", "direction_id"])
+
+    assert (stats.num_departures == te.size()).all()
+    assert (stats.first_departure == te.start_time.min()).all()
+    assert (stats.last_departure == te.start_time.max()).all()
+    assert stats.max_headway.equals(te.time_to_next_trip.max())
+    assert stats.median_headway.equals(te.time_to_next_trip.median().round())
+
+
+def test_headway_stats__per_stop():
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    stats = analytics.headway_stats(fiddler.feed, "stop")
+    assert stats.num_departures.sum() == fiddler.stop_times.departure_time.notna().sum()
+    stats = stats.dropna(subset="max_headway")
+    assert not (stats.min_headway > stats.max_headway).any()
+
+
+def test_trips_per_hour():
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    histogram = analytics.trips_per_hour(fiddler.feed).set_index(
+        ["route_id", "direction_id"]
+    )
+    assert histogram.sum(axis=1).sum() == len(fiddler.trips)
+    assert list(histogram.columns) == list(range(len(histogram.columns)))
+
+
+def test_service_gaps_before_and_after():
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    assert len(analytics.service_gaps(fiddler.feed, 30)) > 0
+    fiddler.ensure_max_trip_interval(30)
+    assert len(analytics.service_gaps(fiddler.feed, 30)) == 0
+    stats = analytics.headway_stats(fiddler.feed)
+    assert not (stats.max_headway.dropna() > GtfsTime("00:30:00")).any()
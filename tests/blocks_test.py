@@ -0,0 +1,108 @@
+import math
+
+import pandas as pd
+from gtfs_kit.feed import Feed
+from pandas import DataFrame
+
+from gtfs_fiddler.blocks import (
+    NEW_BLOCK_PREFIX,
+    VehicleCount,
+    assign_blocks,
+    trip_spans,
+    vehicle_count,
+)
+from gtfs_fiddler.fiddle import GtfsFiddler
+from gtfs_fiddler.gtfs_time import GtfsTime
+
+from .fiddle_test import CAIRNS_GTFS, DIST_UNIT, SUNDAY
+
+
+def _feed(trips: dict[str, tuple[str, str, str | float]]) -> Feed:
+    """
+    trip_id -> (start, end, block_id), all trips of a single bus route
+    """
+    routes = DataFrame({"route_id": ["r"], "route_type": [3]})
+    trip_ids = list(trips)
+    stop_times = DataFrame(
+        {
+            "trip_id": [t for t in trip_ids for _ in range(2)],
+            "stop_sequence": [1, 2] * len(trips),
+            "stop_id": ["a", "b"] * len(trips),
+            "arrival_time": [
+                time for start, end, _ in trips.values() for time in (start, end)
+            ],
+        }
+    )
+    stop_times["departure_time"] = stop_times.arrival_time
+    trips = DataFrame(
+        {
+            "trip_id": trip_ids,
+            "route_id": "r",
+            "service_id": "s",
+            "block_id": [block_id for _, _, block_id in trips.values()],
+        }
+    )
+    return Feed(dist_units="km", routes=routes, trips=trips, stop_times=stop_times)
+
+
+def test_assign_blocks():
+    feed = _feed(
+        {
+            "b1": ("08:00:00", "09:00:00", "B"),
+            "b2": ("10:00:00", "11:00:00", "B"),
+            "fits_b": ("09:10:00", "09:50:00", "B"),
+            "overlaps_b": ("08:30:00", "09:30:00", "B"),
+            "after_overlaps_b": ("09:40:00", "10:30:00", math.nan),
+            "after_b": ("11:00:00", "12:00:00", "B"),
+        }
+    )
+    new_trips = pd.Series(["fits_b", "overlaps_b", "after_overlaps_b", "after_b"])
+    block_ids = assign_blocks(feed, new_trips)
+    assert block_ids.to_dict() == {
+        "fits_b": "B",
+        "overlaps_b": f"{NEW_BLOCK_PREFIX}0",
+        # new blocks are reused as well
+        "after_overlaps_b": f"{NEW_BLOCK_PREFIX}0",
+        "after_b": "B",
+    }
+
+    # with a layover of 15 minutes b can't be reused before 11:15
+    block_ids = assign_blocks(feed, new_trips, 15 * 60)
+    assert block_ids.to_dict() == {
+        "fits_b": f"{NEW_BLOCK_PREFIX}1",
+        "overlaps_b": f"{NEW_BLOCK_PREFIX}0",
+        "after_overlaps_b": f"{NEW_BLOCK_PREFIX}2",
+        # the block with the shortest idle time
+        "after_b": f"{NEW_BLOCK_PREFIX}2",
+    }
+
+
+def test_vehicle_count():
+    feed = _feed(
+        {
+            "a": ("08:00:00", "09:00:00", "B"),
+            "b": ("09:00:00", "10:00:00", "B"),
+            "c": ("08:30:00", "09:30:00", math.nan),
+        }
+    )
+    count = vehicle_count(feed)
+    assert count == VehicleCount(blocks=1, unblocked_trips=1, peak=2)
+    assert count.vehicles == 2
+
+
+def test_assign_blocks__cairns_without_conflicts():
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    before = fiddler.vehicle_count()
+    fiddler.ensure_earliest_departure(GtfsTime("04:00:00"))
+    fiddler.ensure_max_trip_interval(10)
+    count = fiddler.assign_blocks(min_layover_minutes=5)
+
+    spans = trip_spans(fiddler.feed)
+    added = ~spans.trip_id.isin(fiddler._base_feed.trips.trip_id)
+    assert spans.block_id[added].notna().all()
+    assert count.blocks > 0
+    assert count.peak > before.peak
+    # no overlapping trips within a block
+    spans = spans[spans.block_id.notna()].sort_values(["block_id", "start"])
+    previous_end = spans.groupby("block_id").end.shift()
+    assert not (spans.start < previous_end + 5 * 60).any()
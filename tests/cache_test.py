@@ -0,0 +1,87 @@
+import os
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from gtfs_fiddler import cache as fiddle_cache
+from gtfs_fiddler.cache import FEED_SUFFIX, ResultCache, feed_key, restricted_feed
+from gtfs_fiddler.fiddle import GtfsFiddler
+
+from .fiddle_test import CAIRNS_GTFS, DIST_UNIT, SUNDAY
+
+
+def _write_bytes(n: int):
+    return lambda p: Path(p).write_bytes(b"x" * n)
+
+
+def test_key():
+    assert ResultCache.key("a", 1) == ResultCache.key("a", 1)
+    assert ResultCache.key("a", 1) != ResultCache.key("a", 2)
+    # parts are separated
+    assert ResultCache.key("ab", "c") != ResultCache.key("a", "bc")
+
+
+def test_key__depends_on_source(monkeypatch):
+    key = ResultCache.key("a")
+    monkeypatch.setattr(fiddle_cache, "source_digest", lambda: "changed")
+    assert ResultCache.key("a") != key
+
+
+def test_get_and_put(tmp_path: Path):
+    cache = ResultCache(tmp_path, max_bytes=100)
+    assert cache.get("k", ".zip") is None
+    p = cache.put("k", ".zip", _write_bytes(10))
+    assert cache.get("k", ".zip") == p
+    assert p.read_bytes() == b"x" * 10
+    assert cache.get("k", ".other") is None
+    # no temporary files are left
+    assert list(tmp_path.iterdir()) == [p]
+
+
+def test_put__failed_write_leaves_no_entry(tmp_path: Path):
+    def write(p: Path):
+        p.write_bytes(b"partial")
+        raise RuntimeError()
+
+    cache = ResultCache(tmp_path, max_bytes=100)
+    with pytest.raises(RuntimeError):
+        cache.put("k", ".zip", write)
+    assert cache.get("k", ".zip") is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_evict__least_recently_used(tmp_path: Path):
+    cache = ResultCache(tmp_path, max_bytes=25)
+    for i, key in enumerate(["a", "b"]):
+        p = cache.put(key, ".zip", _write_bytes(10))
+        os.utime(p, (i, i))
+    # a is used again, i.e. b is the least recently used
+    assert cache.get("a", ".zip") is not None
+    cache.put("c", ".zip", _write_bytes(10))
+    assert cache.get("b", ".zip") is None
+    assert cache.get("a", ".zip") is not None
+    assert cache.get("c", ".zip") is not None
+
+    # an entry larger than the cache is kept until the next put
+    cache.put("d", ".zip", _write_bytes(30))
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["d.zip"]
+
+
+def test_restricted_feed__reused(tmp_path: Path, monkeypatch):
+    cache = ResultCache(tmp_path, max_bytes=2**30)
+    feed = restricted_feed(cache, CAIRNS_GTFS, SUNDAY, DIST_UNIT)
+    key = feed_key(CAIRNS_GTFS, SUNDAY, DIST_UNIT)
+    assert cache.get(key, FEED_SUFFIX) is not None
+    assert feed_key(CAIRNS_GTFS, SUNDAY.replace(day=2), DIST_UNIT) != key
+
+    expected = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY).feed
+
+    def read_feed(*args, **kwargs):
+        raise AssertionError("feed should be cached")
+
+    monkeypatch.setattr(fiddle_cache.feed_io, "read_feed", read_feed)
+    cached = restricted_feed(cache, CAIRNS_GTFS, SUNDAY, DIST_UNIT, key)
+    for table in ["routes", "trips", "stops", "stop_times", "calendar"]:
+        pd.testing.assert_frame_equal(getattr(cached, table), getattr(feed, table))
+        pd.testing.assert_frame_equal(getattr(cached, table), getattr(expected, table))
@@ -0,0 +1,67 @@
+from pathlib import Path
+
+import gtfs_kit as gk
+import pytest
+from gtfs_kit.helpers import almost_equal
+
+from gtfs_fiddler.fiddle import FiddleFilter, GtfsFiddler
+from gtfs_fiddler.gtfs_time import GtfsTime
+
+pytest.importorskip("pyarrow")
+
+from gtfs_fiddler.chunked import ChunkedGtfsFiddler, assign_partitions
+
+from .fiddle_test import CAIRNS_GTFS, DIST_UNIT, SUNDAY
+from .spatial_test import CITY_CENTRE
+
+
+def test_assign_partitions():
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    route2partition = assign_partitions(fiddler.trips, 4)
+    assert set(route2partition.keys()) == set(fiddler.trips.route_id)
+    assert set(route2partition.values()) == {0, 1, 2, 3}
+
+
+def test_chunked_equals_in_memory(tmp_path: Path):
+    chunked = ChunkedGtfsFiddler(
+        CAIRNS_GTFS,
+        DIST_UNIT,
+        tmp_path / "work",
+        SUNDAY,
+        partition_count=4,
+        chunksize=5000,
+    )
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    assert len(chunked.trips) == len(fiddler.trips)
+
+    for f in (chunked, fiddler):
+        f.ensure_earliest_departure(
+            GtfsTime("5:00"), FiddleFilter(route_ids=["110-423"])
+        )
+        f.ensure_max_trip_interval(30)
+        f.ensure_min_speed(route_type2speed={3: 30})
+
+    chunked.write(tmp_path / "chunked.zip")
+    fiddler.feed.write(tmp_path / "in_memory.zip")
+    actual = gk.read_feed(tmp_path / "chunked.zip", DIST_UNIT)
+    expected = gk.read_feed(tmp_path / "in_memory.zip", DIST_UNIT)
+    for table in ["trips", "stop_times", "stops", "routes", "calendar"]:
+        assert almost_equal(getattr(actual, table), getattr(expected, table)), table
+
+    chunked.cleanup()
+    assert not (tmp_path / "work").exists()
+
+
+def test_chunked__area_filter(tmp_path: Path):
+    chunked = ChunkedGtfsFiddler(
+        CAIRNS_GTFS, DIST_UNIT, tmp_path / "work", SUNDAY, partition_count=4
+    )
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    filter = FiddleFilter(area=CITY_CENTRE)
+    assert chunked.resolve_filter(filter) == fiddler.resolve_filter(filter)
+    num_trips = len(chunked.trips)
+    for f in (chunked, fiddler):
+        f.ensure_max_trip_interval(10, filter)
+    assert len(chunked.trips) > num_trips
+    assert sorted(chunked.trips.trip_id) == sorted(fiddler.trips.trip_id)
+    chunked.cleanup()
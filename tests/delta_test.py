@@ -0,0 +1,120 @@
+import pandas as pd
+import pytest
+from pandas import DataFrame
+
+from gtfs_fiddler.delta import AppendOnlyTable
+from gtfs_fiddler.fiddle import FiddleFilter, GtfsFiddler
+from gtfs_fiddler.gtfs_time import GtfsTime
+
+from .fiddle_test import CAIRNS_GTFS, DIST_UNIT, SUNDAY
+
+
+def _stop_times(trip_ids, stop_sequences) -> DataFrame:
+    return DataFrame({"trip_id": trip_ids, "stop_sequence": stop_sequences})
+
+
+def test_rows__across_base_and_segments():
+    base = _stop_times(["b", "a", "b", "a"], [2, 1, 1, 2])
+    table = AppendOnlyTable("trip_id", "stop_sequence")
+    table.append(_stop_times(["c", "c"], [2, 1]))
+    table.append(_stop_times([], []))
+    assert len(table.segments) == 1
+    assert len(table) == 2
+
+    rows, lengths = table.rows(base, ["c", "a", "c"])
+    assert list(rows.trip_id) == ["c", "c", "a", "a", "c", "c"]
+    assert list(rows.stop_sequence) == [1, 2, 1, 2, 1, 2]
+    assert list(rows.index) == list(range(6))
+    assert list(lengths) == [2, 2, 2]
+
+    rows, lengths = table.rows(base, [])
+    assert len(rows) == 0
+    assert list(rows.columns) == ["trip_id", "stop_sequence"]
+
+    with pytest.raises(KeyError):
+        table.rows(base, ["a", "x"])
+
+
+def test_materialize():
+    base = _stop_times(["b", "a"], [1, 1])
+    table = AppendOnlyTable("trip_id", "stop_sequence")
+    assert table.materialize(base) is base
+
+    table.append(_stop_times(["c"], [1]))
+    table.append(_stop_times(["a"], [2]))
+    table.append(_stop_times(["0"], [1]))
+    df = table.materialize(base, sort_segments=2)
+    # base and the first two segments sorted, the last one appended
+    assert list(df.trip_id) == ["a", "a", "b", "c", "0"]
+    assert list(df.index) == list(range(5))
+    assert table.segments == []
+
+    # without following segments the index from before sorting is kept
+    table.append(_stop_times(["c"], [1]))
+    df = table.materialize(base, sort_segments=1)
+    assert list(df.trip_id) == ["a", "b", "c"]
+    assert list(df.index) == [1, 0, 2]
+
+
+def test_fiddler__tables_materialized_on_access():
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    base_stop_times = fiddler._feed.stop_times
+    fiddler.ensure_earliest_departure(GtfsTime("04:00"))
+    fiddler.ensure_max_trip_interval(10, FiddleFilter(route_short_names=("110",)))
+    fiddler.ensure_latest_departure(GtfsTime("23:30"))
+    # nothing copied yet
+    assert fiddler._feed.stop_times is base_stop_times
+    added = len(fiddler._added_stop_times)
+    assert added > 0
+
+    stop_times = fiddler.stop_times
+    assert len(stop_times) == len(base_stop_times) + added
+    assert fiddler.stop_times is stop_times
+    trip_ids = set(stop_times.trip_id)
+    assert set(fiddler.trips.trip_id) == trip_ids
+    assert len(trip_ids) == len(fiddler.trips)
+    # the trip stats are still up to date (and not computed again)
+    pd.testing.assert_frame_equal(
+        fiddler.trip_stats(), fiddler.feed.compute_trip_stats()
+    )
+
+
+def test_materialize__merged_into_sorted_base():
+    base = _stop_times(["a", "a", "b", "d"], [1, 3, 1, 1])
+    table = AppendOnlyTable("trip_id", "stop_sequence")
+    assert table.is_sorted(base)
+    assert not table.is_sorted(base.iloc[::-1])
+    assert not table.is_sorted(_stop_times(["a", "a"], [1, 1]))
+
+    segments = [_stop_times(["c", "0", "c"], [2, 1, 1]), _stop_times(["a"], [2])]
+    for s in segments:
+        table.append(s)
+    merged = table.materialize(base, sort_segments=2, base_sorted=True)
+    assert list(merged.trip_id) == ["0", "a", "a", "a", "b", "c", "c", "d"]
+    assert list(merged.stop_sequence) == [1, 1, 2, 3, 1, 1, 2, 1]
+    # same as sorting everything (including the index)
+    for s in segments:
+        table.append(s)
+    pd.testing.assert_frame_equal(merged, table.materialize(base, sort_segments=2))
+
+
+def test_fiddler__stop_times_kept_sorted():
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    assert fiddler._sorted_stop_times is fiddler.stop_times
+    fiddler.ensure_max_trip_interval(5, FiddleFilter(route_short_names=("110",)))
+    fiddler.ensure_max_trip_interval(10)
+    stop_times = fiddler.stop_times
+    assert fiddler._sorted_stop_times is stop_times
+    pd.testing.assert_frame_equal(
+        stop_times, stop_times.sort_values(["trip_id", "stop_sequence"])
+    )
+
+    fiddler.ensure_min_speed({3: 30})
+    assert fiddler._sorted_stop_times is fiddler.stop_times
+    fiddler.ensure_latest_departure(GtfsTime("23:30"))
+    assert fiddler.stop_times is not None
+    assert fiddler._sorted_stop_times is None
+    # sorted again by the next min speed step
+    fiddler.ensure_min_speed({3: 40})
+    assert fiddler._sorted_stop_times is fiddler.stop_times
+    assert fiddler._added_stop_times.is_sorted(fiddler.stop_times)
@@ -0,0 +1,59 @@
+from gtfs_fiddler.diff import diff_feeds
+from gtfs_fiddler.fiddle import GtfsFiddler
+from gtfs_fiddler.gtfs_time import GtfsTime
+
+from .fiddle_test import CAIRNS_GTFS, DIST_UNIT, SUNDAY
+
+
+def test_diff__unchanged():
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    diff = fiddler.diff(detail=True)
+    assert (diff.summary.trips_before == diff.summary.trips_after).all()
+    assert diff.summary[["added", "removed", "changed"]].sum().sum() == 0
+    assert set(diff.trips.status) == {"unchanged"}
+    assert len(diff.trips) == len(fiddler.trips)
+
+
+def test_diff__added_trips():
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    fiddler.ensure_earliest_departure(GtfsTime("05:00:00"))
+    fiddler.ensure_max_trip_interval(30)
+    added = len(fiddler.trips) - len(fiddler._base_feed.trips)
+
+    diff = fiddler.diff(detail=True)
+    assert diff.summary.added.sum() == added
+    assert diff.summary.trips_after.sum() == len(fiddler.trips)
+    assert diff.summary.changed.sum() == 0
+    early = diff.trips[diff.trips.trip_id.str.endswith("#early")]
+    assert (early.status == "added").all()
+    assert (early.start_after == 5 * 3600).all()
+    assert early.start_before.isna().all()
+
+
+def test_diff__min_speed():
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    fiddler.ensure_min_speed(route_id2speed={"111-423": 30})
+
+    diff = fiddler.diff(detail=True)
+    changed = diff.trips[diff.trips.status == "changed"]
+    assert len(changed) > 0
+    assert (changed.route_id == "111-423").all()
+    # faster, same start
+    assert (changed.duration_after < changed.duration_before).all()
+    assert (changed.start_after == changed.start_before).all()
+    summary = diff.summary.set_index("route_id").loc["111-423"]
+    assert (summary.mean_duration_change < 0).all()
+
+
+def test_diff_feeds__removed_trips():
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    before = fiddler.feed
+    after = fiddler.feed.copy()
+    removed = after.trips.trip_id.iloc[:3]
+    after.trips = after.trips[~after.trips.trip_id.isin(removed)]
+    after.stop_times = after.stop_times[~after.stop_times.trip_id.isin(removed)]
+
+    diff = diff_feeds(before, after, detail=True)
+    assert diff.summary.removed.sum() == 3
+    assert set(diff.trips[diff.trips.status == "removed"].trip_id) == set(removed)
+    assert diff_feeds(before, after).trips is None
@@ -0,0 +1,72 @@
+import pytest
+
+from gtfs_fiddler.estimate import dry_run, sample_run
+from gtfs_fiddler.fiddle import FiddleFilter, GtfsFiddler
+from gtfs_fiddler.gtfs_time import GtfsTime
+from gtfs_fiddler.recipe import Recipe, Step, run_step
+
+from .fiddle_test import CAIRNS_GTFS, DIST_UNIT, SUNDAY
+
+RECIPE = Recipe(
+    (
+        Step("min_speed", 30.0),
+        Step("earliest_departure", GtfsTime("04:30")),
+        Step("max_trip_interval", 15, FiddleFilter(route_short_names=("110",))),
+        Step("max_trip_interval", 10, FiddleFilter(route_short_names=("111",))),
+        Step("latest_departure", GtfsTime("23:50"), FiddleFilter(route_types=(3,))),
+        Step("min_headway", 12),
+    )
+)
+
+
+@pytest.fixture(scope="module")
+def fiddler() -> GtfsFiddler:
+    return GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+
+
+def test_dry_run__same_counts_as_run(fiddler: GtfsFiddler):
+    fiddler = fiddler.fork()
+    num_stop_times = len(fiddler.stop_times)
+    result = dry_run(fiddler, RECIPE)
+    assert result.stop_times == num_stop_times
+    # nothing changed
+    assert len(fiddler.stop_times) == num_stop_times
+
+    for step, expected in zip(RECIPE.steps, result.steps.itertuples()):
+        trips, stop_times = len(fiddler.trips), len(fiddler.stop_times)
+        run_step(fiddler, step)
+        assert expected.operation == step.operation
+        assert expected.trips == len(fiddler.trips)
+        assert expected.stop_times == len(fiddler.stop_times)
+        assert (
+            expected.added_trips - expected.removed_trips == len(fiddler.trips) - trips
+        )
+        assert (
+            expected.added_stop_times - expected.removed_stop_times
+            == len(fiddler.stop_times) - stop_times
+        )
+    assert result.added_trips > 0
+    assert result.steps.removed_trips.iat[-1] > 0
+    assert result.result_stop_times == len(fiddler.stop_times)
+    assert result.csv_mb == pytest.approx(
+        len(fiddler.stop_times.to_csv(index=False)) / 2**20, rel=0.1
+    )
+    assert result.memory_mb > result.csv_mb
+
+
+def test_dry_run__empty_recipe(fiddler: GtfsFiddler):
+    result = dry_run(fiddler, Recipe(()))
+    assert len(result.steps) == 0
+    assert result.added_trips == 0
+    assert result.result_stop_times == len(fiddler.stop_times)
+
+
+def test_sample_run(fiddler: GtfsFiddler):
+    num_trips = len(fiddler.trips)
+    result = sample_run(fiddler, RECIPE, route_fraction=0.5)
+    assert result.routes == 7
+    assert 0 < result.fraction < 1
+    assert result.seconds > 0
+    assert result.estimated_seconds > result.seconds
+    assert 0 < result.peak_mb < result.estimated_peak_mb
+    assert len(fiddler.trips) == num_trips
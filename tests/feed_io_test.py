@@ -0,0 +1,61 @@
+from pathlib import Path
+
+import gtfs_kit as gk
+import pandas as pd
+import pytest
+
+from gtfs_fiddler import feed_io
+
+from .fiddle_test import CAIRNS_GTFS, DIST_UNIT
+
+
+@pytest.mark.parametrize("use_pyarrow", [True, False])
+def test_read_feed__same_as_gtfs_kit(use_pyarrow: bool):
+    if use_pyarrow:
+        pytest.importorskip("pyarrow")
+    expected = gk.read_feed(CAIRNS_GTFS, dist_units=DIST_UNIT)
+    feed = feed_io.read_feed(CAIRNS_GTFS, DIST_UNIT, use_pyarrow=use_pyarrow)
+    for table in feed_io.GTFS_TABLES:
+        if getattr(expected, table) is None:
+            assert getattr(feed, table) is None
+            continue
+        pd.testing.assert_frame_equal(getattr(feed, table), getattr(expected, table))
+
+
+def test_read_table__arrow_like_pandas(tmp_path: Path):
+    pytest.importorskip("pyarrow")
+    # BOM, empty strings, a column without values and padded column names
+    (tmp_path / "trips.txt").write_bytes(
+        "\ufefftrip_id,route_id,direction_id,block_id,extra\n"
+        "t1,r1,0,,\n"
+        "t2,,1,b,\n".encode("utf-8")
+    )
+    (tmp_path / "routes.txt").write_text(" route_id ,route_type\n 1,3\n")
+    for table in ["trips", "routes"]:
+        expected = feed_io.read_table(tmp_path, table, use_pyarrow=False)
+        df = feed_io.read_table(tmp_path, table)
+        pd.testing.assert_frame_equal(df, expected)
+        assert (df.map(type) == expected.map(type)).all().all()
+
+
+def test_read_feed__missing_path():
+    with pytest.raises(ValueError):
+        feed_io.read_feed(Path("does/not/exist.zip"), DIST_UNIT)
+
+
+def test_write_feed__chunks_with_other_columns(tmp_path: Path):
+    feed = feed_io.read_feed(CAIRNS_GTFS, DIST_UNIT)
+    stop_times = feed.stop_times
+    half = len(stop_times) // 2
+    chunks = [
+        stop_times.iloc[:half],
+        # other order and without a column
+        stop_times.iloc[half:, ::-1].drop(columns="pickup_type"),
+    ]
+    feed_io.write_feed(feed, tmp_path / "feed.zip", stop_times=chunks)
+    actual = feed_io.read_table(tmp_path / "feed.zip", "stop_times")
+    expected = stop_times.assign(
+        pickup_type=stop_times.pickup_type.where(stop_times.index < half)
+    )
+    assert list(actual.columns) == list(stop_times.columns)
+    pd.testing.assert_frame_equal(actual, expected.reset_index(drop=True))
@@ -2,18 +2,21 @@ import math
 from datetime import date
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
+from gtfs_kit.stop_times import append_dist_to_stop_times
 from pandas import DataFrame, Series
 from pandas.testing import assert_frame_equal, assert_series_equal
 
 from gtfs_fiddler.fiddle import (
+    DepartureTargets,
     FiddleFilter,
     GtfsFiddler,
     compute_stop_time_stats,
     make_unique,
     trips_for_route,
 )
-from gtfs_fiddler.gtfs_time import GtfsTime
+from gtfs_fiddler.gtfs_time import GtfsTime, to_seconds
 
 CAIRNS_GTFS = Path("./data/cairns_gtfs.zip")
 SUNDAY = date(2014, 6, 1)
@@ -104,7 +107,8 @@ def test_compute_stop_time_stats():
         "16.80",
         "48.60",
         "nan",
-        "nan",
+        # stop 15 has no time: interpolated by distance
+        "61.20",
         "61.20",
         "36.00",
         "45.00",
@@ -250,6 +254,47 @@ def test_ensure_latest_departure():
     assert _latest_departure(fiddler, route_id, direction_id) == GtfsTime("25:25")
 
 
+def test_ensure_departures__same_as_earliest_then_latest():
+    expected = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    expected.ensure_earliest_departure(GtfsTime("5:00"))
+    expected.ensure_latest_departure(GtfsTime("23:00"))
+    actual = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    actual.ensure_departures(GtfsTime("5:00"), GtfsTime("23:00"))
+
+    assert_frame_equal(actual.trips, expected.trips)
+    assert_frame_equal(actual.stop_times, expected.stop_times)
+    assert_frame_equal(actual.trip_stats(), expected.feed.compute_trip_stats())
+
+
+def test_ensure_departures__per_route():
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    fiddler.ensure_departures(
+        earliest=DepartureTargets(
+            GtfsTime("6:00"),
+            route_types={3: GtfsTime("5:00")},
+            route_ids={"110-423": GtfsTime("4:00")},
+        ),
+        latest=DepartureTargets(route_ids={"123-423": GtfsTime("23:30")}),
+    )
+    assert _earliest_departure(fiddler, "110-423", 0) == GtfsTime("4:00")
+    assert _earliest_departure(fiddler, "123-423", 0) == GtfsTime("5:00")
+    assert _latest_departure(fiddler, "123-423", 0) == GtfsTime("23:30")
+    # no latest target for other routes
+    assert _latest_departure(fiddler, "110-423", 0) == GtfsTime("22:16")
+
+
+def test_departure_targets__per_route():
+    routes = DataFrame({"route_id": ["a", "b", "c"], "route_type": [0, 3, 3]})
+    targets = DepartureTargets(
+        route_types={3: GtfsTime("5:00")},
+        route_ids={"c": GtfsTime("4:00"), "x": GtfsTime("1:00")},
+    )
+    per_route = targets.per_route(routes)
+    assert list(per_route.index) == ["a", "b", "c"]
+    assert list(per_route.fillna(-1)) == [-1, 5 * 3600, 4 * 3600]
+    assert list(DepartureTargets(GtfsTime("6:00")).per_route(routes)) == [6 * 3600] * 3
+
+
 def test_ensure_max_trip_interval__exact_split():
     fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
     route_id = "110-423"
@@ -291,6 +336,31 @@ def test_ensure_max_trip_interval__inexact_split():
     assert _all_departures(fiddler, route_id, direction_id) == expected_departures
 
 
+def test_ensure_min_headway():
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    route_id = "110-423"
+    original_departures = [GtfsTime(f"{h}:16:00") for h in range(7, 23)]
+    other_trips = (fiddler.trips.route_id != route_id).sum()
+    stats = fiddler.trip_stats()
+
+    fiddler.ensure_min_headway(60, FiddleFilter(route_ids=[route_id]))
+    assert _all_departures(fiddler, route_id, 0) == original_departures
+    assert fiddler.trip_stats() is stats, "no change expected"
+
+    # the first trip is kept, then every trip at least 150 minutes after the last kept
+    fiddler.ensure_min_headway(150, FiddleFilter(route_ids=[route_id]))
+    expected_departures = [GtfsTime(f"{h}:16:00") for h in range(7, 23, 3)]
+    assert _all_departures(fiddler, route_id, 0) == expected_departures
+    assert (fiddler.trips.route_id != route_id).sum() == other_trips
+    assert set(fiddler.stop_times.trip_id) == set(fiddler.trips.trip_id)
+    assert_frame_equal(fiddler.trip_stats(), fiddler.feed.compute_trip_stats())
+
+    summary = fiddler.diff().summary.set_index(["route_id", "direction_id"])
+    assert summary.loc[(route_id, 0), "removed"] == 16 - len(expected_departures)
+    assert summary.loc[(route_id, 1), "removed"] > 0
+    assert summary.drop(route_id).removed.sum() == 0
+
+
 def test_combination_of_different_ensures():
     fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
     route_id = "123-423"
@@ -331,7 +401,7 @@ def __departure(fiddler: GtfsFiddler, route_id, direction_id, index) -> GtfsTime
 
 
 def test_ensure_min_speed__per_route_type():
-    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT)
+    fiddler = with_gtfs_kit_distances(GtfsFiddler(CAIRNS_GTFS, DIST_UNIT))
     # the cairns feed only contains bus routes (type 3),
     # let's turn the first route (110-423) into a tram
     fiddler.routes.loc[0, "route_type"] = 0
@@ -354,7 +424,7 @@ def test_ensure_min_speed__per_route_type():
     assert_frame_equal(fiddler.stop_times, original_st)
     # bus still at original state
     assert_frame_equal_to_csv(
-        fiddler.stop_times.set_index("trip_id").loc[bus_trip].reset_index(),
+        trip_stop_times(fiddler, bus_trip),
         Path("./tests/data/test_ensure_min_speed__bus_original.csv"),
     )
 
@@ -364,12 +434,12 @@ def test_ensure_min_speed__per_route_type():
     assert len(fiddler.stop_times) == len(original_st)
     # bus must be adjusted
     assert_frame_equal_to_csv(
-        fiddler.stop_times.set_index("trip_id").loc[bus_trip].reset_index(),
+        trip_stop_times(fiddler, bus_trip),
         Path("./tests/data/test_ensure_min_speed__bus_30.csv"),
     )
     # tram must still be unchanged
     assert_frame_equal_to_csv(
-        fiddler.stop_times.set_index("trip_id").loc[tram_trip].reset_index(),
+        trip_stop_times(fiddler, tram_trip),
         Path("./tests/data/test_ensure_min_speed__tram_original.csv"),
     )
 
@@ -379,34 +449,97 @@ def test_ensure_min_speed__per_route_type():
     assert len(fiddler.stop_times) == len(original_st)
     # bus must (still) be adjusted
     assert_frame_equal_to_csv(
-        fiddler.stop_times.set_index("trip_id").loc[bus_trip].reset_index(),
+        trip_stop_times(fiddler, bus_trip),
         Path("./tests/data/test_ensure_min_speed__bus_30.csv"),
     )
     # tram must be adjusted as well now
     assert_frame_equal_to_csv(
-        fiddler.stop_times.set_index("trip_id").loc[tram_trip].reset_index(),
+        trip_stop_times(fiddler, tram_trip),
         Path("./tests/data/test_ensure_min_speed__tram_50.csv"),
     )
 
 
 def test_ensure_min_speed__per_route():
-    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT)
+    fiddler = with_gtfs_kit_distances(GtfsFiddler(CAIRNS_GTFS, DIST_UNIT))
     # first trip of route "111-423", 0
     bus_trip = "CNS2014-CNS_MUL-Sunday-00-4166214"
     # bus still at original state
     assert_frame_equal_to_csv(
-        fiddler.stop_times.set_index("trip_id").loc[bus_trip].reset_index(),
+        trip_stop_times(fiddler, bus_trip),
         Path("./tests/data/test_ensure_min_speed__bus_original.csv"),
     )
 
     ### change one bus route to travel at >= 30 kph
     fiddler.ensure_min_speed(route_id2speed={"111-423": 30})
     assert_frame_equal_to_csv(
-        fiddler.stop_times.set_index("trip_id").loc[bus_trip].reset_index(),
+        trip_stop_times(fiddler, bus_trip),
         Path("./tests/data/test_ensure_min_speed__bus_30.csv"),
     )
 
 
+def test_ensure_min_speed__computed_distances():
+    """
+    Min speed with the distances computed by `shape_dist` (the default for feeds
+    without shape_dist_traveled) vs. gtfs_kit's distances used by the golden files
+    """
+    # first trips of route "110-423" (as tram) and "111-423", 0
+    tram_trip = "CNS2014-CNS_MUL-Sunday-00-4165971"
+    bus_trip = "CNS2014-CNS_MUL-Sunday-00-4166214"
+    computed = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT)
+    golden = with_gtfs_kit_distances(GtfsFiddler(CAIRNS_GTFS, DIST_UNIT))
+    gtfs_kit_dists = trip_dists(golden, tram_trip)
+    for fiddler in (computed, golden):
+        fiddler.routes.loc[0, "route_type"] = 0
+        fiddler.ensure_min_speed(route_type2speed={3: 30, 0: 50})
+
+    def seconds(fiddler, trip_id):
+        return to_seconds(trip_stop_times(fiddler, trip_id).arrival_time)
+
+    # haversine instead of UTM distances, i.e. at most a second per stop
+    diff = seconds(computed, bus_trip) - seconds(golden, bus_trip)
+    assert np.nanmax(np.abs(diff)) <= 1
+    # gtfs_kit's projection of the tram trip is not monotonic from stop 13 on,
+    # so it falls back to distances interpolated by time: stops departing at
+    # the same time (e.g. 750103 and 750104) get the same distance
+    # (i.e. an infinite speed for the min speed pass), stop 14 none at all
+    diff = seconds(computed, tram_trip) - seconds(golden, tram_trip)
+    assert np.nanmax(np.abs(diff[:12])) <= 1
+    assert (np.diff(gtfs_kit_dists[12:]) == 0).sum() >= 4
+    assert np.isnan(gtfs_kit_dists[13])
+    computed_dists = compute_stop_time_stats(GtfsFiddler(CAIRNS_GTFS, DIST_UNIT).feed)
+    computed_dists = computed_dists[computed_dists.trip_id == tram_trip]
+    assert (np.diff(computed_dists.shape_dist_traveled.to_numpy()[1:]) > 0).all()
+
+
+def test_stop_time_stats__cached_until_stop_times_change():
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    stats = fiddler.stop_time_stats()
+    assert fiddler.stop_time_stats() is stats
+    # stop times without time are interpolated
+    assert stats.arrival_time.apply(GtfsTime.isnan).any()
+    assert not stats.arrival_seconds.isna().any()
+
+    fiddler.ensure_earliest_departure(GtfsTime("05:00:00"))
+    new_stats = fiddler.stop_time_stats()
+    assert new_stats is not stats
+    assert len(new_stats) == len(fiddler.stop_times)
+
+
+def test_trip_stats__kept_up_to_date_for_copied_trips():
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    stats = fiddler.trip_stats()
+    assert fiddler.trip_stats() is stats
+
+    fiddler.ensure_earliest_departure(GtfsTime("04:00:00"))
+    fiddler.ensure_latest_departure(GtfsTime("25:00:00"))
+    fiddler.ensure_max_trip_interval(15)
+    assert len(fiddler.trip_stats()) == len(fiddler.trips)
+    assert_frame_equal(fiddler.trip_stats(), fiddler.feed.compute_trip_stats())
+
+    fiddler.ensure_min_speed(route_type2speed={3: 30})
+    assert_frame_equal(fiddler.trip_stats(), fiddler.feed.compute_trip_stats())
+
+
 def test_ensure_min_speed_of_trip():
     fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT)
 
@@ -420,7 +553,7 @@ def test_ensure_min_speed_of_trip():
     assert fiddler.stop_times.loc[idx[2]].departure_time == "07:18:00"
     fiddler.stop_times.loc[idx[2], "departure_time"] = "07:18:30"
 
-    st = compute_stop_time_stats(fiddler.feed)
+    st = compute_stop_time_stats(with_gtfs_kit_distances(fiddler).feed)
     st = st[st.trip_id == "CNS2014-CNS_MUL-Sunday-00-4165971"]
 
     actual = st[
@@ -458,6 +591,27 @@ def test_ensure_min_speed_of_trip():
     )
 
 
+def with_gtfs_kit_distances(fiddler: GtfsFiddler) -> GtfsFiddler:
+    """
+    The min speed golden files are based on the distances of gtfs_kit's
+    `append_dist_to_stop_times` (the cairns feed has no shape_dist_traveled),
+    which are kept if present, i.e. the files only test the min speed logic
+    (see `test_ensure_min_speed__computed_distances` for the computed distances).
+    """
+    fiddler.feed.stop_times = append_dist_to_stop_times(fiddler.feed).stop_times
+    return fiddler
+
+
+def trip_dists(fiddler: GtfsFiddler, trip_id: str) -> np.ndarray:
+    st = fiddler.stop_times[fiddler.stop_times.trip_id == trip_id]
+    return st.sort_values("stop_sequence").shape_dist_traveled.to_numpy()
+
+
+def trip_stop_times(fiddler: GtfsFiddler, trip_id: str) -> DataFrame:
+    st = fiddler.stop_times.set_index("trip_id").loc[trip_id].reset_index()
+    return st.drop(columns="shape_dist_traveled", errors="ignore")
+
+
 def assert_frame_equal_to_csv(df: DataFrame, path: Path):
     # nans are represented as empty strings
     actual = df.fillna("").astype(str).reset_index(drop=True)
@@ -1,4 +1,6 @@
 import math
+import os
+import timeit
 
 import numpy as np
 import pytest
@@ -81,3 +83,45 @@ def test_less_than():
 def test_greater_than():
     assert GtfsTime("24:00:00") > GtfsTime("01:00:00")
     assert GtfsTime("02:00:00") > GtfsTime("01:00:01")
+
+
+def test_no_instance_dict():
+    time = GtfsTime("05:01:00")
+    assert not hasattr(time, "__dict__")
+    with pytest.raises(AttributeError):
+        time.other = 1
+
+
+def test_hash_of_nan():
+    assert hash(GtfsTime(5)) == hash(GtfsTime("00:00:05"))
+    assert isinstance(hash(GtfsTime(math.nan)), int)
+
+
+def test_arithmetics_keep_nan():
+    assert (GtfsTime(math.nan) + 5).isnan()
+    assert (GtfsTime(10) - GtfsTime(math.nan)).isnan()
+
+
+def test_parse_many():
+    seconds = GtfsTime.parse_many(["05:01:00", math.nan, "25:01", "05:01:00"])
+    np.testing.assert_array_equal(seconds, [18060, math.nan, 90060, 18060])
+    with pytest.raises(ValueError):
+        GtfsTime.parse_many(["abc"])
+
+
+def test_parse_many__same_as_one_by_one():
+    times = [f"{h:02}:{m:02}:00" for h in range(24) for m in range(60)] * 100
+    expected = [GtfsTime(t).seconds_of_day for t in times]
+    np.testing.assert_array_equal(GtfsTime.parse_many(times), expected)
+
+
+@pytest.mark.skipif(
+    not os.environ.get("GTFS_FIDDLER_BENCHMARK"),
+    reason="timing depends on the machine's load, set GTFS_FIDDLER_BENCHMARK=1",
+)
+def test_benchmark_parse_many():
+    times = [f"{h:02}:{m:02}:00" for h in range(24) for m in range(60)] * 100
+    # the bulk parser only parses distinct times and is vectorized
+    one_by_one = timeit.timeit(lambda: [GtfsTime(t) for t in times], number=3)
+    bulk = timeit.timeit(lambda: GtfsTime.parse_many(times), number=3)
+    assert bulk < one_by_one
@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+SRC = Path(__file__).parent.parent / "src"
+
+# imported (transitively) by gtfs_kit or only needed by some operations
+# (pyarrow is not listed, pandas imports it if installed)
+HEAVY_MODULES = ["gtfs_kit", "geopandas", "folium", "shapely", "numba"]
+
+
+def _imported_modules(*args: str) -> set[str]:
+    """
+    Top-level modules imported by `python -X importtime *args`
+    """
+    env = {**os.environ, "PYTHONPATH": str(SRC)}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = set()
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "cumulative" not in line:
+            name = line.split("|")[-1].strip()
+            modules.add(name.split(".")[0])
+    return modules
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        [
+            "-c",
+            "import gtfs_fiddler.fiddle, gtfs_fiddler.recipe, gtfs_fiddler.estimate",
+        ],
+        ["-c", "import gtfs_fiddler.server, gtfs_fiddler.cache"],
+        [str(SRC / "play_the_fiddle.py"), "--help"],
+    ],
+)
+def test_no_heavy_imports(args: list[str]):
+    modules = _imported_modules(*args)
+    assert "gtfs_fiddler" in modules
+    assert "pandas" in modules
+    assert [m for m in HEAVY_MODULES if m in modules] == []
@@ -0,0 +1,125 @@
+import math
+
+import numpy as np
+
+from gtfs_fiddler import kernels
+
+NAN = math.nan
+
+
+def test_trip_boundaries():
+    trip_ids = np.array(["a", "a", "b", "c", "c", "c"])
+    assert list(kernels.trip_boundaries(trip_ids)) == [0, 2, 3, 6]
+    assert list(kernels.trip_boundaries(np.array([]))) == [0]
+
+
+def test_shift_times__nan_stays_nan():
+    arrival = np.array([100, NAN, 300, 50])
+    departure = np.array([110, NAN, 300, 60])
+    boundaries = np.array([0, 3, 4])
+    offsets = np.array([10.0, -50.0])
+    for shift_times in (kernels.shift_times, kernels._shift_times_numpy):
+        new_arrival, new_departure = shift_times(
+            arrival, departure, boundaries, offsets
+        )
+        np.testing.assert_array_equal(new_arrival, [110, NAN, 310, 0])
+        np.testing.assert_array_equal(new_departure, [120, NAN, 310, 10])
+
+
+def test_thin():
+    # two groups, the second with a missing start time
+    starts = np.array([0, 5, 10, 20, 21, 100, 100, 130, NAN])
+    boundaries = np.array([0, 5, 9])
+    for thin in (kernels.thin, kernels._thin_numpy, kernels._thin_loop):
+        keep = thin(starts, boundaries, 10.0)
+        assert list(keep) == [1, 0, 1, 1, 0, 1, 0, 1, 1]
+        assert thin(starts, boundaries, 0.0).all()
+
+
+def test_thin__numpy_equals_loop():
+    rng = np.random.default_rng(42)
+    n = 10_000
+    boundaries = kernels.trip_boundaries(np.sort(rng.integers(0, 500, n)))
+    starts = rng.integers(0, 86400, n).astype(float)
+    starts[rng.random(n) < 0.01] = NAN
+    for i in range(len(boundaries) - 1):
+        # sorted per group with missing starts last
+        starts[boundaries[i] : boundaries[i + 1]].sort()
+    for min_gap in [0.0, 600.0, 3600.0]:
+        np.testing.assert_array_equal(
+            kernels._thin_numpy(starts, boundaries, min_gap),
+            kernels._thin_loop(starts, boundaries, min_gap),
+        )
+
+
+def test_segment_min_speed_times():
+    # 1 km between all stops, 120 seconds each (= 30 km/h), 30 seconds stay at stop 2
+    arrival = np.array([0, 120, NAN, 390, 0, 120])
+    departure = np.array([0, 150, NAN, 390, 0, 120])
+    seconds_to_next_stop = np.array([120, 120, 120, NAN, 120, NAN])
+    dist_to_next_stop = np.array([1, 1, 1, NAN, 1, NAN])
+    boundaries = np.array([0, 4, 6])
+    # second trip is not changed
+    speeds = np.array([60, 60, 60, 60, NAN, NAN])
+
+    for segment_min_speed_times in (
+        kernels.segment_min_speed_times,
+        kernels._segment_min_speed_times_numpy,
+        kernels._segment_min_speed_times_loop,
+    ):
+        new_arrival, new_departure = segment_min_speed_times(
+            arrival,
+            departure,
+            seconds_to_next_stop,
+            dist_to_next_stop,
+            boundaries,
+            speeds,
+        )
+        np.testing.assert_array_equal(new_arrival, [0, 60, NAN, 180, 0, 120])
+        np.testing.assert_array_equal(new_departure, [0, 90, NAN, 180, 0, 120])
+
+
+def test_interpolate():
+    values = np.array([0, NAN, NAN, 30, NAN, NAN, 10, NAN, 40])
+    by = np.array([0, 1, 1, 3, 5, 5, 5, 5, 5], dtype=float)
+    boundaries = np.array([0, 4, 5, 9])
+    np.testing.assert_array_equal(
+        kernels.interpolate(values, by, boundaries),
+        # the second trip has no known value and the leading NaN
+        # of the last trip stays NaN, which is interpolated by position
+        # since `by` does not increase
+        [0, 10, 10, 30, NAN, NAN, 10, 25, 40],
+    )
+    next_values = np.array([0, NAN, NAN, 60, NAN, NAN, 10, NAN, 20])
+    np.testing.assert_array_equal(
+        kernels.interpolate(values, by, boundaries, next_values)[:4],
+        [0, 20, 20, 30],
+    )
+
+
+def test_segment_min_speed_times__numpy_equals_loop():
+    rng = np.random.default_rng(7)
+    n = 10_000
+    boundaries = kernels.trip_boundaries(np.sort(rng.integers(0, 500, n)))
+    arrival = np.cumsum(rng.integers(0, 100, n)).astype(float)
+    departure = arrival + rng.integers(0, 3, n)
+    seconds_to_next_stop = rng.random(n) * 100
+    dist_to_next_stop = rng.random(n)
+    segment_speeds = rng.random(n) * 50
+    segment_speeds[rng.random(n) < 0.7] = NAN
+
+    args = (
+        arrival,
+        departure,
+        seconds_to_next_stop,
+        dist_to_next_stop,
+        boundaries,
+        segment_speeds,
+    )
+    expected = kernels._segment_min_speed_times_loop(*args)
+    for actual in (
+        kernels._segment_min_speed_times_numpy(*args),
+        kernels.segment_min_speed_times(*args),
+    ):
+        np.testing.assert_array_equal(actual[0], expected[0])
+        np.testing.assert_array_equal(actual[1], expected[1])
@@ -0,0 +1,100 @@
+import gzip
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from gtfs_fiddler.fiddle import GtfsFiddler
+from gtfs_fiddler.gtfs_time import GtfsTime
+from gtfs_fiddler.matsim import departures, transport_mode
+
+from .fiddle_test import CAIRNS_GTFS, DIST_UNIT, SUNDAY
+
+
+@pytest.fixture(scope="module")
+def fiddler() -> GtfsFiddler:
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    fiddler.ensure_max_trip_interval(20)
+    return fiddler
+
+
+def test_write_matsim(fiddler: GtfsFiddler, tmp_path):
+    fiddler.write_matsim(tmp_path / "schedule.xml", tmp_path / "vehicles.xml")
+    schedule = ET.parse(tmp_path / "schedule.xml").getroot()
+    vehicles = ET.parse(tmp_path / "vehicles.xml").getroot()
+
+    stop_ids = {s.get("id") for s in schedule.iter("stopFacility")}
+    assert stop_ids == set(fiddler.stop_times.stop_id)
+    lines = schedule.findall("transitLine")
+    assert {line.get("id") for line in lines} == set(fiddler.trips.route_id)
+
+    stats = fiddler.trip_stats().set_index("trip_id")
+    num_stops = fiddler.stop_times.groupby("trip_id").size()
+    vehicle_ids = []
+    for line in lines:
+        for route in line.iter("transitRoute"):
+            assert route.findtext("transportMode") == "bus"
+            stops = route.findall("routeProfile/stop")
+            assert "arrivalOffset" not in stops[0].attrib
+            assert "departureOffset" not in stops[-1].attrib
+            for departure in route.iter("departure"):
+                trip = stats.loc[departure.get("id")]
+                assert trip.route_id == line.get("id")
+                assert departure.get("departureTime") == trip.start_time
+                assert len(stops) == num_stops[departure.get("id")]
+                vehicle_ids.append(departure.get("vehicleRefId"))
+    # a departure and vehicle per trip
+    assert sorted(vehicle_ids) == sorted(
+        v.get("id") for v in vehicles.findall(".//{*}vehicle")
+    )
+    assert len(vehicle_ids) == len(fiddler.trips)
+    # the transit routes are the stop patterns
+    routes = schedule.findall("transitLine/transitRoute")
+    assert len(routes) == len(
+        fiddler.stop_patterns()
+        .assign(route_id=lambda t: t.trip_id.map(stats.route_id))
+        .drop_duplicates(["route_id", "pattern_id"])
+    )
+
+
+def test_write_matsim__projected_and_gzipped(fiddler: GtfsFiddler, tmp_path):
+    fiddler.write_matsim(
+        tmp_path / "schedule.xml.gz", tmp_path / "vehicles.xml.gz", crs="EPSG:28355"
+    )
+    with gzip.open(tmp_path / "schedule.xml.gz") as f:
+        schedule = ET.parse(f).getroot()
+    assert "EPSG:28355" in schedule.findtext("attributes/attribute")
+    # GDA94 / MGA zone 55 (in meters)
+    y = [float(s.get("y")) for s in schedule.iter("stopFacility")]
+    assert 8_000_000 < min(y) < max(y) < 8_200_000
+
+
+def test_departures__frequencies(fiddler: GtfsFiddler):
+    feed = fiddler.feed
+    trip_id = feed.trips.trip_id.iat[0]
+    feed = GtfsFiddler.from_feed(feed).feed
+    feed.frequencies = pd.DataFrame(
+        {
+            "trip_id": [trip_id, trip_id],
+            "start_time": ["06:00:00", "20:00:00"],
+            "end_time": ["07:00:00", "20:30:00"],
+            "headway_secs": [1200, 900],
+        }
+    )
+    d = departures(feed, fiddler.stop_patterns())
+    assert len(d) == len(feed.trips) - 1 + 3 + 2
+    mine = d[d.trip_id == trip_id]
+    assert list(mine.departure_id) == [f"{trip_id}_{k}" for k in [0, 1, 2, 0, 1]]
+    expected = ["06:00", "06:20", "06:40", "20:00", "20:15"]
+    assert list(mine.departure) == [GtfsTime(t).seconds_of_day for t in expected]
+    assert np.all(mine.pattern_id == mine.pattern_id.iat[0])
+
+
+def test_transport_mode():
+    assert transport_mode(3) == "bus"
+    assert transport_mode(2) == "rail"
+    assert transport_mode(109) == "rail"
+    assert transport_mode(700) == "bus"
+    assert transport_mode(900) == "tram"
+    assert transport_mode(42) == "other"
@@ -0,0 +1,57 @@
+import math
+
+import numpy as np
+from gtfs_kit.feed import Feed
+from pandas import DataFrame
+
+from gtfs_fiddler.fiddle import GtfsFiddler
+from gtfs_fiddler.patterns import compute_stop_patterns, rows_of
+
+from .fiddle_test import CAIRNS_GTFS, DIST_UNIT, SUNDAY
+
+
+def test_compute_stop_patterns():
+    stop_times = DataFrame(
+        {
+            "trip_id": ["c", "c", "a", "a", "b", "b", "d", "d", "e", "e"],
+            "stop_sequence": [1, 2, 1, 2, 2, 1, 1, 2, 1, 2],
+            "stop_id": ["x", "y", "x", "y", "y", "x", "x", "y", "x", "y"],
+            "arrival_time": [
+                "08:00:00",
+                "08:10:00",
+                "07:00:00",
+                "07:10:00",
+                "09:10:00",
+                "09:00:00",
+                "10:00:00",
+                "10:15:00",
+                math.nan,
+                "11:10:00",
+            ],
+        }
+    )
+    stop_times["departure_time"] = stop_times.arrival_time
+    trips = DataFrame({"trip_id": list("abcde"), "route_id": "r", "service_id": "s"})
+    feed = Feed(dist_units="km", trips=trips, stop_times=stop_times)
+
+    patterns = compute_stop_patterns(feed)
+    assert list(patterns.trip_id) == list("abcde")
+    # a, b and c only differ in their start time
+    assert list(patterns.pattern_id) == [0, 0, 0, 1, 2]
+    assert list(patterns.start_seconds) == [7 * 3600, 9 * 3600, 8 * 3600, 10 * 3600, 0]
+    assert list(patterns.first_row) == [0, 2, 4, 6, 8]
+    assert list(patterns.num_stops) == [2] * 5
+
+
+def test_rows_of():
+    assert list(rows_of(np.array([5, 0]), np.array([2, 3]))) == [5, 6, 0, 1, 2]
+    assert list(rows_of(np.array([]), np.array([]))) == []
+
+
+def test_stop_patterns__cairns():
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    patterns = fiddler.stop_patterns()
+    assert fiddler.stop_patterns() is patterns
+    assert len(patterns) == len(fiddler.trips)
+    # far fewer patterns than trips
+    assert patterns.pattern_id.nunique() * 5 < len(patterns)
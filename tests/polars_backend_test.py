@@ -0,0 +1,84 @@
+import pytest
+from pandas.testing import assert_frame_equal
+
+from gtfs_fiddler.fiddle import DepartureTargets, FiddleFilter, GtfsFiddler
+from gtfs_fiddler.gtfs_time import GtfsTime
+
+pytest.importorskip("polars")
+
+from .fiddle_test import CAIRNS_GTFS, DIST_UNIT, SUNDAY
+
+
+def test_invalid_backend():
+    with pytest.raises(ValueError):
+        GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY, backend="spark")
+
+
+def test_trips_enriched():
+    expected = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY).trips_enriched()
+    actual = GtfsFiddler(
+        CAIRNS_GTFS, DIST_UNIT, SUNDAY, backend="polars"
+    ).trips_enriched()
+
+    assert list(actual.trip_id) == list(expected.trip_id)
+    assert list(actual.start_time) == list(expected.start_time)
+    assert list(actual.end_time) == list(expected.end_time)
+    assert list(actual.num_stops) == list(expected.num_stops)
+    assert [str(v) for v in actual.time_to_next_trip] == [
+        str(v) for v in expected.time_to_next_trip
+    ]
+
+
+def test_same_feed_as_pandas_backend():
+    expected = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    actual = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY, backend="polars")
+
+    for fiddler in (expected, actual):
+        fiddler.ensure_earliest_departure(GtfsTime("5:00"))
+        fiddler.ensure_latest_departure(
+            GtfsTime("23:30"), FiddleFilter(route_ids=["110-423"])
+        )
+        fiddler.ensure_max_trip_interval(20)
+        fiddler.ensure_min_speed(route_type2speed={3: 30})
+
+    assert_frame_equal(actual.trips, expected.trips)
+    assert_frame_equal(actual.stop_times, expected.stop_times)
+
+
+def test_ensure_departures__same_as_pandas_backend():
+    expected = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    actual = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY, backend="polars")
+
+    for fiddler in (expected, actual):
+        fiddler.ensure_departures(
+            DepartureTargets(GtfsTime("5:00"), route_ids={"110-423": GtfsTime("4:00")}),
+            GtfsTime("23:00"),
+        )
+
+    assert_frame_equal(actual.trips, expected.trips)
+    assert_frame_equal(actual.stop_times, expected.stop_times)
+
+
+def test_caches_kept_up_to_date():
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY, backend="polars")
+    original = fiddler.feed.stop_times
+    stats = fiddler.trip_stats()
+    index = fiddler.timetable_index()
+
+    fiddler.ensure_earliest_departure(GtfsTime("4:00"))
+    # copied trips are added like with the pandas backend
+    assert len(fiddler._added_trips.segments) == 1
+    assert fiddler._feed.stop_times is original
+    fiddler.ensure_max_trip_interval(20)
+    trips = fiddler.trips
+    assert fiddler._trip_stats[0] is trips
+    assert fiddler.trip_stats() is not stats
+    assert_frame_equal(fiddler.trip_stats(), fiddler.feed.compute_trip_stats())
+    # merged into the sorted stop times
+    assert fiddler._sorted_stop_times is fiddler.stop_times
+    assert fiddler.timetable_index() is not index
+
+    fiddler.ensure_min_speed(route_type2speed={3: 30})
+    assert fiddler._sorted_stop_times is fiddler.stop_times
+    assert fiddler.feed.stop_times is not original
+    assert len(original) < len(fiddler.stop_times)
@@ -0,0 +1,66 @@
+from gtfs_fiddler.feed_io import read_feed
+from gtfs_fiddler.fiddle import GtfsFiddler
+from gtfs_fiddler.prune import prune_feed, strip_columns
+
+from .fiddle_test import CAIRNS_GTFS, DIST_UNIT, SUNDAY
+
+
+def test_prune_feed():
+    feed = read_feed(CAIRNS_GTFS, DIST_UNIT)
+    # only keep the trips of a single route on Sunday
+    feed.trips = feed.trips[
+        (feed.trips.route_id == "110-423") & feed.trips.service_id.str.contains("Sun")
+    ]
+    feed.stop_times = feed.stop_times[feed.stop_times.trip_id.isin(feed.trips.trip_id)]
+    pruned = prune_feed(feed, {"stops": ["parent_station"]})
+
+    assert list(pruned.routes.route_id) == ["110-423"]
+    assert set(pruned.stops.stop_id) == set(feed.stop_times.stop_id)
+    assert set(pruned.shapes.shape_id) == set(feed.trips.shape_id)
+    assert set(pruned.calendar.service_id) == set(feed.trips.service_id)
+    assert set(pruned.calendar_dates.service_id) <= set(feed.trips.service_id)
+    assert list(pruned.stops.columns) == [
+        "stop_id",
+        "stop_name",
+        "stop_lat",
+        "stop_lon",
+        "parent_station",
+    ]
+    # the feed itself is not modified
+    assert len(feed.routes) > 1
+    assert "stop_code" in feed.stops.columns
+    # the trips are kept, only without their empty block_id column
+    assert list(pruned.trips.trip_id) == list(feed.trips.trip_id)
+    assert "block_id" not in pruned.trips.columns
+
+
+def test_strip_columns():
+    feed = read_feed(CAIRNS_GTFS, DIST_UNIT)
+    routes = feed.routes.assign(route_desc=None)
+    stripped = strip_columns(routes, "routes")
+    assert "route_desc" not in stripped.columns
+    assert "route_color" in stripped.columns
+    stripped = strip_columns(routes, "routes", keep=[])
+    assert list(stripped.columns) == [
+        "route_id",
+        "route_short_name",
+        "route_long_name",
+        "route_type",
+    ]
+    assert strip_columns(stripped, "routes") is stripped
+    assert strip_columns(routes, "routes", keep=["route_desc"]) is not routes
+    assert "route_desc" in strip_columns(routes, "routes", keep=["route_desc"])
+
+
+def test_prune__after_ensure_min_headway(tmp_path):
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    fiddler.ensure_min_headway(24 * 60)
+    fiddler.prune()
+    feed = fiddler.feed
+    assert len(feed.trips) == len(
+        feed.trips[["route_id", "direction_id"]].drop_duplicates()
+    )
+    assert set(feed.stops.stop_id) == set(feed.stop_times.stop_id)
+    assert set(feed.shapes.shape_id) == set(feed.trips.shape_id)
+    # the pruned feed can still be written
+    feed.write(tmp_path / "pruned.zip")
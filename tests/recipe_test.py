@@ -0,0 +1,167 @@
+import pandas as pd
+import pytest
+from pandas import DataFrame
+
+from gtfs_fiddler.fiddle import FiddleFilter, GtfsFiddler
+from gtfs_fiddler.gtfs_time import GtfsTime
+from gtfs_fiddler.recipe import (
+    Recipe,
+    Step,
+    load_recipe,
+    parse_recipe,
+    plan,
+    run_recipe,
+    run_step,
+)
+
+from .fiddle_test import CAIRNS_GTFS, DIST_UNIT, SUNDAY
+
+RECIPE_TOML = """
+[[steps]]
+operation = "earliest_departure"
+time = "05:00"
+filter = { route_types = [3] }
+
+[[steps]]
+operation = "min_speed"
+speed = 25
+"""
+
+RECIPE_YAML = """
+steps:
+  - operation: earliest_departure
+    time: "05:00"
+    filter:
+      route_types: [3]
+  - operation: min_speed
+    speed: 25
+"""
+
+EXPECTED = Recipe(
+    (
+        Step("earliest_departure", GtfsTime("05:00"), FiddleFilter(route_types=(3,))),
+        Step("min_speed", 25.0),
+    )
+)
+
+
+def test_load_recipe__toml(tmp_path):
+    path = tmp_path / "recipe.toml"
+    path.write_text(RECIPE_TOML)
+    assert load_recipe(path) == EXPECTED
+
+
+def test_load_recipe__yaml(tmp_path):
+    pytest.importorskip("yaml")
+    path = tmp_path / "recipe.yaml"
+    path.write_text(RECIPE_YAML)
+    assert load_recipe(path) == EXPECTED
+
+
+def test_parse_recipe__invalid():
+    with pytest.raises(ValueError):
+        parse_recipe({"steps": [{"operation": "unknown"}]})
+    with pytest.raises(ValueError):
+        parse_recipe({"steps": [{"operation": "min_speed"}]})
+    with pytest.raises(ValueError):
+        parse_recipe({"steps": [{"operation": "min_speed", "speed": 1, "x": 2}]})
+    with pytest.raises(ValueError):
+        parse_recipe(
+            {"steps": [{"operation": "min_speed", "speed": 1, "filter": {"x": [1]}}]}
+        )
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        [],
+        {"steps": [1]},
+        {"steps": {"operation": "min_speed"}},
+        {"steps": [{"operation": ["min_speed"], "speed": 1}]},
+        {"steps": [{"operation": "min_speed", "speed": None}]},
+        {"steps": [{"operation": "min_headway", "minutes": [5]}]},
+        {"steps": [{"operation": "min_speed", "speed": 1, "filter": [1]}]},
+        {"steps": [{"operation": "min_speed", "speed": 1, "filter": {"route_ids": 1}}]},
+        {
+            "steps": [
+                {"operation": "min_speed", "speed": 1, "filter": {"route_types": [{}]}}
+            ]
+        },
+        {"steps": [{"operation": "min_speed", "speed": 1, "filter": {"bbox": 1}}]},
+        {"steps": [{"operation": "min_speed", "speed": 1, "filter": {"radius": [1]}}]},
+        {"steps": [{"operation": "min_speed", "speed": 1, "filter": {"polygon": 1}}]},
+    ],
+)
+def test_parse_recipe__invalid_types(data):
+    with pytest.raises(ValueError):
+        parse_recipe(data)
+
+
+def test_plan():
+    routes = DataFrame(
+        {"route_id": ["a", "b", "c"], "route_short_name": "x", "route_type": [0, 3, 3]}
+    )
+    early = Step("earliest_departure", GtfsTime("05:00"))
+    tram = Step("min_speed", 20.0, FiddleFilter(route_types=(0,)))
+    bus = Step("min_speed", 25.0, FiddleFilter(route_types=(3,)))
+    route_c = Step("min_speed", 30.0, FiddleFilter(route_ids=("c",)))
+    batches = plan(Recipe((early, tram, bus, route_c)), routes)
+    # min speed first, tram and bus are merged (but c is also a bus route)
+    assert [(b.operation, b.steps) for b in batches] == [
+        ("min_speed", (tram, bus)),
+        ("min_speed", (route_c,)),
+        ("departures", (early,)),
+    ]
+
+
+def test_plan__departures():
+    routes = DataFrame(
+        {"route_id": ["a", "b", "c"], "route_short_name": "x", "route_type": [0, 3, 3]}
+    )
+    early_tram = Step("earliest_departure", GtfsTime("04:00"), FiddleFilter((0,)))
+    early_bus = Step("earliest_departure", GtfsTime("05:00"), FiddleFilter((3,)))
+    late = Step("latest_departure", GtfsTime("23:00"))
+    early = Step("earliest_departure", GtfsTime("03:00"))
+    interval = Step("max_trip_interval", 20)
+    batches = plan(
+        Recipe((early_tram, early_bus, late, early, interval, early_bus)), routes
+    )
+    # earliest departure for the same routes again starts a new batch
+    assert [(b.operation, b.steps) for b in batches] == [
+        ("departures", (early_tram, early_bus, late)),
+        ("departures", (early,)),
+        ("max_trip_interval", (interval,)),
+        ("departures", (early_bus,)),
+    ]
+
+
+def _sorted(df: DataFrame, keys: list[str]) -> DataFrame:
+    return df.sort_values(keys).reset_index(drop=True)
+
+
+def test_run_recipe__same_as_step_by_step():
+    recipe = Recipe(
+        (
+            Step("earliest_departure", GtfsTime("04:00")),
+            Step("min_speed", 30.0, FiddleFilter(route_short_names=("110", "111"))),
+            Step("latest_departure", GtfsTime("23:30"), FiddleFilter(route_types=(0,))),
+            Step("latest_departure", GtfsTime("25:00"), FiddleFilter(route_types=(3,))),
+            Step("max_trip_interval", 20),
+            Step("min_headway", 45, FiddleFilter(route_short_names=("111",))),
+            Step("min_speed", 25.0, FiddleFilter(route_short_names=("120",))),
+        )
+    )
+    expected = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    for step in recipe.steps:
+        run_step(expected, step)
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    run_recipe(fiddler, recipe)
+
+    assert len(fiddler.trips) > len(fiddler._base_feed.trips)
+    pd.testing.assert_frame_equal(
+        _sorted(expected.trips, ["trip_id"]), _sorted(fiddler.trips, ["trip_id"])
+    )
+    keys = ["trip_id", "stop_sequence"]
+    pd.testing.assert_frame_equal(
+        _sorted(expected.stop_times, keys), _sorted(fiddler.stop_times, keys)
+    )
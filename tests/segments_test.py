@@ -0,0 +1,90 @@
+import math
+
+import numpy as np
+import pandas as pd
+import shapely
+from pandas import DataFrame
+
+from gtfs_fiddler.fiddle import FiddleFilter, GtfsFiddler
+from gtfs_fiddler.gtfs_time import to_seconds
+from gtfs_fiddler.segments import SegmentSpeedIndex, StopArea, stop_ids_within
+
+from .fiddle_test import CAIRNS_GTFS, DIST_UNIT, SUNDAY
+
+NAN = math.nan
+
+
+def test_segment_speed_index__lookup():
+    index = SegmentSpeedIndex(
+        {("a", "b"): 10, ("b", "c"): 20},
+        [StopArea(["c", "d", "e"], 30), StopArea(["d", "e"], 40)],
+    )
+    assert len(index) == 4
+    stop_ids = np.array(["a", "b", "c", "d", "e", "x", "b", "a", "b"])
+    boundaries = np.array([0, 6, 9])
+    np.testing.assert_array_equal(
+        index.lookup(stop_ids, boundaries),
+        # later areas take precedence, unknown stops and the direction b -> a
+        # never match, the last stop of each trip has no segment
+        [10, 20, 30, 40, NAN, NAN, NAN, 10, NAN],
+    )
+
+
+def test_segment_speed_index__empty():
+    speeds = SegmentSpeedIndex().lookup(np.array(["a", "b"]), np.array([0, 2]))
+    assert np.isnan(speeds).all()
+
+
+def test_stop_ids_within():
+    stops = DataFrame(
+        {"stop_id": ["a", "b", "c"], "stop_lat": [0, 1, 5], "stop_lon": [0, 1, 5]}
+    )
+    assert stop_ids_within(stops, shapely.box(-0.5, -0.5, 2, 2)) == ["a", "b"]
+    # stops on the boundary are within, like for `FiddleFilter.area`
+    assert stop_ids_within(stops, shapely.box(0, 0, 1, 1)) == ["a", "b"]
+
+
+def _segments(st: DataFrame) -> DataFrame:
+    """
+    travel time from each stop to the next and the time spent at each stop
+    """
+    st = st.sort_values(["trip_id", "stop_sequence"]).reset_index(drop=True)
+    arrival = to_seconds(st.arrival_time)
+    departure = to_seconds(st.departure_time)
+    is_last = st.trip_id.ne(st.trip_id.shift(-1)).to_numpy()
+    return DataFrame(
+        {
+            "trip_id": st.trip_id,
+            "stop_sequence": st.stop_sequence,
+            "segment": list(zip(st.stop_id, st.stop_id.shift(-1).where(~is_last))),
+            "travel": np.where(is_last, NAN, np.roll(arrival, -1) - departure),
+            "stay": departure - arrival,
+        }
+    )
+
+
+def test_ensure_segment_min_speed__only_matching_segments():
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    before = _segments(fiddler.stop_times)
+    segment = before.segment[2]
+    fiddler.ensure_segment_min_speed({segment: 1000})
+    after = _segments(fiddler.stop_times)
+
+    matching = before.segment == segment
+    assert matching.sum() > 1
+    assert (after.travel[matching] < before.travel[matching]).all()
+    pd.testing.assert_series_equal(after.travel[~matching], before.travel[~matching])
+    pd.testing.assert_series_equal(after.stay, before.stay)
+
+
+def test_ensure_segment_min_speed__area_equals_route_speed():
+    route_id = "110-423"
+    expected = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    expected.ensure_min_speed(route_id2speed={route_id: 40})
+
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    all_stops = StopArea(fiddler.feed.stops.stop_id.tolist(), 40)
+    fiddler.ensure_segment_min_speed(
+        stop_areas=[all_stops], filter=FiddleFilter(route_ids=[route_id])
+    )
+    pd.testing.assert_frame_equal(fiddler.stop_times, expected.stop_times)
@@ -0,0 +1,202 @@
+import http.client
+import io
+import json
+import socket
+import threading
+import zipfile
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from gtfs_fiddler import feed_io, server
+from gtfs_fiddler.fiddle import GtfsFiddler
+from gtfs_fiddler.gtfs_time import GtfsTime
+from gtfs_fiddler.server import FeedStore, make_server
+
+from .fiddle_test import CAIRNS_GTFS, DIST_UNIT, SUNDAY
+
+JOB = {
+    "feed": "cairns",
+    "date": SUNDAY.isoformat(),
+    "steps": [
+        {"operation": "earliest_departure", "time": "04:00"},
+        {"operation": "max_trip_interval", "minutes": 10},
+    ],
+}
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path: str):
+        super().__init__("localhost")
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self._path)
+
+
+@pytest.fixture(scope="module")
+def store() -> FeedStore:
+    return FeedStore.load({"cairns": CAIRNS_GTFS}, DIST_UNIT)
+
+
+def _serve(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return thread
+
+
+def _request(conn, method: str, path: str, body=None) -> tuple[int, bytes]:
+    conn.request(method, path, body=None if body is None else json.dumps(body))
+    response = conn.getresponse()
+    return response.status, response.read()
+
+
+def _expected_trips() -> pd.DataFrame:
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    fiddler.ensure_earliest_departure(GtfsTime("04:00"))
+    fiddler.ensure_max_trip_interval(10)
+    return fiddler.trips
+
+
+def _trips_of_zip(data: bytes) -> pd.DataFrame:
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert "stop_times.txt" in zf.namelist()
+        with zf.open("trips.txt") as f:
+            return pd.read_csv(f, dtype=str)
+
+
+def test_fork(store: FeedStore):
+    warm = store.fiddler("cairns", SUNDAY)
+    trips = warm.trips
+    fork = warm.fork()
+    fork.ensure_max_trip_interval(10)
+    assert len(fork.trips) > len(trips)
+    assert warm.trips is trips
+    # the trip stats were shared and kept up to date for the fork
+    assert fork._trip_stats[0] is fork.trips
+    assert warm._trip_stats[0] is trips
+
+
+def test_server(store: FeedStore):
+    server = make_server(store, port=0)
+    _serve(server)
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+        assert _request(conn, "GET", "/feeds") == (200, b'["cairns"]')
+
+        # several jobs on the same connection get the same result
+        expected = _expected_trips()
+        for _ in range(2):
+            status, data = _request(conn, "POST", "/fiddle", JOB)
+            assert status == 200
+            trips = _trips_of_zip(data)
+            assert sorted(trips.trip_id) == sorted(expected.trip_id)
+
+        status, _ = _request(conn, "POST", "/fiddle", {**JOB, "feed": "other"})
+        assert status == 404
+        status, data = _request(conn, "POST", "/fiddle", {**JOB, "steps": [{}]})
+        assert status == 400
+        assert "operation" in json.loads(data)["error"]
+        status, _ = _request(conn, "POST", "/fiddle", {**JOB, "date": "tomorrow"})
+        assert status == 400
+        for job in [
+            {**JOB, "date": 123},
+            {**JOB, "steps": [1]},
+            {**JOB, "steps": "max_trip_interval"},
+            {**JOB, "feed": ["cairns"]},
+            [JOB],
+        ]:
+            status, data = _request(conn, "POST", "/fiddle", job)
+            assert status == 400
+            assert json.loads(data)["error"]
+        status, _ = _request(conn, "GET", "/nothing")
+        assert status == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_server__errors(store: FeedStore, monkeypatch):
+    def failing_run_recipe(fiddler, recipe):
+        raise KeyError("bug")
+
+    monkeypatch.setattr(server, "run_recipe", failing_run_recipe)
+    srv = make_server(store, port=0)
+    _serve(srv)
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", srv.server_address[1])
+        # internal errors are not the client's fault
+        status, data = _request(conn, "POST", "/fiddle", JOB)
+        assert status == 500
+        assert "bug" not in json.loads(data)["error"]
+
+        conn = http.client.HTTPConnection("127.0.0.1", srv.server_address[1])
+        conn.putrequest("POST", "/fiddle")
+        conn.putheader("Content-Length", "many")
+        conn.endheaders()
+        assert conn.getresponse().status == 400
+    finally:
+        srv.shutdown()
+        srv.server_close()
+
+
+def test_server__write_error(store: FeedStore, monkeypatch):
+    def failing_write_feed(feed, out):
+        out.write(b"PK")
+        raise OSError("disk on fire")
+
+    monkeypatch.setattr(feed_io, "write_feed", failing_write_feed)
+    server = make_server(store, port=0)
+    _serve(server)
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+        conn.request("POST", "/fiddle", body=json.dumps({**JOB, "steps": []}))
+        response = conn.getresponse()
+        assert response.status == 200
+        # the response is cut off, not completed with a broken zip
+        with pytest.raises(http.client.IncompleteRead):
+            response.read()
+        # and the server still handles requests
+        conn = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+        assert _request(conn, "GET", "/feeds") == (200, b'["cairns"]')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_server__unix_socket(store: FeedStore, tmp_path: Path):
+    path = str(tmp_path / "fiddle.sock")
+    server = make_server(store, unix_socket=path)
+    _serve(server)
+    try:
+        job = {**JOB, "steps": JOB["steps"][:1]}
+        status, data = _request(_UnixConnection(path), "POST", "/fiddle", job)
+        assert status == 200
+        trips = _trips_of_zip(data)
+        assert trips.trip_id.str.endswith("#early").sum() > 0
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_write_feed__unseekable(store: FeedStore, tmp_path: Path):
+    class Unseekable:
+        def __init__(self):
+            self.buf = io.BytesIO()
+
+        def write(self, b):
+            return self.buf.write(b)
+
+        def flush(self):
+            pass
+
+    out = Unseekable()
+    feed = store.feeds["cairns"]
+    feed_io.write_feed(feed, out)
+    feed_io.write_feed(feed, tmp_path / "feed.zip")
+    with zipfile.ZipFile(io.BytesIO(out.buf.getvalue())) as zf:
+        with zipfile.ZipFile(tmp_path / "feed.zip") as expected:
+            for name in expected.namelist():
+                assert zf.read(name) == expected.read(name)
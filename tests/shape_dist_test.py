@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+from gtfs_kit.feed import Feed
+from gtfs_kit.stop_times import append_dist_to_stop_times
+from pandas import DataFrame
+
+from gtfs_fiddler.fiddle import GtfsFiddler, compute_stop_time_stats
+from gtfs_fiddler.shape_dist import _Shape, compute_shape_dist_traveled, haversine
+
+from .fiddle_test import CAIRNS_GTFS, DIST_UNIT
+
+# ~111 m per 0.001 degree latitude
+LAT_STEP = 0.001
+LAT_STEP_M = haversine(0, 0, LAT_STEP, 0)
+
+
+def test_haversine():
+    # one degree of latitude is ~111.2 km
+    assert abs(haversine(0, 0, 1, 0) - 111_195) < 1
+    assert abs(haversine(48.2, 16.3, 48.2, 16.3)) < 1e-6
+
+
+def test_project__straight_line():
+    shape = _Shape(np.array([0, 10 * LAT_STEP]), np.array([0, 0]))
+    stops = shape.to_xy(
+        np.array([0, 2.5 * LAT_STEP, 10 * LAT_STEP]), np.array([0, 0.0001, 0])
+    )
+    np.testing.assert_allclose(
+        shape.project(stops), [0, 2.5 * LAT_STEP_M, 10 * LAT_STEP_M], rtol=1e-3
+    )
+
+
+def test_project__loop_is_monotonic():
+    # out and back on the same street: the stop in the middle is passed twice
+    lat = np.array([0, 10, 0]) * LAT_STEP
+    shape = _Shape(lat, np.zeros(3))
+    stops = shape.to_xy(np.array([0, 5, 10, 5, 0]) * LAT_STEP, np.zeros(5))
+    np.testing.assert_allclose(
+        shape.project(stops) / LAT_STEP_M, [0, 5, 10, 15, 20], rtol=1e-3
+    )
+
+
+def test_project__no_stops():
+    shape = _Shape(np.array([0, 10 * LAT_STEP]), np.array([0, 0]))
+    assert len(shape.project(np.zeros((0, 2)))) == 0
+
+
+def test_compute_shape_dist_traveled__unknown_stops():
+    shapes = DataFrame(
+        {
+            "shape_id": ["s", "s"],
+            "shape_pt_lat": [0, 10 * LAT_STEP],
+            "shape_pt_lon": [0.0, 0.0],
+            "shape_pt_sequence": [1, 2],
+        }
+    )
+    feed = Feed(
+        dist_units="km",
+        stops=DataFrame({"stop_id": ["a"], "stop_lat": [0.0], "stop_lon": [0.0]}),
+        shapes=shapes,
+        trips=DataFrame(
+            {"trip_id": ["t1"], "route_id": "r", "service_id": "x", "shape_id": "s"}
+        ),
+        stop_times=DataFrame(
+            {"trip_id": "t1", "stop_sequence": [1, 2], "stop_id": ["x", "y"]}
+        ),
+    )
+    st = compute_shape_dist_traveled(feed)
+    assert st.shape_dist_traveled.isna().all()
+
+
+def test_compute_shape_dist_traveled__per_pattern():
+    stops = DataFrame(
+        {
+            "stop_id": ["a", "b", "c"],
+            "stop_lat": [0, 5 * LAT_STEP, 10 * LAT_STEP],
+            "stop_lon": [0.0, 0.0, 0.0],
+        }
+    )
+    shapes = DataFrame(
+        {
+            "shape_id": ["s", "s"],
+            "shape_pt_lat": [0, 10 * LAT_STEP],
+            "shape_pt_lon": [0.0, 0.0],
+            "shape_pt_sequence": [1, 2],
+        }
+    )
+    trips = DataFrame(
+        {
+            "trip_id": ["t1", "t2", "t3"],
+            "route_id": "r",
+            "service_id": "x",
+            "shape_id": ["s", "s", np.nan],
+        }
+    )
+    stop_times = DataFrame(
+        {
+            "trip_id": ["t2", "t2", "t2", "t1", "t1", "t1", "t3", "t3"],
+            "stop_sequence": [3, 1, 2, 1, 2, 3, 1, 2],
+            "stop_id": ["c", "a", "b", "a", "b", "c", "a", "c"],
+        }
+    )
+    feed = Feed(
+        dist_units="km", stops=stops, shapes=shapes, trips=trips, stop_times=stop_times
+    )
+    cache = {}
+    st = compute_shape_dist_traveled(feed, cache)
+    assert list(st.trip_id) == ["t1"] * 3 + ["t2"] * 3 + ["t3"] * 2
+    # t3 has no shape, i.e. its distances are from stop to stop
+    expected = np.array([0, 5, 10, 0, 5, 10, 0, 10]) * LAT_STEP_M / 1000
+    np.testing.assert_allclose(st.shape_dist_traveled, expected, rtol=1e-3)
+    # t1 and t2 share the same pattern
+    assert len(cache) == 2
+
+
+def test_compute_stop_time_stats__without_shape_ids():
+    stops = DataFrame(
+        {
+            "stop_id": ["a", "b", "c", "d"],
+            "stop_lat": [0, 5 * LAT_STEP, 10 * LAT_STEP, np.nan],
+            "stop_lon": [0.0, 0.0, 0.0, np.nan],
+        }
+    )
+    trips = DataFrame(
+        {"trip_id": ["t1"], "route_id": "r", "service_id": "x", "direction_id": 0}
+    )
+    stop_times = DataFrame(
+        {
+            "trip_id": "t1",
+            "stop_sequence": [1, 2, 3, 4],
+            "stop_id": ["a", "b", "d", "c"],
+            "arrival_time": ["08:00:00", "08:01:00", np.nan, "08:02:00"],
+            "departure_time": ["08:00:00", "08:01:00", np.nan, "08:02:00"],
+        }
+    )
+    feed = Feed(dist_units="km", stops=stops, trips=trips, stop_times=stop_times)
+    st = compute_stop_time_stats(feed)
+    # the stop without coordinates is interpolated
+    expected = np.array([0, 5, 7.5, 10]) * LAT_STEP_M / 1000
+    np.testing.assert_allclose(st.shape_dist_traveled, expected, rtol=1e-3)
+
+
+def test_compute_shape_dist_traveled__close_to_gtfs_kit():
+    feed = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT).feed
+    cache = {}
+    st = compute_shape_dist_traveled(feed, cache)
+    assert len(cache) < feed.trips.trip_id.nunique()
+    assert not st.shape_dist_traveled.isna().any()
+
+    expected = append_dist_to_stop_times(feed).stop_times
+    expected = expected.sort_values(["trip_id", "stop_sequence"])
+    diff = (expected.shape_dist_traveled.values - st.shape_dist_traveled.values) / (
+        expected.shape_dist_traveled.values + 1
+    )
+    # gtfs_kit falls back to interpolating by time for some trips
+    # and uses UTM instead of haversine distances
+    assert pd.Series(np.abs(diff)).median() < 0.005
+
+    # cached patterns are reused
+    cached = compute_shape_dist_traveled(feed, cache)
+    pd.testing.assert_frame_equal(st, cached)
@@ -0,0 +1,74 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from gtfs_fiddler.fiddle import FiddleFilter, GtfsFiddler
+from gtfs_fiddler.gtfs_time import GtfsTime
+from gtfs_fiddler.recipe import Recipe, Step, run_recipe
+
+from .fiddle_test import CAIRNS_GTFS, DIST_UNIT, SUNDAY
+
+shared = pytest.importorskip("gtfs_fiddler.shared")
+
+
+def test_save_and_load_feed(tmp_path: Path):
+    feed = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT).feed
+    shared.save_feed(feed, tmp_path)
+    loaded = shared.load_feed(tmp_path)
+    assert loaded.dist_units == feed.dist_units
+    for table in ["agency", "routes", "trips", "stops", "stop_times", "shapes"]:
+        expected, actual = getattr(feed, table), getattr(loaded, table)
+        pd.testing.assert_frame_equal(actual, expected)
+        assert (actual.map(type) == expected.map(type)).all().all()
+    assert shared.load_feed(tmp_path, skip=["shapes"]).shapes is None
+
+
+def test_run_scenarios(tmp_path: Path):
+    base = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY).feed
+    shared.save_feed(base, tmp_path / "base")
+    scenarios = [
+        shared.Scenario(
+            "early", Recipe((Step("earliest_departure", GtfsTime("04:00")),))
+        ),
+        shared.Scenario(
+            "dense_110",
+            Recipe(
+                (
+                    Step(
+                        "max_trip_interval",
+                        10,
+                        FiddleFilter(route_short_names=("110",)),
+                    ),
+                )
+            ),
+        ),
+    ]
+    summaries = shared.run_scenarios(
+        tmp_path / "base", scenarios, tmp_path / "out", max_workers=2
+    )
+
+    for scenario in scenarios:
+        fiddler = GtfsFiddler.from_feed(base)
+        run_recipe(fiddler, scenario.recipe)
+        pd.testing.assert_frame_equal(summaries[scenario.name], fiddler.diff().summary)
+        assert (tmp_path / "out" / f"{scenario.name}.zip").exists()
+    # scenarios don't affect each other
+    assert summaries["early"].added.sum() > 0
+    assert summaries["dense_110"].added.sum() > 0
+    assert summaries["early"].added.sum() != summaries["dense_110"].added.sum()
+
+
+def test_run_scenario__base_feed_not_modified(tmp_path: Path):
+    shared.save_feed(GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY).feed, tmp_path)
+    base = shared._base_feed(tmp_path)
+    tables = {t: getattr(base, t) for t in ["trips", "stop_times"]}
+    copies = {t: df.copy() for t, df in tables.items()}
+    recipe = Recipe((Step("max_trip_interval", 10), Step("min_speed", 30.0)))
+    summary = shared.run_scenario(tmp_path, shared.Scenario("dense", recipe))
+    assert summary.added.sum() > 0
+    # loaded once per process and shared by its scenarios, but never modified
+    assert shared._base_feed(tmp_path) is base
+    for t, df in tables.items():
+        assert getattr(base, t) is df
+        pd.testing.assert_frame_equal(df, copies[t])
@@ -0,0 +1,156 @@
+import typing
+
+import numpy as np
+import pytest
+import shapely
+from pandas import DataFrame
+
+from gtfs_fiddler.fiddle import FiddleFilter, GtfsFiddler, filtered_route_ids
+from gtfs_fiddler.recipe import parse_step
+from gtfs_fiddler.shape_dist import haversine
+from gtfs_fiddler.spatial import BBox, Radius, StopIndex, contains
+
+from .fiddle_test import CAIRNS_GTFS, DIST_UNIT, SUNDAY
+
+CITY_CENTRE = BBox(145.76, -16.93, 145.78, -16.91)
+
+
+def _touching_route_ids(fiddler: GtfsFiddler, inside: np.ndarray) -> set[str]:
+    """
+    brute force: join the stops within the area with all stop times
+    """
+    stop_ids = fiddler.feed.stops.stop_id[inside]
+    st = fiddler.stop_times[fiddler.stop_times.stop_id.isin(stop_ids)]
+    trips = fiddler.trips[fiddler.trips.trip_id.isin(st.trip_id)]
+    return set(trips.route_id)
+
+
+@pytest.fixture(scope="module")
+def fiddler() -> GtfsFiddler:
+    return GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+
+
+@pytest.mark.parametrize(
+    "area",
+    [
+        CITY_CENTRE,
+        Radius(145.75, -16.92, 1500),
+        shapely.Polygon([(145.70, -16.95), (145.75, -16.90), (145.70, -16.85)]),
+        BBox(0, 0, 1, 1),
+    ],
+)
+def test_stop_index__same_as_brute_force(fiddler: GtfsFiddler, area):
+    stops = fiddler.feed.stops
+    lon, lat = stops.stop_lon.to_numpy(float), stops.stop_lat.to_numpy(float)
+    inside = contains(area, lon, lat)
+    index = fiddler.stop_index()
+    assert len(index) == len(stops)
+
+    assert sorted(index.stop_ids(area)) == sorted(stops.stop_id[inside])
+    assert index.route_ids(area) == _touching_route_ids(fiddler, inside)
+    # with a coarse and a fine grid
+    for cell_degrees in [1, 0.001]:
+        other = StopIndex(stops, fiddler.stop_times, fiddler.trips, cell_degrees)
+        assert sorted(other.trip_ids(area)) == sorted(index.trip_ids(area))
+
+
+def test_contains__radius():
+    # 0.0089° ~ 990m, 0.0091° ~ 1012m
+    lon = np.array([0.0, 0.0, 0.0091, -0.0089])
+    lat = np.array([0.0, 0.0089, 0.0, 0.0])
+    inside = contains(Radius(0, 0, 1000), lon, lat)
+    assert list(inside) == [True, True, False, True]
+    np.testing.assert_array_equal(inside, haversine(lat, lon, 0, 0) <= 1000)
+
+
+def test_filter_type_hints():
+    hints = typing.get_type_hints(FiddleFilter)
+    assert hints["area"] == BBox | Radius | shapely.Geometry | None
+
+
+def test_stop_index__empty():
+    stops = DataFrame({"stop_id": [], "stop_lon": [], "stop_lat": []})
+    st = DataFrame({"stop_id": [], "trip_id": []})
+    trips = DataFrame({"trip_id": [], "route_id": []})
+    index = StopIndex(stops, st, trips)
+    assert index.stop_ids(CITY_CENTRE) == []
+    assert index.route_ids(CITY_CENTRE) == set()
+
+
+def test_stop_index__from_stop_routes(fiddler: GtfsFiddler):
+    trip_route_ids = fiddler.trips.set_index("trip_id").route_id
+    stop_routes = DataFrame(
+        {
+            "stop_id": fiddler.stop_times.stop_id,
+            "route_id": fiddler.stop_times.trip_id.map(trip_route_ids),
+        }
+    ).drop_duplicates()
+    index = StopIndex.from_stop_routes(fiddler.feed.stops, stop_routes)
+    expected = fiddler.stop_index()
+    assert index.stop_ids(CITY_CENTRE) == expected.stop_ids(CITY_CENTRE)
+    assert index.route_ids(CITY_CENTRE) == expected.route_ids(CITY_CENTRE)
+
+
+def test_resolve_filter(fiddler: GtfsFiddler):
+    route_ids = fiddler.stop_index().route_ids(CITY_CENTRE)
+    assert 0 < len(route_ids) < len(fiddler.routes)
+    resolved = fiddler.resolve_filter(FiddleFilter(area=CITY_CENTRE))
+    assert resolved == FiddleFilter(route_ids=tuple(sorted(route_ids)))
+    some = sorted(route_ids)[:1] + ["not_in_area"]
+    resolved = fiddler.resolve_filter(FiddleFilter(route_ids=some, area=CITY_CENTRE))
+    assert resolved.route_ids == tuple(some[:1])
+
+    with pytest.raises(ValueError):
+        filtered_route_ids(fiddler.routes, FiddleFilter(area=CITY_CENTRE))
+
+
+def test_ensure_max_trip_interval__with_area():
+    by_area = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    by_area.ensure_max_trip_interval(10, FiddleFilter(area=CITY_CENTRE))
+    by_ids = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    route_ids = by_ids.stop_index().route_ids(CITY_CENTRE)
+    by_ids.ensure_max_trip_interval(10, FiddleFilter(route_ids=route_ids))
+
+    assert len(by_area.trips) > len(by_area._base_feed.trips)
+    assert sorted(by_area.trips.trip_id) == sorted(by_ids.trips.trip_id)
+    added = by_area.diff().summary
+    assert set(added[added.added > 0].route_id) <= route_ids
+
+
+def test_parse_step__area():
+    step = parse_step(
+        {
+            "operation": "max_trip_interval",
+            "minutes": 10,
+            "filter": {"route_types": [3], "bbox": [145.76, -16.93, 145.78, -16.91]},
+        }
+    )
+    assert step.filter == FiddleFilter(route_types=(3,), area=CITY_CENTRE)
+    step = parse_step(
+        {
+            "operation": "min_speed",
+            "speed": 30,
+            "filter": {"radius": {"lon": 145.75, "lat": -16.92, "meters": 500}},
+        }
+    )
+    assert step.filter.area == Radius(145.75, -16.92, 500)
+    step = parse_step(
+        {
+            "operation": "min_speed",
+            "speed": 30,
+            "filter": {"polygon": [[0, 0], [1, 0], [1, 1]]},
+        }
+    )
+    assert step.filter.area.equals(shapely.Polygon([(0, 0), (1, 0), (1, 1)]))
+    with pytest.raises(ValueError):
+        parse_step(
+            {
+                "operation": "min_speed",
+                "speed": 30,
+                "filter": {"bbox": [0, 0, 1, 1], "polygon": [[0, 0], [1, 0], [1, 1]]},
+            }
+        )
+    with pytest.raises(ValueError):
+        parse_step(
+            {"operation": "min_speed", "speed": 30, "filter": {"bbox": [0, 0, 1]}}
+        )
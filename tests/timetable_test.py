@@ -0,0 +1,117 @@
+import math
+
+import numpy as np
+from pandas import DataFrame
+
+from gtfs_fiddler.fiddle import FiddleFilter, GtfsFiddler
+from gtfs_fiddler.gtfs_time import GtfsTime, to_seconds
+from gtfs_fiddler.timetable import Departure, TimetableIndex
+
+from .fiddle_test import CAIRNS_GTFS, DIST_UNIT, SUNDAY
+
+
+def test_next_departures():
+    trips = DataFrame({"trip_id": ["t1", "t2", "t3"], "route_id": ["r1", "r1", "r2"]})
+    stop_times = DataFrame(
+        {
+            "trip_id": ["t1", "t1", "t1", "t2", "t2", "t3", "t3"],
+            "stop_sequence": [1, 2, 3, 1, 2, 1, 2],
+            "stop_id": ["a", "b", "c", "a", "c", "b", "a"],
+            "arrival_time": [
+                "08:00:00",
+                "08:05:00",
+                "08:10:00",
+                "07:00:00",
+                "07:10:00",
+                "07:30:00",
+                "07:40:00",
+            ],
+            "departure_time": [
+                "08:00:00",
+                math.nan,
+                "08:10:00",
+                "07:00:00",
+                "07:10:00",
+                "07:30:00",
+                "07:40:00",
+            ],
+            "pickup_type": [0, 0, 0, 1, 0, 0, 0],
+        }
+    )
+    index = TimetableIndex(stop_times, trips)
+    # neither the last stops nor t2 at a (no pickup)
+    assert len(index) == 3
+    assert index.next_departures("a", "06:00") == [
+        Departure(GtfsTime("08:00"), "t1", "r1")
+    ]
+    # arrival time instead of missing departure time
+    assert index.next_departures("b", GtfsTime("07:30")) == [
+        Departure(GtfsTime("07:30"), "t3", "r2"),
+        Departure(GtfsTime("08:05"), "t1", "r1"),
+    ]
+    assert index.next_departures("b", 7 * 3600, n=1) == [
+        Departure(GtfsTime("07:30"), "t3", "r2")
+    ]
+    assert index.next_departures("b", "07:00", route_id="r1") == [
+        Departure(GtfsTime("08:05"), "t1", "r1")
+    ]
+    assert index.next_departures("b", "08:06") == []
+    assert index.next_departures("c", "00:00") == []
+    assert index.next_departures("x", "00:00") == []
+    assert index.next_departures("b", "00:00", route_id="x") == []
+
+
+def test_next_departures__trips_without_route():
+    trips = DataFrame({"trip_id": ["t1", "t2"], "route_id": ["r1", math.nan]})
+    stop_times = DataFrame(
+        {
+            "trip_id": ["t1", "t1", "t2", "t2"],
+            "stop_sequence": [1, 2, 1, 2],
+            "stop_id": ["a", "b", "b", "a"],
+            "arrival_time": ["08:00:00", "08:10:00", "07:00:00", "07:10:00"],
+            "departure_time": ["08:00:00", "08:10:00", "07:00:00", "07:10:00"],
+        }
+    )
+    index = TimetableIndex(stop_times, trips)
+    assert len(index) == 1
+    assert index.next_departures("a", "00:00", route_id="r1") == [
+        Departure(GtfsTime("08:00"), "t1", "r1")
+    ]
+    assert index.next_departures("b", "00:00") == []
+    assert index.next_departures("b", "00:00", route_id="r1") == []
+
+
+def test_fiddler_next_departures():
+    fiddler = GtfsFiddler(CAIRNS_GTFS, DIST_UNIT, SUNDAY)
+    index = fiddler.timetable_index()
+    assert fiddler.timetable_index() is index
+    fiddler.ensure_max_trip_interval(10, FiddleFilter(route_short_names=("110",)))
+    assert fiddler.timetable_index() is not index
+
+    st = fiddler.stop_times.join(
+        fiddler.trips.set_index("trip_id").route_id, on="trip_id"
+    )
+    departure = to_seconds(st.departure_time)
+    departure = np.where(np.isnan(departure), to_seconds(st.arrival_time), departure)
+    st = st.assign(departure=departure)
+    last = st.groupby("trip_id").stop_sequence.transform("max")
+    st = st[(st.stop_sequence != last).to_numpy() & ~np.isnan(departure)]
+    for (stop_id, route_id), group in list(st.groupby(["stop_id", "route_id"]))[:30]:
+        after = group.departure.median()
+        expected = np.sort(group.departure[group.departure >= after])[:4]
+        for departures in [
+            fiddler.next_departures(stop_id, int(after), 4, route_id),
+            fiddler.next_departures(stop_id, int(after), 100),
+        ]:
+            times = [d.time.seconds_of_day for d in departures]
+            assert times == sorted(times)
+            assert all(t >= after for t in times)
+        departures = fiddler.next_departures(stop_id, int(after), 4, route_id)
+        assert [d.time.seconds_of_day for d in departures] == list(expected)
+        assert {d.route_id for d in departures} == {route_id}
+        trip_ids = set(group.trip_id[group.departure.isin(expected)])
+        assert {d.trip_id for d in departures} <= trip_ids
+    # the added trips depart too
+    densified = st[st.trip_id.str.contains("#densify")].iloc[0]
+    departures = fiddler.next_departures(densified.stop_id, "00:00", len(st))
+    assert densified.trip_id in {d.trip_id for d in departures}